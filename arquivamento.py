@@ -0,0 +1,260 @@
+# arquivamento.py - Arquivamento do histórico em bancos separados por período letivo
+#
+# Períodos encerrados saem da tabela historico do banco principal e vão para
+# um arquivo SQLite próprio (ex.: chromebooks-arquivo/historico-2025-1.db),
+# mantendo os ids originais. As consultas ao histórico anexam (ATTACH) esses
+# arquivos só quando o intervalo pedido chega até eles.
+#
+#   python arquivamento.py listar
+#   python arquivamento.py arquivar [periodo]     (sem período: todos os encerrados)
+#   python arquivamento.py verificar [periodo]    (também cria o índice de busca que faltar)
+import os
+import sqlite3
+from datetime import datetime
+import busca
+
+# Tamanho do período letivo em meses (6 = semestres: 2025-1, 2025-2)
+MESES_POR_PERIODO = int(os.environ.get('CHROMEBOOKS_MESES_POR_PERIODO', 6))
+
+# Mesma expressão de database.SQL_DATA_EVENTO (e dos índices por data do evento)
+SQL_DATA_EVENTO = 'COALESCE(data_devolucao, data_emprestimo)'
+COLUNAS = 'id, chromebook_numero, carrinho, aluno, turma, professor, data_emprestimo, data_devolucao, tipo_acao'
+
+
+def periodo_de(data):
+    """Período ('aaaa-n') de uma data ISO."""
+    ano, mes = int(str(data)[:4]), int(str(data)[5:7])
+    return f"{ano}-{(mes - 1) // MESES_POR_PERIODO + 1}"
+
+
+def limites_periodo(periodo):
+    """(inicio, fim) do período como texto ISO; o fim é exclusivo (início do próximo)."""
+    ano, numero = (int(parte) for parte in periodo.split('-'))
+    mes_inicio = (numero - 1) * MESES_POR_PERIODO + 1
+    if not 1 <= mes_inicio <= 12:
+        raise ValueError(f"Período inválido: {periodo}")
+    mes_fim = mes_inicio + MESES_POR_PERIODO
+    ano_fim, mes_fim = (ano + 1, mes_fim - 12) if mes_fim > 12 else (ano, mes_fim)
+    return f"{ano:04d}-{mes_inicio:02d}-01 00:00:00", f"{ano_fim:04d}-{mes_fim:02d}-01 00:00:00"
+
+
+def pasta_arquivos(db_name):
+    return os.path.splitext(db_name)[0] + '-arquivo'
+
+
+def caminho_arquivo(db_name, periodo):
+    return os.path.join(pasta_arquivos(db_name), f"historico-{periodo}.db")
+
+
+def arquivos_registrados(conn):
+    """[(periodo, arquivo, inicio, fim, registros)] do mais recente para o mais antigo."""
+    return conn.execute(
+        "SELECT periodo, arquivo, inicio, fim, registros FROM arquivos_historico ORDER BY inicio DESC"
+    ).fetchall()
+
+
+def arquivos_no_intervalo(conn, data_inicio=None, data_fim=None):
+    """Arquivos cujo período cruza [data_inicio, data_fim] (limites vazios = sem limite)."""
+    return no_intervalo(arquivos_registrados(conn), data_inicio, data_fim)
+
+
+def no_intervalo(arquivos, data_inicio=None, data_fim=None):
+    """Filtra linhas de ``arquivos_registrados`` já lidas (ex.: de um cache)."""
+    return [arquivo for arquivo in arquivos
+            if (not data_inicio or arquivo[3] > data_inicio) and (not data_fim or arquivo[2] <= data_fim)]
+
+
+def anexar(conn, arquivo, nome='arq'):
+    """ATTACH de um arquivo de histórico (precisa ser feito fora de transação)."""
+    conn.execute("ATTACH DATABASE ? AS " + nome, (arquivo,))
+
+
+def desanexar(conn, nome='arq'):
+    try:
+        conn.execute("DETACH DATABASE " + nome)
+    except sqlite3.Error:
+        pass
+
+
+def periodos_encerrados(conn, hoje=None):
+    """Períodos com registros no banco principal que terminaram antes do período atual."""
+    inicio_atual = limites_periodo(periodo_de(hoje or datetime.now().isoformat(sep=' ')))[0]
+    datas = conn.execute(
+        f"SELECT DISTINCT substr({SQL_DATA_EVENTO}, 1, 7) FROM historico WHERE {SQL_DATA_EVENTO} < ?",
+        (inicio_atual,)
+    ).fetchall()
+    return sorted({periodo_de(data + '-01') for (data,) in datas if data})
+
+
+def arquivar_periodo(db_name, periodo, hoje=None):
+    """Move o histórico do período para o arquivo dele. Retorna quantos registros foram movidos.
+
+    São duas transações: a cópia (commit durável no arquivo) e depois a remoção
+    do banco principal, só dos ids que já estão no arquivo. Com os ids originais
+    preservados (INSERT OR IGNORE), repetir após uma falha no meio não perde
+    nem duplica nada.
+    """
+    inicio, fim = limites_periodo(periodo)
+    if fim > limites_periodo(periodo_de(hoje or datetime.now().isoformat(sep=' ')))[0]:
+        raise ValueError(f"O período {periodo} ainda não foi encerrado")
+
+    arquivo = caminho_arquivo(db_name, periodo)
+    os.makedirs(os.path.dirname(arquivo), exist_ok=True)
+    destino = sqlite3.connect(arquivo)
+    try:
+        # o arquivo quase não muda depois de criado: sem -wal/-shm ao lado
+        destino.execute("PRAGMA journal_mode=DELETE")
+        destino.execute('''
+            CREATE TABLE IF NOT EXISTS historico (
+                id INTEGER PRIMARY KEY,
+                chromebook_numero INTEGER,
+                carrinho TEXT,
+                aluno TEXT,
+                turma TEXT,
+                professor TEXT,
+                data_emprestimo TEXT,
+                data_devolucao TEXT,
+                tipo_acao TEXT
+            )
+        ''')
+        for coluna in ('chromebook_numero', 'carrinho', 'aluno', 'turma', 'professor', 'tipo_acao'):
+            destino.execute(f"CREATE INDEX IF NOT EXISTS idx_historico_{coluna} ON historico ({coluna}, id)")
+        destino.execute(f"CREATE INDEX IF NOT EXISTS idx_historico_data_evento ON historico ({SQL_DATA_EVENTO}, id)")
+        # busca textual: os triggers indexam as linhas conforme a cópia as insere
+        busca.criar_indice_historico(destino.cursor())
+        destino.commit()
+    finally:
+        destino.close()
+
+    conn = sqlite3.connect(db_name, timeout=30)
+    try:
+        conn.execute("PRAGMA busy_timeout=30000")
+        anexar(conn, arquivo)
+        conn.execute("PRAGMA arq.synchronous=FULL")
+        condicao = f"{SQL_DATA_EVENTO} >= ? AND {SQL_DATA_EVENTO} < ?"
+
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(f"INSERT OR IGNORE INTO arq.historico ({COLUNAS}) SELECT {COLUNAS} FROM main.historico WHERE {condicao}",
+                     (inicio, fim))
+        conn.commit()
+
+        conn.execute("BEGIN IMMEDIATE")
+        movidos = conn.execute(f"DELETE FROM main.historico WHERE {condicao} AND id IN (SELECT id FROM arq.historico)",
+                               (inicio, fim)).rowcount
+        total = conn.execute("SELECT COUNT(*) FROM arq.historico").fetchone()[0]
+        conn.execute(
+            "INSERT INTO arquivos_historico (periodo, arquivo, inicio, fim, registros, arquivado_em) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (periodo) DO UPDATE SET registros = excluded.registros, arquivado_em = excluded.arquivado_em",
+            (periodo, os.path.relpath(arquivo, os.path.dirname(os.path.abspath(db_name))), inicio, fim, total,
+             datetime.now().isoformat(sep=' ', timespec='seconds'))
+        )
+        conn.commit()
+        return movidos
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        desanexar(conn)
+        conn.close()
+
+
+def verificar_arquivo(db_name, periodo, indexar=False):
+    """Confere integridade e contagem do arquivo e se nada do período ficou no banco principal.
+
+    Com ``indexar=True``, cria o índice de busca (historico_busca) se o arquivo
+    ainda não tiver (arquivos de antes da busca textual): as consultas não
+    escrevem nos arquivos, só usam LIKE enquanto o índice falta.
+    """
+    conn = sqlite3.connect(db_name, timeout=30)
+    try:
+        registro = conn.execute("SELECT arquivo, inicio, fim, registros FROM arquivos_historico WHERE periodo = ?",
+                                (periodo,)).fetchone()
+        if registro is None:
+            return {'periodo': periodo, 'ok': False, 'erros': ['Período não arquivado']}
+        arquivo, inicio, fim, registros = registro
+        erros = []
+        caminho = resolver_caminho(db_name, arquivo)
+        if not os.path.exists(caminho):
+            return {'periodo': periodo, 'ok': False, 'erros': [f'Arquivo não encontrado: {caminho}']}
+        anexar(conn, caminho)
+        integridade = conn.execute("PRAGMA arq.integrity_check").fetchone()[0]
+        if integridade != 'ok':
+            erros.append(f'integrity_check: {integridade}')
+        indice_criado = False
+        if indexar and not erros and not busca.tem_indice(conn, 'arq'):
+            conn.execute("BEGIN")  # só o arquivo é escrito
+            try:
+                indice_criado = busca.criar_indice_historico(conn.cursor(), 'arq')
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        total, fora = conn.execute(
+            f"SELECT COUNT(*), COALESCE(SUM({SQL_DATA_EVENTO} < ? OR {SQL_DATA_EVENTO} >= ?), 0) FROM arq.historico",
+            (inicio, fim)
+        ).fetchone()
+        if total != registros:
+            erros.append(f'{total} registros no arquivo, {registros} registrados')
+        if fora:
+            erros.append(f'{fora} registros fora do período')
+        no_principal = conn.execute(
+            f"SELECT COUNT(*) FROM main.historico WHERE {SQL_DATA_EVENTO} >= ? AND {SQL_DATA_EVENTO} < ?", (inicio, fim)
+        ).fetchone()[0]
+        if no_principal:
+            erros.append(f'{no_principal} registros do período ainda no banco principal')
+        desanexar(conn)
+        return {'periodo': periodo, 'ok': not erros, 'registros': total, 'erros': erros,
+                'indice_criado': indice_criado}
+    finally:
+        conn.close()
+
+
+def resolver_caminho(db_name, arquivo):
+    """Caminhos de arquivo são guardados relativos à pasta do banco principal."""
+    return arquivo if os.path.isabs(arquivo) else os.path.join(os.path.dirname(os.path.abspath(db_name)), arquivo)
+
+
+if __name__ == '__main__':
+    import sys
+    from database import Database
+
+    db = Database()
+    db.criar_tabelas()
+    comando = sys.argv[1] if len(sys.argv) > 1 else 'listar'
+    periodos = sys.argv[2:]
+
+    if comando == 'listar':
+        with db.conexao() as conn:
+            for periodo, arquivo, inicio, fim, registros in arquivos_registrados(conn):
+                print(f"{periodo}: {registros} registros em {arquivo} ({inicio[:10]} a {fim[:10]})")
+            pendentes = periodos_encerrados(conn)
+        print(f"Períodos encerrados ainda no banco principal: {', '.join(pendentes) or 'nenhum'}")
+    elif comando == 'arquivar':
+        if not periodos:
+            with db.conexao() as conn:
+                periodos = periodos_encerrados(conn)
+        for periodo in periodos:
+            try:
+                movidos = db.arquivar_periodo(periodo)
+            except ValueError as e:
+                print(f"❌ {e}")
+                sys.exit(1)
+            resultado = verificar_arquivo(db.db_name, periodo, indexar=True)
+            estado = '✅' if resultado['ok'] else '❌ ' + '; '.join(resultado['erros'])
+            print(f"{periodo}: {movidos} registros arquivados {estado}")
+        if not periodos:
+            print("✅ Nenhum período encerrado para arquivar")
+    elif comando == 'verificar':
+        if not periodos:
+            with db.conexao() as conn:
+                periodos = [linha[0] for linha in arquivos_registrados(conn)]
+        falhou = False
+        for periodo in periodos:
+            resultado = verificar_arquivo(db.db_name, periodo, indexar=True)
+            falhou = falhou or not resultado['ok']
+            indice = ' (índice de busca criado)' if resultado.get('indice_criado') else ''
+            print(f"{periodo}: {'✅ ok' if resultado['ok'] else '❌ ' + '; '.join(resultado['erros'])}{indice}")
+        sys.exit(1 if falhou else 0)
+    else:
+        print("Uso: python arquivamento.py [listar|arquivar|verificar] [periodo...]")
+        sys.exit(2)
@@ -0,0 +1,239 @@
+# atrasos.py - Detecção de empréstimos atrasados
+#
+# Cada regra de prazo (padrão, por carrinho ou por turma) vira um "corte":
+# um empréstimo iniciado antes do corte está atrasado. Como o corte só anda
+# para frente, os recém-atrasados entre duas varreduras são os empréstimos
+# com data_emprestimo entre o corte anterior e o atual, uma faixa lida pelo
+# índice parcial dos empréstimos ativos (idx_chromebooks_emprestados_data),
+# sem varrer a tabela.
+#
+#   CHROMEBOOKS_PRAZO_HORA_LIMITE=17:00   devolução até esse horário do dia ('' = sem limite)
+#   CHROMEBOOKS_PRAZO_MINUTOS=            duração máxima padrão ('' = sem limite)
+#   CHROMEBOOKS_ATRASOS_INTERVALO_S=60    intervalo da varredura (0 desliga)
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+
+log = logging.getLogger('chromebooks.atrasos')
+
+ALVOS = ('carrinho', 'turma')
+SQL_EMPRESTADOS_FAIXA = '''
+    SELECT numero, carrinho, aluno_emprestado, turma_aluno, professor_emprestimo, data_emprestimo
+    FROM chromebooks
+    WHERE status = 'Emprestado' AND data_emprestimo >= ? AND data_emprestimo < ?
+    ORDER BY data_emprestimo
+'''
+SQL_REGISTRAR_ATRASO = '''
+    INSERT OR IGNORE INTO atrasos (chromebook_numero, carrinho, aluno, turma, professor, data_emprestimo, prazo, detectado_em)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+_lock = threading.Lock()
+_agendadores = {}
+
+
+def _texto(data):
+    return data.isoformat(sep=' ', timespec='seconds')
+
+
+def _hora_minuto(texto):
+    hora, minuto = (int(parte) for parte in texto.split(':'))
+    if not (0 <= hora < 24 and 0 <= minuto < 60):
+        raise ValueError(f"Horário inválido: {texto}")
+    return hora, minuto
+
+
+class Prazo:
+    """Janela de empréstimo: duração máxima (minutos) e/ou horário limite do dia; vale a que vencer antes."""
+
+    def __init__(self, minutos=None, hora_limite=None, alvo=None, nome=None):
+        self.minutos = int(minutos) if minutos not in (None, '') else None
+        self.hora_limite = _hora_minuto(hora_limite) if hora_limite else None
+        self.alvo = alvo
+        self.nome = nome
+
+    def corte(self, agora):
+        """Empréstimos iniciados antes deste instante (texto ISO) estão atrasados (None: nunca atrasam)."""
+        cortes = []
+        if self.minutos is not None:
+            cortes.append(agora - timedelta(minutes=self.minutos))
+        if self.hora_limite is not None:
+            limite = agora.replace(hour=self.hora_limite[0], minute=self.hora_limite[1], second=0, microsecond=0)
+            cortes.append(limite if agora >= limite else limite - timedelta(days=1))
+        return _texto(max(cortes)) if cortes else None
+
+    def vencimento(self, data_emprestimo):
+        """Data/hora (texto ISO) em que o empréstimo passa a estar atrasado."""
+        inicio = datetime.fromisoformat(data_emprestimo)
+        vencimentos = []
+        if self.minutos is not None:
+            vencimentos.append(inicio + timedelta(minutes=self.minutos))
+        if self.hora_limite is not None:
+            limite = inicio.replace(hour=self.hora_limite[0], minute=self.hora_limite[1], second=0, microsecond=0)
+            vencimentos.append(limite if limite > inicio else limite + timedelta(days=1))
+        return _texto(min(vencimentos)) if vencimentos else None
+
+    def descricao(self):
+        partes = []
+        if self.minutos is not None:
+            partes.append(f"{self.minutos} min")
+        if self.hora_limite is not None:
+            partes.append("até %02d:%02d" % self.hora_limite)
+        return ' ou '.join(partes) or 'sem prazo'
+
+    def como_dict(self):
+        return {'alvo': self.alvo, 'nome': self.nome, 'minutos': self.minutos,
+                'hora_limite': "%02d:%02d" % self.hora_limite if self.hora_limite else None,
+                'descricao': self.descricao()}
+
+
+def prazo_padrao():
+    return Prazo(os.environ.get('CHROMEBOOKS_PRAZO_MINUTOS') or None,
+                 os.environ.get('CHROMEBOOKS_PRAZO_HORA_LIMITE', '17:00') or None)
+
+
+class Regras:
+    """Prazo padrão mais os de prazos_emprestimo (turma tem precedência sobre carrinho)."""
+
+    def __init__(self, linhas=(), padrao=None):
+        self.padrao = padrao or prazo_padrao()
+        self.por_alvo = {alvo: {} for alvo in ALVOS}
+        for alvo, nome, minutos, hora_limite in linhas:
+            self.por_alvo[alvo][nome] = Prazo(minutos, hora_limite, alvo, nome)
+        self.assinatura = (tuple(sorted(linhas)), self.padrao.descricao())
+
+    def prazo(self, carrinho, turma):
+        return self.por_alvo['turma'].get(turma) or self.por_alvo['carrinho'].get(carrinho) or self.padrao
+
+    def todos(self):
+        return [self.padrao, *self.por_alvo['turma'].values(), *self.por_alvo['carrinho'].values()]
+
+    def faixa(self, agora, desde=None):
+        """(início, fim) de data_emprestimo que cobre os atrasos novos entre ``desde`` e ``agora``."""
+        fins = [corte for corte in (prazo.corte(agora) for prazo in self.todos()) if corte]
+        if not fins:
+            return None
+        inicios = [prazo.corte(desde) for prazo in self.todos()] if desde else []
+        return (min((inicio for inicio in inicios if inicio), default=''), max(fins))
+
+
+def carregar_regras(conn):
+    linhas = conn.execute("SELECT alvo, nome, minutos, hora_limite FROM prazos_emprestimo").fetchall()
+    return Regras([tuple(linha) for linha in linhas])
+
+
+def em_atraso(conn, regras, agora=None, desde=None):
+    """Empréstimos atrasados em ``agora`` (só os que atrasaram depois de ``desde``, se informado).
+
+    Lê do índice só a faixa de datas entre os cortes e aplica a regra de cada linha.
+    """
+    agora = agora or datetime.now()
+    faixa = regras.faixa(agora, desde)
+    if faixa is None:
+        return []
+    cortes = {id(prazo): (prazo.corte(agora), prazo.corte(desde) if desde else None) for prazo in regras.todos()}
+    atrasados = []
+    for numero, carrinho, aluno, turma, professor, data_emprestimo in conn.execute(SQL_EMPRESTADOS_FAIXA, faixa):
+        prazo = regras.prazo(carrinho, turma)
+        corte, corte_anterior = cortes[id(prazo)]
+        if corte is None or data_emprestimo >= corte:
+            continue
+        if corte_anterior is not None and data_emprestimo < corte_anterior:
+            continue  # já estava atrasado na varredura anterior
+        vencimento = prazo.vencimento(data_emprestimo)
+        atrasados.append({
+            'numero': numero, 'carrinho': carrinho, 'aluno': aluno, 'turma': turma, 'professor': professor,
+            'data_emprestimo': data_emprestimo, 'prazo': vencimento,
+            'minutos_atraso': int((agora - datetime.fromisoformat(vencimento)).total_seconds() // 60),
+        })
+    return atrasados
+
+
+class AgendadorAtrasos:
+    """Varredura periódica: registra em ``atrasos`` (uma vez por empréstimo) e publica os recém-atrasados.
+
+    Na primeira varredura (ou quando as regras mudam) considera todos os
+    atrasados; depois só a faixa nova. Vários processos podem varrer o mesmo
+    banco: o INSERT OR IGNORE deixa um registro por empréstimo e só quem
+    registrou publica o evento.
+    """
+
+    def __init__(self, db, intervalo=60.0):
+        self.db = db
+        self.intervalo = intervalo
+        self.varreduras = 0
+        self.detectados = 0
+        self.falhas = 0
+        self.ultima_varredura = None
+        self._desde = None
+        self._assinatura = None
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._executar, name='atrasos', daemon=True)
+
+    def iniciar(self):
+        self._thread.start()
+
+    def parar(self):
+        self._parar.set()
+
+    def varrer(self, agora=None):
+        """Uma varredura; retorna os empréstimos registrados como atrasados agora."""
+        agora = agora or datetime.now()
+        with self.db.conexao() as conn:
+            regras = carregar_regras(conn)
+            desde = self._desde if regras.assinatura == self._assinatura else None
+            novos = em_atraso(conn, regras, agora, desde)
+        registrados = []
+        if novos:
+            detectado_em = _texto(agora)
+
+            def registrar(cursor):
+                for item in novos:
+                    cursor.execute(SQL_REGISTRAR_ATRASO, (
+                        item['numero'], item['carrinho'], item['aluno'], item['turma'], item['professor'],
+                        item['data_emprestimo'], item['prazo'], detectado_em))
+                    if cursor.rowcount == 1:
+                        registrados.append(item)
+
+            self.db.transacao_imediata(registrar)
+        self._desde, self._assinatura = agora, regras.assinatura
+        self.varreduras += 1
+        self.detectados += len(registrados)
+        self.ultima_varredura = _texto(agora)
+        if registrados:
+            log.info("Empréstimos atrasados", extra={'novos': len(registrados)})
+            self.db.eventos.publicar('atraso', {'itens': registrados})
+        return registrados
+
+    def _executar(self):
+        while not self._parar.is_set():
+            try:
+                self.varrer()
+            except Exception:
+                self.falhas += 1
+                log.exception("Falha na varredura de atrasos")
+            self._parar.wait(self.intervalo)
+
+    def estatisticas(self):
+        return {'intervalo_s': self.intervalo, 'varreduras': self.varreduras, 'detectados': self.detectados,
+                'falhas': self.falhas, 'ultima_varredura': self.ultima_varredura}
+
+
+def agendar(db, intervalo_s=None):
+    """Sobe (uma vez por banco) a varredura periódica. CHROMEBOOKS_ATRASOS_INTERVALO_S=0 desliga."""
+    if intervalo_s is None:
+        intervalo_s = float(os.environ.get('CHROMEBOOKS_ATRASOS_INTERVALO_S', 60))
+    if intervalo_s <= 0:
+        return None
+    chave = os.path.abspath(db.db_name)
+    with _lock:
+        if chave not in _agendadores:
+            _agendadores[chave] = AgendadorAtrasos(db, intervalo_s)
+            _agendadores[chave].iniciar()
+        return _agendadores[chave]
+
+
+def agendador(db_name):
+    """Agendador já ativo para o banco (ou None)."""
+    return _agendadores.get(os.path.abspath(db_name))
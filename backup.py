@@ -0,0 +1,266 @@
+# backup.py - Backups online do banco com a API de backup do SQLite
+#
+# A cópia é feita em passos de poucas páginas com uma pausa entre eles, então
+# roda com o app no ar sem segurar as transações de empréstimo (em WAL o
+# backup só precisa de um lock de leitura por passo). Cada cópia é gravada num
+# arquivo temporário, conferida com PRAGMA integrity_check e só então entra na
+# rotação (chromebooks-backups/chromebooks-AAAAMMDD-HHMMSS.db).
+#
+#   python backup.py listar
+#   python backup.py fazer
+#   python backup.py verificar [arquivo...]      (sem arquivo: todos)
+#   python backup.py restaurar <arquivo>
+import glob
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+PAGINAS_POR_PASSO = int(os.environ.get('CHROMEBOOKS_BACKUP_PAGINAS', 256))
+PAUSA_ENTRE_PASSOS = float(os.environ.get('CHROMEBOOKS_BACKUP_PAUSA_MS', 50)) / 1000
+MANTER = int(os.environ.get('CHROMEBOOKS_BACKUP_MANTER', 14))
+# Se o banco muda a cada passo, a cópia incremental recomeça sem fim; depois
+# de tantas tentativas copia tudo num passo só (ainda só com lock de leitura).
+REINICIOS_MAXIMOS = 5
+
+log = logging.getLogger('chromebooks.backup')
+
+_lock = threading.Lock()
+_agendadores = {}
+
+
+class BackupReiniciado(Exception):
+    pass
+
+
+def pasta_backups(db_name):
+    return os.environ.get('CHROMEBOOKS_BACKUP_PASTA') or os.path.splitext(db_name)[0] + '-backups'
+
+
+def backups_existentes(db_name):
+    """Caminhos dos backups, do mais recente para o mais antigo."""
+    prefixo = os.path.splitext(os.path.basename(db_name))[0]
+    return sorted(glob.glob(os.path.join(pasta_backups(db_name), f"{prefixo}-*.db")), reverse=True)
+
+
+def verificar(caminho):
+    """Resultado do PRAGMA integrity_check do arquivo ('ok' se íntegro)."""
+    conn = sqlite3.connect(f"file:{caminho}?mode=ro", uri=True)
+    try:
+        return '; '.join(linha[0] for linha in conn.execute("PRAGMA integrity_check").fetchall())
+    finally:
+        conn.close()
+
+
+def copiar(origem, destino, paginas=PAGINAS_POR_PASSO, pausa=PAUSA_ENTRE_PASSOS):
+    """Backup de ``origem`` para ``destino`` (conexões abertas) em passos de ``paginas``."""
+    restantes = [None, 0]
+
+    def progresso(status, faltam, total):
+        if restantes[0] is not None and faltam > restantes[0]:
+            restantes[1] += 1
+            if restantes[1] > REINICIOS_MAXIMOS:
+                raise BackupReiniciado()
+        restantes[0] = faltam
+
+    try:
+        origem.backup(destino, pages=paginas, progress=progresso, sleep=pausa)
+    except BackupReiniciado:
+        log.info("Banco alterado durante o backup incremental; copiando num passo só")
+        origem.backup(destino, pages=-1)
+
+
+def fazer_backup(db_name, manter=MANTER, paginas=PAGINAS_POR_PASSO, pausa=PAUSA_ENTRE_PASSOS):
+    """Cria um backup verificado na pasta de backups e aplica a rotação (manter=None: sem rotação).
+
+    Retorna o caminho do backup.
+    """
+    pasta = pasta_backups(db_name)
+    os.makedirs(pasta, exist_ok=True)
+    prefixo = os.path.splitext(os.path.basename(db_name))[0]
+    nome = f"{prefixo}-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+    destino, n = os.path.join(pasta, nome + '.db'), 1
+    while os.path.exists(destino):
+        destino, n = os.path.join(pasta, f"{nome}-{n}.db"), n + 1
+    temporario = destino + '.tmp'
+    inicio = time.perf_counter()
+
+    origem = sqlite3.connect(db_name, timeout=30)
+    alvo = sqlite3.connect(temporario)
+    try:
+        copiar(origem, alvo, paginas, pausa)
+        # a cópia herda o modo WAL; o backup é um arquivo só, sem -wal/-shm
+        alvo.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        alvo.close()
+        origem.close()
+
+    integridade = verificar(temporario)
+    if integridade != 'ok':
+        os.remove(temporario)
+        raise sqlite3.DatabaseError(f"Backup corrompido ({integridade})")
+    os.replace(temporario, destino)
+    removidos = rotacionar(db_name, manter) if manter is not None else []
+    log.info("Backup criado", extra={'arquivo': destino, 'bytes': os.path.getsize(destino),
+                                     'ms': round((time.perf_counter() - inicio) * 1000, 1), 'removidos': len(removidos)})
+    return destino
+
+
+def rotacionar(db_name, manter=MANTER):
+    """Apaga os backups além dos ``manter`` mais recentes. Retorna os removidos."""
+    removidos = backups_existentes(db_name)[max(manter, 1):]
+    for caminho in removidos:
+        try:
+            os.remove(caminho)
+        except OSError:
+            pass
+    return removidos
+
+
+def restaurar(db_name, arquivo):
+    """Substitui o conteúdo do banco pelo backup, com o app podendo estar no ar.
+
+    Antes guarda um backup do estado atual. A cópia usa a API de backup sobre a
+    conexão do banco (e não uma troca de arquivos), então conexões abertas de
+    outros processos passam a ver os dados restaurados. A versão do inventário
+    avança para que as cópias em memória sejam recarregadas.
+    """
+    integridade = verificar(arquivo)
+    if integridade != 'ok':
+        raise ValueError(f"Backup corrompido, restauração cancelada ({integridade})")
+    anterior = fazer_backup(db_name, manter=None)
+
+    destino = sqlite3.connect(db_name, timeout=30)
+    origem = sqlite3.connect(f"file:{arquivo}?mode=ro", uri=True)
+    try:
+        destino.execute("PRAGMA busy_timeout=30000")
+        versao = destino.execute("SELECT versao FROM inventario_versao WHERE id = 1").fetchone()
+        origem.backup(destino, pages=-1)
+        destino.execute("PRAGMA journal_mode=WAL")
+        if versao is not None:
+            destino.execute("UPDATE inventario_versao SET versao = MAX(versao, ?) + 1 WHERE id = 1", (versao[0],))
+            destino.commit()
+    finally:
+        origem.close()
+        destino.close()
+    log.warning("Banco restaurado", extra={'arquivo': arquivo, 'backup_anterior': anterior})
+    return anterior
+
+
+class AgendadorBackup:
+    """Thread que faz um backup a cada ``intervalo`` segundos.
+
+    Com vários workers sobre o mesmo banco, o backup mais recente na pasta e um
+    arquivo de trava evitam que cada um faça o seu.
+    """
+
+    def __init__(self, db_name, intervalo, espera_inicial=60.0):
+        self.db_name = db_name
+        self.intervalo = intervalo
+        self.espera_inicial = espera_inicial
+        self.ultimo = None
+        self.falhas = 0
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._executar, name='backup', daemon=True)
+
+    def iniciar(self):
+        self._thread.start()
+
+    def parar(self):
+        self._parar.set()
+
+    def _vencido(self):
+        existentes = backups_existentes(self.db_name)
+        return not existentes or time.time() - os.path.getmtime(existentes[0]) >= self.intervalo
+
+    def _executar(self):
+        espera = self.espera_inicial
+        while not self._parar.wait(espera):
+            espera = min(self.intervalo, 300.0)
+            if not self._vencido():
+                continue
+            trava = os.path.join(pasta_backups(self.db_name), '.backup.lock')
+            try:
+                os.makedirs(os.path.dirname(trava), exist_ok=True)
+                if os.path.exists(trava) and time.time() - os.path.getmtime(trava) > 3600:
+                    os.remove(trava)  # deixada por um processo que morreu no meio
+                fd = os.open(trava, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                continue  # outro processo está fazendo o backup
+            except OSError:
+                log.warning("Não foi possível criar a trava do backup", exc_info=True)
+                continue
+            try:
+                os.close(fd)
+                self.ultimo = fazer_backup(self.db_name)
+            except Exception:
+                self.falhas += 1
+                log.exception("Falha no backup agendado")
+            finally:
+                try:
+                    os.remove(trava)
+                except OSError:
+                    pass
+
+    def estatisticas(self):
+        existentes = backups_existentes(self.db_name)
+        return {
+            'intervalo_min': self.intervalo / 60,
+            'ultimo': existentes[0] if existentes else None,
+            'backups': len(existentes),
+            'falhas': self.falhas,
+        }
+
+
+def agendar(db_name, intervalo_min=None):
+    """Sobe (uma vez por banco) o backup periódico. CHROMEBOOKS_BACKUP_INTERVALO_MIN=0 desliga."""
+    if intervalo_min is None:
+        intervalo_min = float(os.environ.get('CHROMEBOOKS_BACKUP_INTERVALO_MIN', 360))
+    if intervalo_min <= 0:
+        return None
+    chave = os.path.abspath(db_name)
+    with _lock:
+        if chave not in _agendadores:
+            _agendadores[chave] = AgendadorBackup(db_name, intervalo_min * 60)
+            _agendadores[chave].iniciar()
+        return _agendadores[chave]
+
+
+def agendador(db_name):
+    """Agendador já ativo para o banco (ou None)."""
+    return _agendadores.get(os.path.abspath(db_name))
+
+
+if __name__ == '__main__':
+    import sys
+    from database import Database
+
+    db = Database()
+    comando = sys.argv[1] if len(sys.argv) > 1 else 'listar'
+    arquivos = sys.argv[2:]
+
+    if comando == 'listar':
+        for caminho in backups_existentes(db.db_name):
+            data = datetime.fromtimestamp(os.path.getmtime(caminho)).isoformat(sep=' ', timespec='seconds')
+            print(f"{caminho} ({os.path.getsize(caminho) // 1024} KB, {data})")
+    elif comando == 'fazer':
+        print(f"✅ Backup criado: {fazer_backup(db.db_name)}")
+    elif comando == 'verificar':
+        falhou = False
+        for caminho in arquivos or backups_existentes(db.db_name):
+            resultado = verificar(caminho)
+            falhou = falhou or resultado != 'ok'
+            print(f"{caminho}: {'✅ ok' if resultado == 'ok' else '❌ ' + resultado}")
+        sys.exit(1 if falhou else 0)
+    elif comando == 'restaurar' and len(arquivos) == 1:
+        try:
+            anterior = restaurar(db.db_name, arquivos[0])
+        except (ValueError, sqlite3.Error) as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+        print(f"✅ Banco restaurado de {arquivos[0]} (estado anterior salvo em {anterior})")
+    else:
+        print("Uso: python backup.py [listar|fazer|verificar [arquivo...]|restaurar <arquivo>]")
+        sys.exit(2)
@@ -0,0 +1,230 @@
+# benchmark.py - Benchmark ponta a ponta das rotas principais (Flask test client)
+#
+# Gera um banco sintético (chromebooks, carrinhos e histórico), sobe o app
+# apontando para ele e mede cada cenário em vários níveis de concorrência
+# (threads, cada uma com seu cliente logado). O resultado sai em JSON:
+# vazão (req/s) e latências p50/p95/p99 em ms por cenário e concorrência.
+#
+#   python benchmark.py --historico 1000000 --concorrencia 1,4,16 --saida base.json
+#   python benchmark.py --banco /tmp/bench.db --comparar base.json --tolerancia 10
+#
+# POSTs seguem o redirect (como o navegador), então /emprestimo e /devolucao
+# medem a gravação mais a página seguinte.
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+CENARIOS = ('login', 'emprestimo', 'api_emprestados', 'devolucao', 'dashboard', 'historico', 'api_disponiveis',
+            'autocompletar', 'busca_historico')
+SENHA = 'bench-1234'
+
+
+def log(mensagem):
+    print(mensagem, file=sys.stderr, flush=True)
+
+
+def gerar_banco(caminho, chromebooks, carrinhos, historico):
+    """Popula um banco novo (as tabelas já devem existir) com dados sintéticos."""
+    conn = sqlite3.connect(caminho)
+    conn.execute(
+        "INSERT INTO chromebooks (numero, carrinho, status) "
+        "WITH RECURSIVE seq(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM seq WHERE i < ?) "
+        "SELECT i, 'Carrinho ' || ((i - 1) % ?  + 1), 'Disponível' FROM seq",
+        (chromebooks, carrinhos)
+    )
+    # Histórico espalhado pelos últimos 365 dias; linhas pares são devoluções
+    conn.execute(
+        "INSERT INTO historico (chromebook_numero, carrinho, aluno, turma, professor, data_emprestimo, data_devolucao, tipo_acao) "
+        "WITH RECURSIVE seq(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM seq WHERE i < :total), "
+        "datas(i, data) AS (SELECT i, datetime('now', 'localtime', '-' || CAST((:total - i) * :passo AS INTEGER) || ' seconds') FROM seq) "
+        "SELECT (i - 1) % :chromebooks + 1, 'Carrinho ' || (((i - 1) % :chromebooks) % :carrinhos + 1), "
+        "       'Aluno ' || (i % 5000), (i % 9 + 1) || 'º ' || char(65 + i % 4), 'Professor ' || (i % 60), "
+        "       CASE WHEN i % 2 = 0 THEN datetime(data, '-50 minutes') ELSE data END, "
+        "       CASE WHEN i % 2 = 0 THEN data END, "
+        "       CASE WHEN i % 2 = 0 THEN 'Devolução' ELSE 'Empréstimo' END "
+        "FROM datas",
+        {'total': historico, 'passo': 365 * 86400 / max(historico, 1), 'chromebooks': chromebooks, 'carrinhos': carrinhos}
+    )
+    conn.commit()
+    conn.close()
+
+
+def percentil(ordenadas, q):
+    if not ordenadas:
+        return None
+    return ordenadas[min(len(ordenadas) - 1, int(round(q * (len(ordenadas) - 1))))]
+
+
+def medir(cenario, clientes, requisicoes, fazer):
+    latencias, erros = [], []
+    barreira = threading.Barrier(len(clientes))
+
+    def trabalhar(t, cliente):
+        barreira.wait()
+        for i in range(requisicoes):
+            inicio = time.perf_counter()
+            resposta = fazer(cliente, t, i)
+            latencias.append(time.perf_counter() - inicio)
+            if resposta.status_code >= 400:
+                erros.append(resposta.status_code)
+
+    threads = [threading.Thread(target=trabalhar, args=(t, cliente)) for t, cliente in enumerate(clientes)]
+    inicio = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duracao = time.perf_counter() - inicio
+
+    ordenadas = sorted(latencias)
+    ms = lambda valor: round(valor * 1000, 3) if valor is not None else None
+    return {
+        'cenario': cenario,
+        'concorrencia': len(clientes),
+        'requisicoes': len(latencias),
+        'erros': len(erros),
+        'duracao_s': round(duracao, 3),
+        'rps': round(len(latencias) / duracao, 1) if duracao else None,
+        'p50_ms': ms(percentil(ordenadas, 0.50)),
+        'p95_ms': ms(percentil(ordenadas, 0.95)),
+        'p99_ms': ms(percentil(ordenadas, 0.99)),
+        'max_ms': ms(ordenadas[-1] if ordenadas else None),
+    }
+
+
+def executar(app, db, args):
+    concorrencias = [int(valor) for valor in args.concorrencia.split(',')]
+    cenarios = CENARIOS if args.cenarios == 'todos' else tuple(args.cenarios.split(','))
+    usuarios = max(concorrencias)
+    for t in range(usuarios):
+        if not db.verificar_usuario_existe(f'bench{t}'):
+            db.criar_usuario(f'bench{t}', SENHA, f'Professor Bench {t}')
+
+    def cliente_logado(t):
+        cliente = app.test_client()
+        resposta = cliente.post('/login', data={'username': f'bench{t}', 'senha': SENHA})
+        if resposta.status_code != 302:
+            raise RuntimeError(f"login de bench{t} falhou ({resposta.status_code})")
+        return cliente
+
+    def chromebook(n, t, i):
+        # cada thread usa a sua fatia de chromebooks, sem disputa entre threads
+        return (t + i * n) % args.chromebooks + 1
+
+    resultados = []
+    for n in concorrencias:
+        clientes = [cliente_logado(t) for t in range(n)]
+        acoes = {
+            'login': lambda c, t, i: c.post('/login', data={'username': f'bench{t}', 'senha': SENHA}),
+            'emprestimo': lambda c, t, i: c.post('/emprestimo', follow_redirects=True, data={
+                'numero_chromebook': chromebook(n, t, i), 'carrinho': f'Carrinho {(chromebook(n, t, i) - 1) % args.carrinhos + 1}',
+                'nome_aluno': f'Aluno {t}-{i}', 'turma': '1º A'}),
+            'api_emprestados': lambda c, t, i: c.get('/api/chromebooks_emprestados'),
+            'devolucao': lambda c, t, i: c.post('/devolucao', follow_redirects=True, data={
+                'numero_chromebook': chromebook(n, t, i), 'carrinho': f'Carrinho {(chromebook(n, t, i) - 1) % args.carrinhos + 1}'}),
+            'dashboard': lambda c, t, i: c.get('/dashboard'),
+            'historico': lambda c, t, i: c.get('/historico'),
+            'api_disponiveis': lambda c, t, i: c.get('/api/chromebooks_disponiveis'),
+            # prefixos distintos a cada requisição: mede o índice, não o cache
+            'autocompletar': lambda c, t, i: c.get(f'/api/autocompletar/aluno?q=Aluno {(t * args.requisicoes + i) % 5000}'),
+            'busca_historico': lambda c, t, i: c.get(f'/api/historico?busca=Aluno {(t * args.requisicoes + i) % 5000}'),
+        }
+        for cenario in cenarios:
+            resultado = medir(cenario, clientes, args.requisicoes, acoes[cenario])
+            resultados.append(resultado)
+            log(f"{cenario:>16} x{n:<3} {resultado['rps']:>8} req/s  p50 {resultado['p50_ms']:>8} ms  "
+                f"p95 {resultado['p95_ms']:>8} ms  p99 {resultado['p99_ms']:>8} ms  erros {resultado['erros']}")
+    return resultados
+
+
+def comparar(atual, base, tolerancia):
+    """Imprime a variação contra a base e retorna True se algum cenário piorou além da tolerância (%)."""
+    anteriores = {(r['cenario'], r['concorrencia']): r for r in base['resultados']}
+    piorou = False
+    log(f"\n{'cenário':>16} {'conc':>4} {'req/s':>14} {'p95':>14}")
+    for r in atual['resultados']:
+        anterior = anteriores.get((r['cenario'], r['concorrencia']))
+        if not anterior or not anterior['rps'] or not anterior['p95_ms']:
+            continue
+        delta_rps = (r['rps'] - anterior['rps']) / anterior['rps'] * 100
+        delta_p95 = (r['p95_ms'] - anterior['p95_ms']) / anterior['p95_ms'] * 100
+        ruim = delta_rps < -tolerancia or delta_p95 > tolerancia
+        piorou = piorou or ruim
+        log(f"{r['cenario']:>16} {r['concorrencia']:>4} {delta_rps:>+13.1f}% {delta_p95:>+13.1f}%{'  ⚠️' if ruim else ''}")
+    return piorou
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ponta a ponta das rotas principais")
+    parser.add_argument('--chromebooks', type=int, default=2000)
+    parser.add_argument('--carrinhos', type=int, default=20)
+    parser.add_argument('--historico', type=int, default=200000, help='linhas de histórico geradas')
+    parser.add_argument('--concorrencia', default='1,4,16', help='níveis separados por vírgula')
+    parser.add_argument('--requisicoes', type=int, default=100, help='por thread, em cada cenário')
+    parser.add_argument('--cenarios', default='todos', help=f"todos ou lista entre: {','.join(CENARIOS)}")
+    parser.add_argument('--banco', help='reaproveita este banco (gerado na primeira vez)')
+    parser.add_argument('--saida', help='grava o JSON neste arquivo (padrão: stdout)')
+    parser.add_argument('--comparar', help='JSON de uma execução anterior para comparação')
+    parser.add_argument('--tolerancia', type=float, default=10.0, help='piora máxima aceita (%%) na comparação')
+    args = parser.parse_args()
+
+    caminho = args.banco or os.path.join(tempfile.mkdtemp(prefix='bench_'), 'bench.db')
+    novo = not os.path.exists(caminho)
+    os.environ['CHROMEBOOKS_DB'] = caminho
+    # sem tarefas agendadas (backup, varredura de atrasos) no meio da medição
+    os.environ.setdefault('CHROMEBOOKS_BACKUP_INTERVALO_MIN', '0')
+    os.environ.setdefault('CHROMEBOOKS_ATRASOS_INTERVALO_S', '0')
+
+    with contextlib.redirect_stdout(sys.stderr):
+        import app as aplicacao
+        app = aplicacao.create_app(caminho)
+        db = app.extensions['chromebooks']
+        db.inicializar()
+        if novo:
+            log(f"Gerando {caminho}: {args.chromebooks} chromebooks, {args.carrinhos} carrinhos, {args.historico} históricos...")
+            inicio = time.perf_counter()
+            gerar_banco(caminho, args.chromebooks, args.carrinhos, args.historico)
+            db.recalcular_estatisticas()
+            db.reconstruir_uso()
+            db.reconstruir_busca()
+            db.verificar_inventario()
+            log(f"Banco gerado em {time.perf_counter() - inicio:.1f}s")
+        resultados = executar(app, db, args)
+
+    saida = {
+        'meta': {
+            'data': datetime.now().isoformat(sep=' ', timespec='seconds'),
+            'banco': caminho,
+            'chromebooks': args.chromebooks,
+            'carrinhos': args.carrinhos,
+            'historico': args.historico,
+            'requisicoes_por_thread': args.requisicoes,
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+        },
+        'resultados': resultados,
+    }
+    texto = json.dumps(saida, ensure_ascii=False, indent=2)
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as arquivo:
+            arquivo.write(texto)
+    else:
+        print(texto)
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as arquivo:
+            base = json.load(arquivo)
+        if comparar(saida, base, args.tolerancia):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+# busca.py - Busca textual (FTS5) no histórico e autocompletar de alunos, turmas e professores
+#
+# Dois índices, mantidos por triggers (nenhuma escrita do app precisa saber deles):
+#   historico_busca  FTS5 sobre aluno/turma/professor do histórico (conteúdo
+#                    externo: o texto fica só em historico, o índice guarda os termos)
+#   nomes_busca      vocabulário: cada aluno/turma/professor com o número de
+#                    empréstimos e o último uso, somado quando um chromebook passa
+#                    a 'Emprestado' (imediato também com o histórico assíncrono);
+#                    nomes_busca_fts indexa os prefixos dos nomes
+#
+# O vocabulário não encolhe quando o histórico é arquivado. Os arquivos de
+# histórico levam o próprio historico_busca, criado ao arquivar; arquivos de
+# antes da busca ganham o índice em "python arquivamento.py verificar" (ou
+# "reconstruir", abaixo). Enquanto não têm, a busca neles usa LIKE.
+#
+#   python busca.py reconstruir            (refaz os índices a partir do histórico e dos arquivos)
+#   python busca.py sugerir <tipo> <texto>
+import unicodedata
+
+TIPOS = ('aluno', 'turma', 'professor')
+# Mesma normalização nas consultas e no índice: minúsculas, sem acentos
+TOKENIZADOR = "unicode61 remove_diacritics 2"
+
+SQL_SUGERIR = '''
+    SELECT n.nome, n.usos, n.ultimo_uso, n.turma
+    FROM nomes_busca_fts f JOIN nomes_busca n ON n.id = f.rowid
+    WHERE nomes_busca_fts MATCH ? AND n.tipo = ?
+    ORDER BY n.usos DESC, n.ultimo_uso DESC
+    LIMIT ?
+'''
+
+# (tipo, coluna do nome em chromebooks, turma guardada junto)
+NOMES_CHROMEBOOK = (
+    ('aluno', 'aluno_emprestado', 'new.turma_aluno'),
+    ('turma', 'turma_aluno', 'NULL'),
+    ('professor', 'professor_emprestimo', 'NULL'),
+)
+
+
+def criar_indice_historico(cursor, esquema='main'):
+    """historico_busca e os triggers que o acompanham (no banco principal ou num arquivo anexado).
+
+    Se o índice ainda não existia, indexa as linhas que já estão em historico.
+    Retorna True nesse caso.
+    """
+    cursor.execute(f"SELECT 1 FROM {esquema}.sqlite_master WHERE name = 'historico_busca'")
+    if cursor.fetchone():
+        return False
+    cursor.execute(f'''
+        CREATE VIRTUAL TABLE {esquema}.historico_busca USING fts5(
+            aluno, turma, professor,
+            content='historico', content_rowid='id',
+            tokenize="{TOKENIZADOR}", prefix='2 3'
+        )
+    ''')
+    linha_nova = "new.id, new.aluno, new.turma, new.professor"
+    linha_antiga = "'delete', old.id, old.aluno, old.turma, old.professor"
+    for evento, corpo in (
+        ('insert', f"INSERT INTO historico_busca (rowid, aluno, turma, professor) VALUES ({linha_nova});"),
+        ('delete', f"INSERT INTO historico_busca (historico_busca, rowid, aluno, turma, professor) VALUES ({linha_antiga});"),
+        ('update', f"INSERT INTO historico_busca (historico_busca, rowid, aluno, turma, professor) VALUES ({linha_antiga});\n"
+                   f"                INSERT INTO historico_busca (rowid, aluno, turma, professor) VALUES ({linha_nova});"),
+    ):
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {esquema}.trg_historico_busca_{evento}
+            AFTER {evento.upper()} ON historico
+            BEGIN
+                {corpo}
+            END
+        """)
+    reindexar_historico(cursor, esquema)
+    return True
+
+
+def criar_tabelas(cursor):
+    criar_indice_historico(cursor)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS nomes_busca (
+            id INTEGER PRIMARY KEY,
+            tipo TEXT NOT NULL,
+            nome TEXT NOT NULL,
+            usos INTEGER NOT NULL DEFAULT 0,
+            ultimo_uso TEXT,
+            turma TEXT,
+            UNIQUE (tipo, nome)
+        )
+    ''')
+    cursor.execute(f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS nomes_busca_fts USING fts5(
+            nome, content='nomes_busca', content_rowid='id',
+            tokenize="{TOKENIZADOR}", prefix='1 2 3'
+        )
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_nomes_busca_insert AFTER INSERT ON nomes_busca
+        BEGIN
+            INSERT INTO nomes_busca_fts (rowid, nome) VALUES (new.id, new.nome);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_nomes_busca_delete AFTER DELETE ON nomes_busca
+        BEGIN
+            INSERT INTO nomes_busca_fts (nomes_busca_fts, rowid, nome) VALUES ('delete', old.id, old.nome);
+        END
+    ''')
+    # Nome só muda por reconstrução; usos/ultimo_uso/turma não são indexados
+    somar = []
+    for tipo, coluna, turma in NOMES_CHROMEBOOK:
+        somar.append(f"""
+                INSERT INTO nomes_busca (tipo, nome, usos, ultimo_uso, turma)
+                SELECT '{tipo}', trim(new.{coluna}), 1, new.data_emprestimo, {turma}
+                WHERE trim(COALESCE(new.{coluna}, '')) <> ''
+                ON CONFLICT (tipo, nome) DO UPDATE SET
+                    usos = usos + 1,
+                    ultimo_uso = max(COALESCE(ultimo_uso, ''), COALESCE(excluded.ultimo_uso, '')),
+                    turma = COALESCE(excluded.turma, turma);""")
+    for evento, condicao in (
+        ('UPDATE OF status', "new.status = 'Emprestado' AND old.status IS NOT 'Emprestado'"),
+        ('INSERT', "new.status = 'Emprestado'"),
+    ):
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_nomes_busca_{evento.split()[0].lower()}_chromebook
+            AFTER {evento} ON chromebooks
+            WHEN {condicao}
+            BEGIN{''.join(somar)}
+            END
+        """)
+
+
+def somar_nomes(cursor, fonte='historico', filtro=''):
+    """Soma no vocabulário os empréstimos de ``fonte`` (historico ou arq.historico)."""
+    for tipo, coluna in (('aluno', 'aluno'), ('turma', 'turma'), ('professor', 'professor')):
+        turma = 'turma' if tipo == 'aluno' else 'NULL'
+        cursor.execute(f"""
+            INSERT INTO main.nomes_busca (tipo, nome, usos, ultimo_uso, turma)
+            SELECT '{tipo}', nome, usos, ultimo_uso, turma FROM (
+                SELECT trim({coluna}) AS nome, COUNT(*) AS usos, MAX(data_emprestimo) AS ultimo_uso,
+                       {turma} AS turma
+                FROM {fonte}
+                WHERE tipo_acao = 'Empréstimo' AND trim(COALESCE({coluna}, '')) <> '' {filtro}
+                GROUP BY trim({coluna})
+            ) WHERE true
+            ON CONFLICT (tipo, nome) DO UPDATE SET
+                usos = usos + excluded.usos,
+                ultimo_uso = max(COALESCE(ultimo_uso, ''), COALESCE(excluded.ultimo_uso, '')),
+                turma = CASE WHEN excluded.ultimo_uso >= COALESCE(ultimo_uso, '') THEN COALESCE(excluded.turma, turma)
+                             ELSE turma END
+        """)
+
+
+def limpar_nomes(cursor):
+    cursor.execute("DELETE FROM nomes_busca")
+    cursor.execute("INSERT INTO nomes_busca_fts (nomes_busca_fts) VALUES ('rebuild')")
+
+
+def reindexar_historico(cursor, esquema='main'):
+    cursor.execute(f"INSERT INTO {esquema}.historico_busca (historico_busca) VALUES ('rebuild')")
+
+
+def tem_indice(conn, esquema='main'):
+    """True se o banco (ou o arquivo anexado como ``esquema``) já tem historico_busca."""
+    return conn.execute(f"SELECT 1 FROM {esquema}.sqlite_master WHERE name = 'historico_busca'").fetchone() is not None
+
+
+def condicao_like(texto):
+    """(condição, parâmetros) com LIKE para um histórico sem índice: cada palavra começa uma palavra de aluno/turma/professor.
+
+    Aproximação da consulta FTS5 (só separa palavras por espaço e ignora
+    maiúsculas só em ASCII), usada em arquivos antigos ainda não indexados.
+    Retorna None se não sobrou nenhuma palavra.
+    """
+    palavras = [palavra.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+                for palavra in str(texto or '').lower().split()]
+    if not palavras:
+        return None
+    condicoes, params = [], []
+    for palavra in palavras:
+        condicoes.append('(' + ' OR '.join(f"{coluna} LIKE ? ESCAPE '\\' OR {coluna} LIKE ? ESCAPE '\\'"
+                                           for coluna in ('aluno', 'turma', 'professor')) + ')')
+        params += [f'{palavra}%', f'% {palavra}%'] * 3
+    return ' AND '.join(condicoes), params
+
+
+def normalizar(texto):
+    """Minúsculas e sem acentos, como o tokenizador unicode61 (remove_diacritics 2)."""
+    decomposto = unicodedata.normalize('NFD', str(texto or '').lower())
+    return ''.join(c for c in decomposto if not unicodedata.combining(c))
+
+
+def termos(texto):
+    """Palavras do texto como o FTS5 as separa (letras e números; o resto separa)."""
+    palavras, atual = [], []
+    for c in normalizar(texto):
+        if c.isalnum():
+            atual.append(c)
+        elif atual:
+            palavras.append(''.join(atual))
+            atual = []
+    if atual:
+        palavras.append(''.join(atual))
+    return palavras
+
+
+def consulta_prefixos(texto):
+    """Consulta FTS5 em que cada palavra digitada é prefixo de uma palavra do registro ('jo sil' -> "jo"* "sil"*).
+
+    Retorna None se não sobrou nenhuma palavra. As aspas impedem que o texto
+    digitado seja lido como sintaxe do FTS5 (AND, NOT, parênteses...).
+    """
+    palavras = termos(texto)
+    return ' '.join(f'"{palavra}"*' for palavra in palavras) if palavras else None
+
+
+def corresponde(palavras, *textos):
+    """Mesma regra de consulta_prefixos, em Python (para registros que ainda estão na fila)."""
+    do_registro = [termo for texto in textos for termo in termos(texto)]
+    return all(any(termo.startswith(palavra) for termo in do_registro) for palavra in palavras)
+
+
+def sugerir(conn, tipo, texto, limite=10):
+    """Nomes do vocabulário cujas palavras começam pelas digitadas, dos mais usados para os menos."""
+    consulta = consulta_prefixos(texto)
+    if tipo not in TIPOS or consulta is None:
+        return []
+    return [
+        {'nome': nome, 'usos': usos, 'ultimo_uso': ultimo_uso, **({'turma': turma} if tipo == 'aluno' else {})}
+        for nome, usos, ultimo_uso, turma in conn.execute(SQL_SUGERIR, (consulta, tipo, limite))
+    ]
+
+
+if __name__ == '__main__':
+    import json
+    import sys
+    from database import Database
+
+    db = Database()
+    db.criar_tabelas()
+    comando = sys.argv[1] if len(sys.argv) > 1 else ''
+    if comando == 'reconstruir':
+        registros, nomes = db.reconstruir_busca()
+        print(f"✅ Índices de busca reconstruídos: {registros} registros, {nomes} nomes")
+    elif comando == 'sugerir' and len(sys.argv) > 3:
+        print(json.dumps(db.autocompletar(sys.argv[2], ' '.join(sys.argv[3:])), ensure_ascii=False, indent=2))
+    else:
+        print("Uso: python busca.py [reconstruir|sugerir <aluno|turma|professor> <texto>]")
+        sys.exit(2)
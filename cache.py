@@ -0,0 +1,90 @@
+# cache.py - Cache LRU em memória com expiração (TTL)
+import threading
+import time
+from collections import OrderedDict
+
+_AUSENTE = object()
+
+
+class CacheLRU:
+    """Cache LRU thread-safe com TTL e contadores de acertos/falhas.
+
+    Valores ``None`` também são guardados (ex.: usuário inexistente), então use
+    ``obter(chave, carregar)`` para diferenciar "não está no cache" de "não existe".
+    Com ``peso`` (função do valor, ex.: ``len``) e ``peso_maximo``, o limite vale
+    também para a soma dos pesos: saem os menos usados até caber.
+    """
+
+    def __init__(self, tamanho=256, ttl=300.0, peso=None, peso_maximo=None):
+        self.tamanho = tamanho
+        self.ttl = ttl
+        self.peso = peso
+        self.peso_maximo = peso_maximo
+        self.peso_total = 0
+        self._dados = OrderedDict()
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.falhas = 0
+        self.remocoes = 0
+
+    def _buscar(self, chave):
+        with self._lock:
+            item = self._dados.get(chave, _AUSENTE)
+            if item is not _AUSENTE:
+                valor, expira = item
+                if self.ttl is None or expira > time.monotonic():
+                    self._dados.move_to_end(chave)
+                    self.acertos += 1
+                    return valor
+                self._remover(chave)
+            self.falhas += 1
+            return _AUSENTE
+
+    def _remover(self, chave):
+        valor, _ = self._dados.pop(chave)
+        if self.peso is not None:
+            self.peso_total -= self.peso(valor)
+
+    def guardar(self, chave, valor):
+        expira = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            if chave in self._dados:
+                self._remover(chave)
+            self._dados[chave] = (valor, expira)
+            if self.peso is not None:
+                self.peso_total += self.peso(valor)
+            while len(self._dados) > self.tamanho or (
+                    self.peso_maximo is not None and self.peso_total > self.peso_maximo):
+                self._remover(next(iter(self._dados)))
+                self.remocoes += 1
+
+    def obter(self, chave, carregar):
+        """Valor em cache ou ``carregar()`` (que é então guardado)."""
+        valor = self._buscar(chave)
+        if valor is _AUSENTE:
+            valor = carregar()
+            self.guardar(chave, valor)
+        return valor
+
+    def invalidar(self, chave):
+        with self._lock:
+            if chave in self._dados:
+                self._remover(chave)
+
+    def limpar(self):
+        with self._lock:
+            self._dados.clear()
+            self.peso_total = 0
+
+    def estatisticas(self):
+        total = self.acertos + self.falhas
+        return {
+            'itens': len(self._dados),
+            'tamanho': self.tamanho,
+            'ttl': self.ttl,
+            'acertos': self.acertos,
+            'falhas': self.falhas,
+            'remocoes': self.remocoes,
+            'taxa_acerto': round(self.acertos / total, 3) if total else None,
+            **({'peso_total': self.peso_total, 'peso_maximo': self.peso_maximo} if self.peso is not None else {}),
+        }
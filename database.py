@@ -1,92 +1,544 @@
+import atexit
+import logging
+import os
+import queue
+import random
 import sqlite3
+import threading
+import time
+from contextlib import closing, contextmanager
 from datetime import datetime
-from werkzeug.security import check_password_hash, generate_password_hash
+from werkzeug.security import generate_password_hash
+from migracoes import aplicar_migracoes
+from eventos import CanalEventos
+from cache import CacheLRU
+from senhas import METODO_HASH, VerificadorSenhas, precisa_rehash
+from fila_historico import FilaHistorico, SQL_INSERIR_HISTORICO, lotes_aplicados
+from inventario import InventarioMemoria, SQL_VERSAO_INVENTARIO
+import arquivamento
+import uso
+import atrasos
+import busca
+from metricas import ConexaoMedida, Metricas
 
-class Database:
-    def __init__(self):
-        import os
-        self.db_name = os.path.join(os.path.dirname(__file__), 'chromebooks.db')
+log = logging.getLogger('chromebooks.db')
 
-    def get_connection(self):
-        return sqlite3.connect(self.db_name)
+# Consultas fixas: o schema é garantido pelas migrações, então não há
+# introspecção por chamada e o cache de statements de cada conexão é reaproveitado.
+SQL_TODOS_CHROMEBOOKS = '''
+    SELECT numero, carrinho, status, aluno_emprestado, turma_aluno, professor_emprestimo, data_emprestimo
+    FROM chromebooks ORDER BY carrinho, numero
+'''
+COLUNAS_HISTORICO = ('id', 'chromebook_numero', 'carrinho', 'aluno', 'turma', 'professor',
+                     'data_emprestimo', 'data_devolucao', 'tipo_acao')
+SQL_HISTORICO = f"SELECT {', '.join(COLUNAS_HISTORICO)} FROM historico"
+SQL_HISTORICO_ARQUIVO = f"SELECT {', '.join(COLUNAS_HISTORICO)} FROM arq.historico"
+# Com busca textual a leitura parte do índice FTS5 (banco principal ou arquivo),
+# que entrega os ids já em ordem: ORDER BY id ... LIMIT para cedo (ver busca.py)
+SQL_HISTORICO_BUSCA = (f"SELECT {', '.join(COLUNAS_HISTORICO)} "
+                       "FROM (SELECT rowid AS id FROM {esquema}.historico_busca(?)) JOIN {esquema}.historico USING (id)")
 
-    def criar_tabelas(self):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Tabela de usuários
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS usuarios (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                senha TEXT NOT NULL,
-                nome TEXT NOT NULL
+# Data do evento: devoluções guardam também o início do empréstimo, então a
+# data de devolução tem prioridade. Mesma expressão do índice idx_historico_data_evento.
+SQL_DATA_EVENTO = 'COALESCE(data_devolucao, data_emprestimo)'
+
+# Filtro aceito por buscar_historico -> condição SQL (cada coluna tem índice (coluna, id))
+FILTROS_HISTORICO = {
+    'numero': 'chromebook_numero = ?',
+    'carrinho': 'carrinho = ?',
+    'aluno': 'aluno = ?',
+    'turma': 'turma = ?',
+    'professor': 'professor = ?',
+    'tipo_acao': 'tipo_acao = ?',
+    'data_inicio': f'{SQL_DATA_EVENTO} >= ?',
+    'data_fim': f'{SQL_DATA_EVENTO} <= ?',
+    'busca': None,  # palavras de aluno/turma/professor: muda a origem da consulta (_select_historico)
+}
+LIMITE_MAXIMO_HISTORICO = 500
+# Filtro -> posição na linha do histórico (para filtrar registros ainda na fila)
+POSICAO_FILTROS = {'numero': 1, 'carrinho': 2, 'aluno': 3, 'turma': 4, 'professor': 5, 'tipo_acao': 8}
+LIMITE_MAXIMO_AUTOCOMPLETAR = 50
+
+# Versão compartilhada entre processos: inventario_versao (chromebooks) e
+# dados_versao (histórico e usuários), ambas mantidas por triggers
+SQL_VERSOES_DISCO = ("SELECT (SELECT versao FROM inventario_versao WHERE id = 1), "
+                     "(SELECT versao FROM dados_versao WHERE id = 1)")
+SQL_NOVA_VERSAO_DADOS = "UPDATE dados_versao SET versao = versao + 1 WHERE id = 1"
+
+SQL_MARCAR_EMPRESTADO = (
+    "UPDATE chromebooks SET status = 'Emprestado', aluno_emprestado = ?, turma_aluno = ?, data_emprestimo = ?, professor_emprestimo = ? "
+    "WHERE numero = ? AND carrinho = ? AND status = 'Disponível'"
+)
+SQL_MARCAR_DISPONIVEL = (
+    "UPDATE chromebooks SET status = 'Disponível', aluno_emprestado = NULL, turma_aluno = NULL, data_emprestimo = NULL, professor_emprestimo = NULL "
+    "WHERE numero = ? AND carrinho = ? AND status = 'Emprestado'"
+)
+
+
+def agora():
+    """Data/hora local em ISO-8601 ('aaaa-mm-dd hh:mm:ss'), ordenável como texto."""
+    return datetime.now().isoformat(sep=' ', timespec='seconds')
+
+
+def banco_ocupado(erro):
+    """True para os erros transitórios de concorrência do SQLite (locked/busy)."""
+    mensagem = str(erro).lower()
+    return isinstance(erro, sqlite3.OperationalError) and ('locked' in mensagem or 'busy' in mensagem)
+
+
+def minutos_desde(data):
+    """Minutos inteiros desde uma data ISO (None se a data estiver vazia ou inválida)."""
+    try:
+        return int((datetime.now() - datetime.fromisoformat(data)).total_seconds() // 60)
+    except (TypeError, ValueError):
+        return None
+
+
+def numero_valido(texto):
+    """True se o texto é um número inteiro em dígitos 0-9 (isdigit aceitaria '²' e outros que int() recusa)."""
+    return texto.isascii() and texto.isdecimal()
+
+
+def fim_do_dia(valor):
+    """Completa uma data 'aaaa-mm-dd' para incluir o dia inteiro em comparações <=."""
+    valor = str(valor)
+    return f"{valor} 23:59:59" if len(valor) == 10 else valor
+
+
+class ConexaoPool:
+    """Conexão emprestada do pool: ``close()`` devolve ao pool em vez de fechar."""
+
+    def __init__(self, conn, pool):
+        self._conn = conn
+        self._pool = pool
+
+    def __getattr__(self, nome):
+        return getattr(self._conn, nome)
+
+    def close(self):
+        if self._conn is not None:
+            self._pool.devolver(self._conn)
+            self._conn = None
+
+
+class PoolConexoes:
+    """Pool limitado de conexões SQLite persistentes (WAL + busy_timeout)."""
+
+    def __init__(self, db_name, tamanho=8, timeout=30.0, busy_timeout_ms=5000,
+                 cached_statements=256, verificar_saude=True, intervalo_saude=60.0):
+        self.db_name = db_name
+        self.tamanho = tamanho
+        self.timeout = timeout
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cached_statements = cached_statements
+        self.verificar_saude = verificar_saude
+        self.intervalo_saude = intervalo_saude
+        self._livres = queue.LifoQueue()
+        self._ultimo_uso = {}
+        self._criadas = 0
+        self._lock = threading.Lock()
+        self._vagas = threading.BoundedSemaphore(tamanho)
+
+    def _nova_conexao(self):
+        conn = sqlite3.connect(
+            self.db_name,
+            timeout=self.busy_timeout_ms / 1000,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with self._lock:
+            self._criadas += 1
+        return conn
+
+    def _saudavel(self, conn):
+        if not self.verificar_saude:
+            return True
+        ocioso = time.monotonic() - self._ultimo_uso.get(id(conn), 0)
+        if ocioso < self.intervalo_saude:
+            return True
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _descartar(self, conn):
+        self._ultimo_uso.pop(id(conn), None)
+        with self._lock:
+            self._criadas -= 1
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def obter(self):
+        if not self._vagas.acquire(timeout=self.timeout):
+            raise sqlite3.OperationalError("Pool de conexões esgotado")
+        try:
+            while True:
+                try:
+                    conn = self._livres.get_nowait()
+                except queue.Empty:
+                    return self._nova_conexao()
+                if self._saudavel(conn):
+                    return conn
+                self._descartar(conn)
+        except Exception:
+            self._vagas.release()
+            raise
+
+    def devolver(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._descartar(conn)
+        else:
+            self._ultimo_uso[id(conn)] = time.monotonic()
+            self._livres.put(conn)
+        finally:
+            self._vagas.release()
+
+    def abertas(self):
+        return self._criadas
+
+    def ociosas(self):
+        return self._livres.qsize()
+
+    def fechar(self):
+        while True:
+            try:
+                conn = self._livres.get_nowait()
+            except queue.Empty:
+                break
+            self._descartar(conn)
+
+
+class Database:
+    def __init__(self, db_name=None, tamanho_pool=None, verificar_saude=True, intervalo_saude=60.0,
+                 historico_assincrono=None):
+        self.db_name = (db_name or os.environ.get('CHROMEBOOKS_DB')
+                        or os.path.join(os.path.dirname(__file__), 'chromebooks.db'))
+        self.pool = PoolConexoes(
+            self.db_name,
+            tamanho=tamanho_pool or int(os.environ.get('CHROMEBOOKS_POOL_TAMANHO', 8)),
+            verificar_saude=verificar_saude,
+            intervalo_saude=intervalo_saude,
+        )
+        # Escritas de outros processos viram 'recarregar' para os navegadores deste
+        # (conferido a cada CHROMEBOOKS_EVENTOS_VERIFICACAO_S enquanto há assinantes)
+        self.eventos = CanalEventos(
+            verificar=self.conferir_escritas_externas,
+            intervalo_verificacao=float(os.environ.get('CHROMEBOOKS_EVENTOS_VERIFICACAO_S', 5)),
+        )
+        self._versao_disco_vista = None  # sem inventário em memória: último inventario_versao conhecido
+        # Contagem de consultas/linhas/tempo de SQL por requisição (CHROMEBOOKS_METRICAS=0 desliga)
+        self.metricas = None
+        if os.environ.get('CHROMEBOOKS_METRICAS', '1').lower() in ('1', 'true', 'sim'):
+            limite_ms = os.environ.get('CHROMEBOOKS_SQL_LENTO_MS')
+            self.metricas = Metricas(limite_sql_lento=float(limite_ms) / 1000 if limite_ms else None)
+        # Repetições de uma escrita quando o banco segue ocupado após o busy_timeout
+        self.tentativas_escrita = int(os.environ.get('CHROMEBOOKS_TENTATIVAS_ESCRITA', 4))
+        self.senhas = VerificadorSenhas(
+            workers=int(os.environ.get('CHROMEBOOKS_HASH_WORKERS', 2)),
+            max_pendentes=int(os.environ.get('CHROMEBOOKS_HASH_PENDENTES', 8)),
+        )
+        # Usuários mudam poucas vezes por semestre, mas são lidos a cada requisição
+        self.cache_usuarios = CacheLRU(
+            tamanho=int(os.environ.get('CHROMEBOOKS_CACHE_USUARIOS', 256)),
+            ttl=float(os.environ.get('CHROMEBOOKS_CACHE_USUARIOS_TTL', 300)),
+        )
+        # Prefixos do autocompletar: quem digita repete os mesmos começos ("a", "an", "ana")
+        self.cache_autocompletar = CacheLRU(
+            tamanho=int(os.environ.get('CHROMEBOOKS_CACHE_AUTOCOMPLETAR', 1024)),
+            ttl=float(os.environ.get('CHROMEBOOKS_CACHE_AUTOCOMPLETAR_TTL', 30)),
+        )
+        # Trechos de página já renderizados (tabelas), por versão dos dados; limitado
+        # pelo total de caracteres (CHROMEBOOKS_CACHE_FRAGMENTOS_MB=0 desliga)
+        self.cache_fragmentos = None
+        fragmentos_mb = float(os.environ.get('CHROMEBOOKS_CACHE_FRAGMENTOS_MB', 16))
+        if fragmentos_mb > 0:
+            self.cache_fragmentos = CacheLRU(
+                tamanho=int(os.environ.get('CHROMEBOOKS_CACHE_FRAGMENTOS', 512)),
+                ttl=float(os.environ.get('CHROMEBOOKS_CACHE_FRAGMENTOS_TTL', 300)),
+                peso=len,
+                peso_maximo=int(fragmentos_mb * 1024 * 1024),
             )
-        ''')
-        
-        # Tabela de chromebooks - ATUALIZADA com turma_aluno
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS chromebooks (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                numero INTEGER UNIQUE NOT NULL,
-                carrinho TEXT NOT NULL,
-                status TEXT DEFAULT 'Disponível',
-                aluno_emprestado TEXT,
-                turma_aluno TEXT,
-                data_emprestimo TEXT,
-                professor_emprestimo TEXT
+        # Escritas deste processo (cada uma força reler a versão do disco)
+        self._versao = 0
+        self._lock_versao = threading.Lock()
+        # Versão do disco já lida: (marca local, versão, instante), relida no máximo a
+        # cada CHROMEBOOKS_VERSAO_VERIFICACAO_MS ou logo após uma escrita deste processo
+        self.intervalo_versao = float(os.environ.get('CHROMEBOOKS_VERSAO_VERIFICACAO_MS', 1000)) / 1000
+        self._versao_lida = None
+        # Arquivos do histórico existentes no disco: (versão dos dados, [(linha registrada, caminho)]),
+        # relidos quando a versão muda (arquivar apaga do histórico) ou por arquivar_periodo
+        self._arquivos = None
+        # Cópia do inventário em memória para as leituras (CHROMEBOOKS_INVENTARIO_MEMORIA=0 desliga)
+        self.inventario = None
+        if os.environ.get('CHROMEBOOKS_INVENTARIO_MEMORIA', '1').lower() in ('1', 'true', 'sim'):
+            self.inventario = InventarioMemoria(
+                intervalo_verificacao=float(os.environ.get('CHROMEBOOKS_INVENTARIO_VERIFICACAO_MS', 1000)) / 1000,
             )
-        ''')
-        
-        # Tabela de histórico - ATUALIZADA com turma
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS historico (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                chromebook_numero INTEGER,
-                carrinho TEXT,
-                aluno TEXT,
-                turma TEXT,
-                professor TEXT,
-                data_emprestimo TEXT,
-                data_devolucao TEXT,
-                tipo_acao TEXT
+        # inventario_versao antes/depois da última transação imediata desta thread:
+        # _apos_escrita repassa ao inventário, que reconhece as próprias escritas
+        self._versoes_escrita = threading.local()
+        # Nada aqui abre o banco: isso fica para inicializar(), no primeiro uso
+        self.inicializado = False
+        self._lock_inicializacao = threading.Lock()
+        # Histórico em write-behind (opcional): gravado em lotes por uma thread
+        if historico_assincrono is None:
+            historico_assincrono = os.environ.get('CHROMEBOOKS_HISTORICO_ASSINCRONO', '').lower() in ('1', 'true', 'sim')
+        self.fila_historico = None
+        self.ler_historico_pendente = os.environ.get('CHROMEBOOKS_HISTORICO_LER_PENDENTES', '1').lower() in ('1', 'true', 'sim')
+        if historico_assincrono:
+            self.fila_historico = FilaHistorico(
+                self.transacao_imediata,
+                self.db_name + '-historico',
+                tamanho_lote=int(os.environ.get('CHROMEBOOKS_HISTORICO_LOTE', 100)),
+                intervalo=float(os.environ.get('CHROMEBOOKS_HISTORICO_INTERVALO_MS', 50)) / 1000,
+                ao_inserir=uso.acumular,
+                sincronizar=os.environ.get('CHROMEBOOKS_HISTORICO_FSYNC', '1').lower() in ('1', 'true', 'sim'),
             )
-        ''')
-        
-        conn.commit()
-        conn.close()
-        
-        # Criar usuário padrão se não existir
-        self.criar_usuario_padrao()
+            atexit.register(self.fila_historico.fechar)
+        if self.metricas is not None:
+            self._registrar_medidores()
 
-    def criar_usuario_padrao(self):
+    def _registrar_medidores(self):
+        medidor = self.metricas.medidor
+        medidor('chromebooks_pool_conexoes_abertas', 'Conexões abertas no pool.', self.pool.abertas)
+        medidor('chromebooks_pool_conexoes_ociosas', 'Conexões paradas no pool.', self.pool.ociosas)
+        medidor('chromebooks_eventos_assinantes', 'Navegadores conectados em /api/eventos.',
+                lambda: self.eventos.total_assinantes)
+        medidor('chromebooks_cache_usuarios_itens', 'Usuários no cache.', lambda: self.cache_usuarios.estatisticas()['itens'])
+        medidor('chromebooks_logins_recusados', 'Logins recusados por excesso de tentativas (desde o início).',
+                lambda: self.senhas.recusadas)
+        if self.fila_historico is not None:
+            medidor('chromebooks_historico_pendentes', 'Linhas de histórico ainda não gravadas.',
+                    lambda: self.fila_historico.total_pendentes)
+
+    def _nova_versao(self):
+        with self._lock_versao:
+            self._versao += 1
+        if self.cache_fragmentos is not None:
+            self.cache_fragmentos.limpar()  # as chaves levam a versão: nada antigo seria lido de novo
+
+    def versao_leitura(self):
+        """Versão dos dados no disco, igual em todos os processos (base das chaves de cache).
+
+        Junta inventario_versao e dados_versao: muda com qualquer escrita em
+        chromebooks, histórico (inclusive a fila de outro worker e o arquivamento)
+        ou usuários. Se o inventário em memória está atrás do disco, é
+        sincronizado antes, para nada ser renderizado com dados mais velhos que a chave.
+
+        O valor lido vale por ``intervalo_versao`` segundos: a maioria das
+        chamadas (ETags, fragmentos) não consulta o banco. Escritas deste
+        processo, inclusive os lotes da fila de histórico, invalidam na hora;
+        as de outros processos aparecem em até um intervalo.
+        """
+        marca = (self._versao, self.fila_historico.gravados if self.fila_historico is not None else 0)
+        lida = self._versao_lida
+        if lida is not None and lida[0] == marca and time.monotonic() - lida[2] < self.intervalo_versao:
+            return lida[1]
+        with self.conexao() as conn:
+            inventario, dados = conn.execute(SQL_VERSOES_DISCO).fetchone()
+            if self.inventario is not None and inventario != self.inventario.versao_disco:
+                if self.inventario.sincronizar(conn):
+                    self._escrita_externa()
+        versao = f"{inventario}-{dados}"
+        self._versao_lida = (marca, versao, time.monotonic())
+        return versao
+
+    def get_connection(self):
+        if self.metricas is None:
+            return ConexaoPool(self.pool.obter(), self.pool)
+        inicio = time.perf_counter()
+        conn = ConexaoPool(self.pool.obter(), self.pool)
+        self.metricas.registrar_conexao(time.perf_counter() - inicio)
+        return ConexaoMedida(conn, self.metricas)
+
+    @contextmanager
+    def conexao(self):
+        """Empresta uma conexão do pool e garante a devolução (com rollback se necessário)."""
         conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM usuarios WHERE username = 'admin'")
-        if not cursor.fetchone():
-            cursor.execute("INSERT INTO usuarios (username, senha, nome) VALUES (?, ?, ?)",
-                          ('admin', generate_password_hash('1234'), 'Administrador'))
-            conn.commit()
-        conn.close()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def transacao_imediata(self, operacao, espera_inicial=0.05):
+        """Executa ``operacao(cursor)`` dentro de BEGIN IMMEDIATE e faz o commit.
+
+        O lock de escrita é obtido já no início, então não há upgrade de lock no
+        meio da transação. Se o banco continuar ocupado, a transação inteira é
+        repetida com backoff exponencial (e jitter) até ``tentativas_escrita`` vezes.
+        Guarda inventario_versao do início e do fim da transação (nenhum outro
+        processo escreve entre as duas leituras): assim as escritas deste processo
+        não se confundem com as de outros. O histórico reservado na fila durante
+        a transação é confirmado depois do commit ou retirado se ela falhar.
+        """
+        self._versoes_escrita.valor = None
+        for tentativa in range(self.tentativas_escrita):
+            try:
+                with self.conexao() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute("BEGIN IMMEDIATE")
+                    try:
+                        antes = self._versao_inventario(cursor)
+                        resultado = operacao(cursor)
+                        depois = self._versao_inventario(cursor)
+                        conn.commit()
+                    except BaseException:
+                        if self.fila_historico is not None:
+                            self.fila_historico.cancelar()
+                        raise
+                    if self.fila_historico is not None:
+                        self.fila_historico.confirmar()
+                    if antes is not None and depois is not None:
+                        self._versoes_escrita.valor = (antes, depois)
+                    return resultado
+            except sqlite3.OperationalError as e:
+                if not banco_ocupado(e) or tentativa == self.tentativas_escrita - 1:
+                    raise
+                time.sleep(espera_inicial * (2 ** tentativa) * random.uniform(0.5, 1.5))
+
+    def _versao_inventario(self, cursor):
+        linha = cursor.execute(SQL_VERSAO_INVENTARIO).fetchone()
+        return linha[0] if linha else None
+
+    def _gravar_historico(self, cursor, linhas):
+        """Insere as linhas (e soma nos resumos de uso) na transação corrente, ou deixa para a fila no modo assíncrono.
+
+        As linhas seguem COLUNAS_HISTORICO sem o id; no modo assíncrono elas vão
+        para o spool da fila ainda antes do commit (``transacao_imediata`` as
+        confirma ou retira no fim).
+        """
+        if self.fila_historico is None:
+            cursor.executemany(SQL_INSERIR_HISTORICO, linhas)
+            uso.acumular(cursor, linhas)
+        else:
+            self.fila_historico.reservar(linhas)
+
+    def _apos_escrita(self, acao, itens=(), recarregar=False):
+        """Chamado após cada commit que altera o inventário: notifica os assinantes de eventos."""
+        versoes, self._versoes_escrita.valor = getattr(self._versoes_escrita, 'valor', None), None
+        itens = list(itens)
+        if not itens and not recarregar:
+            return
+        if self.inventario is None:
+            if versoes is not None and versoes[0] == self._versao_disco_vista:
+                self._versao_disco_vista = versoes[1]
+        else:
+            with self.conexao() as conn:
+                if recarregar or len(itens) > 500:
+                    self.inventario.carregar(conn)
+                else:
+                    self.inventario.atualizar(conn, [item['numero'] for item in itens], versoes)
+        self._nova_versao()
+        if len(itens) > 100:
+            itens, recarregar = [], True
+        self.eventos.publicar('inventario', {'acao': acao, 'itens': itens, 'recarregar': recarregar})
+
+    def criar_tabelas(self):
+        """Aplica as migrações pendentes (uma vez por banco, inclusive o usuário padrão)."""
+        with self.conexao() as conn:
+            aplicar_migracoes(conn)
+            if self.inventario is not None:
+                self.inventario.carregar(conn)
+
+    def inicializar(self):
+        """Preparação do processo antes do primeiro uso: schema, inventário e fila do histórico.
+
+        Idempotente e segura entre threads. Com o schema em dia (carimbo em
+        schema_version) custa uma leitura e não pega o lock de escrita.
+        """
+        if self.inicializado:
+            return
+        with self._lock_inicializacao:
+            if self.inicializado:
+                return
+            inicio = time.perf_counter()
+            self.criar_tabelas()
+            if self.fila_historico is not None:
+                self.fila_historico.iniciar()
+            if self.inventario is None:
+                with self.conexao() as conn:
+                    self._versao_disco_vista = self._versao_inventario(conn.cursor())
+            self.inicializado = True
+            log.info("Banco de dados inicializado", extra={'banco': self.db_name,
+                                                           'ms': round((time.perf_counter() - inicio) * 1000, 1)})
+
+    def _inventario_atual(self):
+        """Inventário em memória, recarregado se outro processo alterou o banco."""
+        if self.inventario.precisa_sincronizar():
+            with self.conexao() as conn:
+                if self.inventario.sincronizar(conn):
+                    self._escrita_externa()
+        return self.inventario
+
+    def _escrita_externa(self):
+        """Outro processo alterou o inventário: nova versão e aviso aos navegadores conectados aqui."""
+        self._nova_versao()
+        self.eventos.publicar('inventario', {'acao': 'externa', 'itens': [], 'recarregar': True})
+
+    def conferir_escritas_externas(self):
+        """Confere se outro processo alterou o inventário (publica 'recarregar' se sim)."""
+        if self.inventario is not None:
+            self._inventario_atual()
+            return
+        with self.conexao() as conn:
+            versao = self._versao_inventario(conn.cursor())
+        anterior, self._versao_disco_vista = self._versao_disco_vista, versao
+        if anterior is not None and versao != anterior:
+            self._escrita_externa()
+
+    def verificar_inventario(self):
+        """Compara a cópia em memória com o disco e recarrega se houver diferença.
+
+        Retorna os números que estavam divergentes (lista vazia se estava consistente).
+        """
+        if self.inventario is None:
+            return []
+        with self.conexao() as conn:
+            divergentes = self.inventario.divergencias(conn)
+            if divergentes:
+                self.inventario.carregar(conn)
+        if divergentes:
+            self._nova_versao()
+        return divergentes
+
+    def criar_usuario_padrao(self):
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id FROM usuarios WHERE username = 'admin'")
+            if not cursor.fetchone():
+                cursor.execute("INSERT INTO usuarios (username, senha, nome) VALUES (?, ?, ?)",
+                              ('admin', generate_password_hash('1234', METODO_HASH), 'Administrador'))
+                conn.commit()
+                self._nova_versao()
 
     def verificar_usuario_existe(self, username):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM usuarios WHERE username = ?", (username,))
-        resultado = cursor.fetchone()
-        conn.close()
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id FROM usuarios WHERE username = ?", (username,))
+            resultado = cursor.fetchone()
         return resultado is not None
 
     def criar_usuario(self, username, senha, nome):
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT INTO usuarios (username, senha, nome) VALUES (?, ?, ?)",
-                (username, generate_password_hash(senha), nome)
-            )
-            conn.commit()
-            conn.close()
+            senha_hash = self.senhas.gerar_hash(senha)
+            with self.conexao() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    "INSERT INTO usuarios (username, senha, nome) VALUES (?, ?, ?)",
+                    (username, senha_hash, nome)
+                )
+                conn.commit()
+            self.invalidar_usuario(cursor.lastrowid)
+            self._nova_versao()
             return True, "Usuário criado com sucesso"
         except sqlite3.IntegrityError:
             return False, "Usuário já existe"
@@ -94,59 +546,84 @@ class Database:
             return False, str(e)
 
     # método de login (com suporte a hash e texto simples)
-    def verificar_login(self, username, senha_digitada):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, username, senha, nome FROM usuarios WHERE username = ?", (username,))
-        row = cursor.fetchone()
-        conn.close()
+    def verificar_login(self, username, senha_digitada, endereco=None):
+        """Confere a senha no pool de hash e, se o hash estiver desatualizado
+        (texto simples ou custo antigo), grava um novo com os parâmetros atuais.
 
-        if not row:
+        Levanta senhas.LoginLimitado quando o usuário (a partir de ``endereco``,
+        o IP do cliente) ou o servidor excedem o limite.
+        """
+        with self.senhas.tentativa(username, endereco) as tentativa:
+            with self.conexao() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT id, username, senha, nome FROM usuarios WHERE username = ?", (username,))
+                row = cursor.fetchone()
+
+            if not row:
+                return None
+
+            user_id, username_db, senha_db, nome = row
+            tentativa.sucesso = self.senhas.conferir(senha_db, senha_digitada)
+
+        if not tentativa.sucesso:
             return None
 
-        user_id, username_db, senha_db, nome = row
+        if precisa_rehash(senha_db):
+            self._atualizar_hash(user_id, senha_db, senha_digitada)
 
-        # tenta verificar hash
+        return {'id': user_id, 'nome': nome, 'is_admin': (username_db.lower() == 'admin')}
+
+    def _atualizar_hash(self, user_id, senha_antiga, senha):
         try:
-            if check_password_hash(senha_db, senha_digitada):
-                return {'id': user_id, 'nome': nome, 'is_admin': (username_db.lower() == 'admin')}
-        except Exception:
-            pass
+            novo_hash = self.senhas.gerar_hash(senha)
+            with self.conexao() as conn:
+                # só troca se ninguém alterou a senha nesse meio tempo
+                conn.execute("UPDATE usuarios SET senha = ? WHERE id = ? AND senha = ?", (novo_hash, user_id, senha_antiga))
+                conn.commit()
+            self._nova_versao()
+        except Exception as e:
+            # o login já foi validado; a atualização fica para a próxima vez
+            log.warning("Não foi possível atualizar o hash da senha: %s", e, extra={'usuario_id': user_id})
 
-        # fallback: comparar texto simples
-        if senha_db == senha_digitada:
-            return {'id': user_id, 'nome': nome, 'is_admin': (username_db.lower() == 'admin')}
+    def buscar_usuario_por_id(self, user_id):
+        """Usuário pelo id, servido do cache LRU (inclusive ids inexistentes)."""
+        try:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            return None
+        usuario = self.cache_usuarios.obter(user_id, lambda: self._carregar_usuario(user_id))
+        return dict(usuario) if usuario else None
 
-        return None
+    def _carregar_usuario(self, user_id):
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, username, nome FROM usuarios WHERE id = ?", (user_id,))
+            row = cursor.fetchone()
 
-    def buscar_usuario_por_id(self, user_id):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, username, nome FROM usuarios WHERE id = ?", (user_id,))
-        row = cursor.fetchone()
-        conn.close()
-        
         if not row:
             return None
-            
+
         user_id, username_db, nome = row
         return {'id': user_id, 'username': username_db, 'nome': nome, 'is_admin': (username_db.lower() == 'admin')}
 
+    def invalidar_usuario(self, user_id):
+        """Deve ser chamado por qualquer escrita que altere ou remova um usuário."""
+        self.cache_usuarios.invalidar(int(user_id))
+
     def obter_usuarios(self):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, username, senha, nome FROM usuarios")
-        usuarios = cursor.fetchall()
-        conn.close()
-        return usuarios
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, username, senha, nome FROM usuarios")
+            return cursor.fetchall()
 
     def cadastrar_chromebook(self, numero, carrinho):
-        try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
+        def cadastrar(cursor):
             cursor.execute("INSERT INTO chromebooks (numero, carrinho, status) VALUES (?, ?, 'Disponível')", (numero, carrinho))
-            conn.commit()
-            conn.close()
+            self._ajustar_contador(cursor, carrinho, 'Disponível', 1)
+
+        try:
+            self.transacao_imediata(cadastrar)
+            self._apos_escrita('cadastro', [{'numero': numero, 'carrinho': carrinho, 'status': 'Disponível'}])
             return True, "Chromebook cadastrado com sucesso!"
         except sqlite3.IntegrityError:
             return False, "Chromebook com este número já existe!"
@@ -155,137 +632,677 @@ class Database:
 
     # resto das funções
     def registrar_emprestimo(self, numero_chromebook, carrinho, nome_aluno, turma, professor):
-        try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM chromebooks WHERE numero = ? AND carrinho = ?", (numero_chromebook, carrinho))
-            chromebook = cursor.fetchone()
-            if not chromebook:
-                cursor.execute(
-                    "INSERT INTO chromebooks (numero, carrinho, status, aluno_emprestado, turma_aluno, data_emprestimo, professor_emprestimo) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                    (numero_chromebook, carrinho, 'Emprestado', nome_aluno, turma, datetime.now().strftime("%d/%m/%Y %H:%M"), professor)
-                )
+        data = agora()
+
+        def emprestar(cursor):
+            # A condição no WHERE decide quem leva o chromebook: só uma transação vê rowcount 1
+            cursor.execute(SQL_MARCAR_EMPRESTADO, (nome_aluno, turma, data, professor, numero_chromebook, carrinho))
+            if cursor.rowcount == 1:
+                self._ajustar_contadores(cursor, {(carrinho, 'Disponível'): -1, (carrinho, 'Emprestado'): 1})
             else:
-                if chromebook[3] == 'Emprestado':
-                    return False, "Chromebook já está emprestado"
                 cursor.execute(
-                    "UPDATE chromebooks SET status = ?, aluno_emprestado = ?, turma_aluno = ?, data_emprestimo = ?, professor_emprestimo = ? WHERE numero = ? AND carrinho = ?",
-                    ('Emprestado', nome_aluno, turma, datetime.now().strftime("%d/%m/%Y %H:%M"), professor, numero_chromebook, carrinho)
+                    "INSERT OR IGNORE INTO chromebooks (numero, carrinho, status, aluno_emprestado, turma_aluno, data_emprestimo, professor_emprestimo) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (numero_chromebook, carrinho, 'Emprestado', nome_aluno, turma, data, professor)
                 )
-            cursor.execute(
-                "INSERT INTO historico (chromebook_numero, carrinho, aluno, turma, professor, data_emprestimo, tipo_acao) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                (numero_chromebook, carrinho, nome_aluno, turma, professor, datetime.now().strftime("%d/%m/%Y %H:%M"), 'Empréstimo')
-            )
-            conn.commit()
-            conn.close()
+                if cursor.rowcount != 1:
+                    return self._motivo_recusa(cursor, numero_chromebook, carrinho, 'Emprestado')
+                self._ajustar_contador(cursor, carrinho, 'Emprestado', 1)
+            self._gravar_historico(cursor, [linha])
+            return None
+
+        linha = (numero_chromebook, carrinho, nome_aluno, turma, professor, data, None, 'Empréstimo')
+        try:
+            recusa = self.transacao_imediata(emprestar)
+            if recusa:
+                return False, recusa
+            self._apos_escrita('emprestimo', [{'numero': numero_chromebook, 'carrinho': carrinho, 'status': 'Emprestado',
+                                               'aluno': nome_aluno, 'turma': turma}])
             return True, f"Chromebook {numero_chromebook} emprestado para {nome_aluno} (Turma: {turma})"
         except Exception as e:
             return False, str(e)
 
     def registrar_devolucao(self, numero_chromebook, carrinho):
+        data = agora()
+
+        def devolver(cursor):
+            # Dentro do BEGIN IMMEDIATE ninguém altera a linha entre a leitura e o UPDATE condicional
+            cursor.execute(
+                "SELECT aluno_emprestado, turma_aluno, professor_emprestimo, data_emprestimo "
+                "FROM chromebooks WHERE numero = ? AND carrinho = ? AND status = 'Emprestado'",
+                (numero_chromebook, carrinho)
+            )
+            emprestimo = cursor.fetchone()
+            if emprestimo is None:
+                return None, self._motivo_recusa(cursor, numero_chromebook, carrinho, 'Disponível')
+            cursor.execute(SQL_MARCAR_DISPONIVEL, (numero_chromebook, carrinho))
+            if cursor.rowcount != 1:
+                raise sqlite3.IntegrityError("Status do chromebook mudou durante a devolução")
+            self._ajustar_contadores(cursor, {(carrinho, 'Emprestado'): -1, (carrinho, 'Disponível'): 1})
+            # data_emprestimo guarda o início do empréstimo para o cálculo de duração
+            aluno, turma, professor, data_emprestimo = emprestimo
+            linha = (numero_chromebook, carrinho, aluno, turma, professor, data_emprestimo, data, 'Devolução')
+            self._gravar_historico(cursor, [linha])
+            return linha, None
+
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM chromebooks WHERE numero = ? AND carrinho = ?", (numero_chromebook, carrinho))
-            chromebook = cursor.fetchone()
-            if not chromebook:
-                return False, "Chromebook não encontrado"
-            if chromebook[3] == 'Disponível':
-                return False, "Chromebook já está disponível"
-            cursor.execute("UPDATE chromebooks SET status = 'Disponível', aluno_emprestado = NULL, turma_aluno = NULL, data_emprestimo = NULL, professor_emprestimo = NULL WHERE numero = ? AND carrinho = ?", (numero_chromebook, carrinho))
-            cursor.execute("INSERT INTO historico (chromebook_numero, carrinho, aluno, turma, professor, data_devolucao, tipo_acao) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                           (numero_chromebook, carrinho, chromebook[4], chromebook[5], chromebook[6], datetime.now().strftime("%d/%m/%Y %H:%M"), 'Devolução'))
-            conn.commit()
-            conn.close()
+            _, recusa = self.transacao_imediata(devolver)
+            if recusa:
+                return False, recusa
+            self._apos_escrita('devolucao', [{'numero': numero_chromebook, 'carrinho': carrinho, 'status': 'Disponível'}])
             return True, f"Chromebook {numero_chromebook} devolvido"
         except Exception as e:
             return False, str(e)
 
+    def _motivo_recusa(self, cursor, numero, carrinho, status_desejado):
+        """Mensagem para uma escrita condicional que não afetou nenhuma linha."""
+        cursor.execute("SELECT carrinho, status FROM chromebooks WHERE numero = ?", (numero,))
+        atual = cursor.fetchone()
+        if atual is None or (status_desejado == 'Disponível' and atual[0] != carrinho):
+            return "Chromebook não encontrado"
+        if atual[0] != carrinho:
+            return f"Chromebook pertence ao carrinho {atual[0]}"
+        if status_desejado == 'Emprestado':
+            return "Chromebook já está emprestado"
+        return "Chromebook já está disponível"
+
+    def registrar_emprestimos_lote(self, itens, professor):
+        """Empresta vários chromebooks numa única transação.
+
+        ``itens`` é uma lista de (numero, carrinho, aluno, turma). Itens inválidos
+        são recusados individualmente; os demais são gravados juntos com
+        executemany. Retorna um resultado por item, na ordem recebida.
+        """
+        data = agora()
+        resultados = []
+
+        def emprestar(cursor):
+            resultados[:] = [{'numero': item[0], 'carrinho': item[1], 'sucesso': False, 'mensagem': ''} for item in itens]
+            atuais = self._status_por_numero(cursor, [item[0] for item in itens])
+
+            novos, atualizados, historico, deltas, vistos = [], [], [], {}, set()
+            for resultado, (numero, carrinho, aluno, turma) in zip(resultados, itens):
+                if not carrinho or not aluno or not turma:
+                    resultado['mensagem'] = "Preencha todos os campos!"
+                    continue
+                if numero in vistos:
+                    resultado['mensagem'] = "Chromebook repetido no lote"
+                    continue
+                vistos.add(numero)
+                atual = atuais.get(numero)
+                if atual is None:
+                    novos.append((numero, carrinho, 'Emprestado', aluno, turma, data, professor))
+                elif atual[0] != carrinho:
+                    resultado['mensagem'] = f"Chromebook pertence ao carrinho {atual[0]}"
+                    continue
+                elif atual[1] != 'Disponível':
+                    resultado['mensagem'] = "Chromebook já está emprestado"
+                    continue
+                else:
+                    atualizados.append((aluno, turma, data, professor, numero, carrinho))
+                    deltas[(carrinho, 'Disponível')] = deltas.get((carrinho, 'Disponível'), 0) - 1
+                deltas[(carrinho, 'Emprestado')] = deltas.get((carrinho, 'Emprestado'), 0) + 1
+                historico.append((numero, carrinho, aluno, turma, professor, data, None, 'Empréstimo'))
+                resultado['sucesso'] = True
+                resultado['mensagem'] = f"Chromebook {numero} emprestado para {aluno} (Turma: {turma})"
+
+            cursor.executemany(
+                "INSERT INTO chromebooks (numero, carrinho, status, aluno_emprestado, turma_aluno, data_emprestimo, professor_emprestimo) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                novos
+            )
+            cursor.executemany(SQL_MARCAR_EMPRESTADO, atualizados)
+            if atualizados and cursor.rowcount != len(atualizados):
+                raise sqlite3.IntegrityError("Status dos chromebooks mudou durante o lote")
+            self._gravar_historico(cursor, historico)
+            self._ajustar_contadores(cursor, deltas)
+            return historico
+
+        try:
+            historico = self.transacao_imediata(emprestar)
+            self._apos_escrita('emprestimo', [
+                {'numero': numero, 'carrinho': carrinho, 'status': 'Emprestado', 'aluno': aluno, 'turma': turma}
+                for numero, carrinho, aluno, turma, *_ in historico
+            ])
+        except Exception as e:
+            resultados[:] = [{'numero': item[0], 'carrinho': item[1], 'sucesso': False, 'mensagem': str(e)} for item in itens]
+        return resultados
+
+    def registrar_devolucoes_lote(self, itens):
+        """Devolve vários chromebooks numa única transação (``itens``: lista de (numero, carrinho))."""
+        data = agora()
+        resultados = []
+
+        def devolver(cursor):
+            resultados[:] = [{'numero': item[0], 'carrinho': item[1], 'sucesso': False, 'mensagem': ''} for item in itens]
+            atuais = self._status_por_numero(cursor, [item[0] for item in itens])
+
+            atualizados, historico, deltas, vistos = [], [], {}, set()
+            for resultado, (numero, carrinho) in zip(resultados, itens):
+                if numero in vistos:
+                    resultado['mensagem'] = "Chromebook repetido no lote"
+                    continue
+                vistos.add(numero)
+                atual = atuais.get(numero)
+                if atual is None or atual[0] != carrinho:
+                    resultado['mensagem'] = "Chromebook não encontrado"
+                    continue
+                if atual[1] != 'Emprestado':
+                    resultado['mensagem'] = "Chromebook já está disponível"
+                    continue
+                _, status, aluno, turma, professor, data_emprestimo = atual
+                atualizados.append((numero, carrinho))
+                historico.append((numero, carrinho, aluno, turma, professor, data_emprestimo, data, 'Devolução'))
+                deltas[(carrinho, 'Emprestado')] = deltas.get((carrinho, 'Emprestado'), 0) - 1
+                deltas[(carrinho, 'Disponível')] = deltas.get((carrinho, 'Disponível'), 0) + 1
+                resultado['sucesso'] = True
+                resultado['mensagem'] = f"Chromebook {numero} devolvido"
+
+            cursor.executemany(SQL_MARCAR_DISPONIVEL, atualizados)
+            if atualizados and cursor.rowcount != len(atualizados):
+                raise sqlite3.IntegrityError("Status dos chromebooks mudou durante o lote")
+            self._gravar_historico(cursor, historico)
+            self._ajustar_contadores(cursor, deltas)
+            return atualizados
+
+        try:
+            atualizados = self.transacao_imediata(devolver)
+            self._apos_escrita('devolucao', [
+                {'numero': numero, 'carrinho': carrinho, 'status': 'Disponível'} for numero, carrinho in atualizados
+            ])
+        except Exception as e:
+            resultados[:] = [{'numero': item[0], 'carrinho': item[1], 'sucesso': False, 'mensagem': str(e)} for item in itens]
+        return resultados
+
+    def importar_chromebooks(self, registros, simular=False, tamanho_bloco=500):
+        """Cadastra chromebooks em massa a partir de um iterável de (linha, numero, carrinho).
+
+        Os registros são consumidos em blocos: cada bloco é validado, comparado
+        com o banco numa única consulta e gravado com executemany. Linhas com
+        erro ou duplicadas são relatadas sem interromper a importação. Com
+        ``simular=True`` nada é gravado (pré-visualização).
+        """
+        relatorio = {'inseridos': 0, 'duplicados': 0, 'erros': 0, 'simulacao': simular, 'linhas': []}
+        vistos = set()
+
+        def classificar(cursor, bloco):
+            # Só lê e decide; o relatório é preenchido depois que o bloco foi gravado
+            existentes = self._status_por_numero(cursor, [numero for _, numero, _ in bloco])
+            itens, novos, deltas, no_bloco = [], [], {}, set()
+            for linha, numero, carrinho in bloco:
+                item = {'linha': linha, 'numero': numero, 'carrinho': carrinho}
+                if numero in existentes or numero in vistos or numero in no_bloco:
+                    item['situacao'], item['mensagem'] = 'duplicado', "Chromebook com este número já existe!"
+                else:
+                    no_bloco.add(numero)
+                    novos.append((numero, carrinho))
+                    deltas[(carrinho, 'Disponível')] = deltas.get((carrinho, 'Disponível'), 0) + 1
+                    item['situacao'], item['mensagem'] = 'novo', "Chromebook cadastrado com sucesso!"
+                itens.append(item)
+            return itens, novos, deltas
+
+        def gravar(cursor, bloco):
+            # Dentro do BEGIN IMMEDIATE ninguém cadastra entre a conferência e o INSERT
+            itens, novos, deltas = classificar(cursor, bloco)
+            cursor.executemany("INSERT INTO chromebooks (numero, carrinho, status) VALUES (?, ?, 'Disponível')", novos)
+            self._ajustar_contadores(cursor, deltas)
+            return itens, novos
+
+        def processar(bloco):
+            try:
+                if simular:
+                    with self.conexao() as conn:
+                        itens, novos, _ = classificar(conn.cursor(), bloco)
+                else:
+                    itens, novos = self.transacao_imediata(lambda cursor: gravar(cursor, bloco))
+            except Exception as e:
+                # Falha do banco neste bloco: as linhas dele saem como erro e os próximos seguem
+                log.warning("Falha ao importar bloco de chromebooks: %s", e)
+                relatorio['erros'] += len(bloco)
+                relatorio['linhas'].extend({'linha': linha, 'numero': numero, 'carrinho': carrinho,
+                                            'situacao': 'erro', 'mensagem': f'Não gravado: {e}'}
+                                           for linha, numero, carrinho in bloco)
+                return
+            vistos.update(numero for numero, _ in novos)
+            relatorio['inseridos'] += len(novos)
+            relatorio['duplicados'] += len(itens) - len(novos)
+            relatorio['linhas'].extend(itens)
+            if novos and not simular:
+                self._apos_escrita('cadastro', [
+                    {'numero': numero, 'carrinho': carrinho, 'status': 'Disponível'} for numero, carrinho in novos
+                ])
+
+        bloco = []
+        for linha, numero, carrinho in registros:
+            numero = str(numero if numero is not None else '').strip()
+            carrinho = str(carrinho if carrinho is not None else '').strip()
+            if not numero_valido(numero) or int(numero) < 1 or not carrinho:
+                relatorio['erros'] += 1
+                relatorio['linhas'].append({'linha': linha, 'numero': numero, 'carrinho': carrinho,
+                                            'situacao': 'erro', 'mensagem': 'Número ou carrinho inválido'})
+                continue
+            bloco.append((linha, int(numero), carrinho))
+            if len(bloco) >= tamanho_bloco:
+                processar(bloco)
+                bloco = []
+        if bloco:
+            processar(bloco)
+
+        relatorio['linhas'].sort(key=lambda item: item['linha'])
+        return relatorio
+
+    def _status_por_numero(self, cursor, numeros, tamanho_bloco=500):
+        """numero -> (carrinho, status, aluno, turma, professor, data_emprestimo) dos chromebooks existentes."""
+        numeros = list(dict.fromkeys(numeros))
+        atuais = {}
+        for i in range(0, len(numeros), tamanho_bloco):
+            bloco = numeros[i:i + tamanho_bloco]
+            cursor.execute(
+                "SELECT numero, carrinho, status, aluno_emprestado, turma_aluno, professor_emprestimo, data_emprestimo "
+                f"FROM chromebooks WHERE numero IN ({', '.join('?' * len(bloco))})",
+                bloco
+            )
+            for numero, *resto in cursor.fetchall():
+                atuais[numero] = tuple(resto)
+        return atuais
+
+    def _ajustar_contador(self, cursor, carrinho, status, delta):
+        """Atualiza o contador (carrinho, status) dentro da transação corrente."""
+        self._ajustar_contadores(cursor, {(carrinho, status): delta})
+
+    def _ajustar_contadores(self, cursor, deltas):
+        cursor.executemany(
+            "INSERT INTO estatisticas_chromebooks (carrinho, status, quantidade) VALUES (?, ?, ?) "
+            "ON CONFLICT (carrinho, status) DO UPDATE SET quantidade = quantidade + excluded.quantidade",
+            [(carrinho, status or '', delta) for (carrinho, status), delta in deltas.items() if delta]
+        )
+
+    def recalcular_estatisticas(self):
+        """Reconstrói os contadores com uma única varredura agrupada de chromebooks."""
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM estatisticas_chromebooks")
+            cursor.execute("""
+                INSERT INTO estatisticas_chromebooks (carrinho, status, quantidade)
+                SELECT carrinho, COALESCE(status, ''), COUNT(*)
+                FROM chromebooks
+                GROUP BY status, carrinho
+            """)
+            conn.commit()
+        self._nova_versao()
+
     def obter_estatisticas(self):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM chromebooks WHERE status = 'Disponível'")
-        disponiveis = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(*) FROM chromebooks WHERE status = 'Emprestado'")
-        emprestados = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(*) FROM chromebooks")
-        total = cursor.fetchone()[0]
-        conn.close()
-        return {'disponiveis': disponiveis, 'emprestados': emprestados, 'total': total}
+        """Totais gerais e por carrinho lidos dos contadores (uma linha por carrinho/status)."""
+        if self.inventario is not None:
+            linhas = self._inventario_atual().contagens()
+        else:
+            with self.conexao() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT carrinho, status, quantidade FROM estatisticas_chromebooks WHERE quantidade > 0 ORDER BY carrinho")
+                linhas = cursor.fetchall()
+
+        stats = {'disponiveis': 0, 'emprestados': 0, 'total': 0, 'por_carrinho': {}}
+        for carrinho, status, quantidade in linhas:
+            carro = stats['por_carrinho'].setdefault(carrinho, {'disponiveis': 0, 'emprestados': 0, 'total': 0})
+            if status == 'Disponível':
+                stats['disponiveis'] += quantidade
+                carro['disponiveis'] += quantidade
+            elif status == 'Emprestado':
+                stats['emprestados'] += quantidade
+                carro['emprestados'] += quantidade
+            stats['total'] += quantidade
+            carro['total'] += quantidade
+        return stats
+
+    def obter_resumo_periodo(self, inicio, fim):
+        """Empréstimos, devoluções e duração média (minutos) dos eventos em [inicio, fim]."""
+        with self.conexao() as conn:
+            row = conn.execute(f"""
+                SELECT COALESCE(SUM(tipo_acao = 'Empréstimo'), 0),
+                       COALESCE(SUM(tipo_acao = 'Devolução'), 0),
+                       AVG(CASE WHEN tipo_acao = 'Devolução'
+                           THEN (julianday(data_devolucao) - julianday(data_emprestimo)) * 1440 END)
+                FROM historico
+                WHERE {SQL_DATA_EVENTO} BETWEEN ? AND ?
+            """, (inicio, fim_do_dia(fim))).fetchone()
+        return {
+            'emprestimos': row[0],
+            'devolucoes': row[1],
+            'duracao_media_minutos': round(row[2]) if row[2] is not None else None,
+        }
 
     def obter_todos_chromebooks(self):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Verificar se a coluna turma_aluno existe
-        cursor.execute("PRAGMA table_info(chromebooks)")
-        colunas = [col[1] for col in cursor.fetchall()]
-        
-        if 'turma_aluno' in colunas:
-            cursor.execute("SELECT numero, carrinho, status, aluno_emprestado, turma_aluno, professor_emprestimo, data_emprestimo FROM chromebooks ORDER BY carrinho, numero")
+        if self.inventario is not None:
+            return self._inventario_atual().listar()
+        with self.conexao() as conn:
+            return conn.execute(SQL_TODOS_CHROMEBOOKS).fetchall()
+
+    def obter_chromebooks_disponiveis(self, carrinho=None):
+        if self.inventario is not None:
+            chromebooks = self._inventario_atual().listar('Disponível', carrinho)
         else:
-            # Se a coluna não existe, usar consulta sem turma_aluno
-            cursor.execute("SELECT numero, carrinho, status, aluno_emprestado, NULL as turma_aluno, professor_emprestimo, data_emprestimo FROM chromebooks ORDER BY carrinho, numero")
-        
-        r = cursor.fetchall()
-        conn.close()
-        return r
-
-    def obter_chromebooks_disponiveis(self):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT numero, carrinho FROM chromebooks WHERE status = 'Disponível' ORDER BY carrinho, numero")
-        chromebooks = cursor.fetchall()
-        conn.close()
+            sql = "SELECT numero, carrinho FROM chromebooks WHERE status = 'Disponível'"
+            params = []
+            if carrinho is not None:
+                sql += " AND carrinho = ?"
+                params.append(carrinho)
+            with self.conexao() as conn:
+                chromebooks = conn.execute(sql + " ORDER BY carrinho, numero", params).fetchall()
         return [{'numero': cb[0], 'carrinho': cb[1]} for cb in chromebooks]
 
-        con = self.conectar()
-        cur = con.cursor()
-        cur.execute("SELECT numero, carrinho, status, nome_aluno, turma FROM chromebooks WHERE status='Emprestado'")
-        rows = cur.fetchall()
-        con.close()
-        return [
-            {"numero": r[0], "carrinho": r[1], "status": r[2], "aluno": r[3], "turma": r[4]}
-            for r in rows
-        ]
-    
-    def obter_historico(self):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Verificar se a coluna turma existe
-        cursor.execute("PRAGMA table_info(historico)")
-        colunas = [col[1] for col in cursor.fetchall()]
-        
-        if 'turma' in colunas:
-            cursor.execute('''
-                SELECT * FROM historico ORDER BY id DESC LIMIT 50
-            ''')
-        else:
-            # Se a coluna não existe, criar uma consulta alternativa
-            cursor.execute('''
-                SELECT id, chromebook_numero, carrinho, aluno, NULL as turma, professor, data_emprestimo, data_devolucao, tipo_acao 
-                FROM historico ORDER BY id DESC LIMIT 50
-            ''')
-            
-        historico = cursor.fetchall()
-        conn.close()
-        return historico
-    
+    def obter_historico(self, limite=50):
+        return self.buscar_historico(limite=limite)[0]
+
+    def buscar_historico(self, filtros=None, antes_de=None, limite=50):
+        """Página do histórico (mais recente primeiro) com paginação por cursor no id.
+
+        ``filtros`` aceita as chaves de FILTROS_HISTORICO; ``antes_de`` é o cursor
+        devolvido pela página anterior. Retorna (linhas, proximo_cursor), onde
+        proximo_cursor é None quando não há registros mais antigos.
+        """
+        condicoes, params = self._condicoes_historico(filtros)
+        if antes_de is not None:
+            condicoes.append("id < ?")
+            params.append(antes_de)
+        limite = max(1, min(int(limite), LIMITE_MAXIMO_HISTORICO))
+
+        where = " WHERE " + " AND ".join(condicoes) if condicoes else ""
+        ordem = " ORDER BY id DESC LIMIT ?"
+
+        incluir_pendentes = self.fila_historico is not None and self.ler_historico_pendente and antes_de is None
+        while True:
+            # Cópia da fila antes da leitura: os lotes gravados depois dela são
+            # descartados pelo marcador, lido no mesmo snapshot que o histórico
+            lotes = self.fila_historico.lotes_pendentes() if incluir_pendentes else []
+            with self.conexao() as conn:
+                select, params_select = self._select_historico(conn, filtros, 'main')
+                conn.execute("BEGIN")
+                try:
+                    aplicados = lotes_aplicados(conn, [nome for nome, _ in lotes])
+                    linhas = conn.execute(select + where + ordem, params_select + params + [limite + 1]).fetchall()
+                finally:
+                    conn.commit()
+                # Acabou o banco principal: continua nos arquivos de períodos anteriores que o filtro alcança
+                for arquivo in self._arquivos_historico(conn, filtros):
+                    if len(linhas) > limite:
+                        break
+                    with self._arquivo_anexado(conn, arquivo):
+                        select, params_select = self._select_historico(conn, filtros, 'arq')
+                        linhas += conn.execute(select + where + ordem,
+                                               params_select + params + [limite + 1 - len(linhas)]).fetchall()
+            pendentes = self._historico_pendente(
+                filtros, [linha for nome, lote in lotes if nome not in aplicados for linha in lote])
+            if len(pendentes) <= limite:
+                break
+            # Mais pendentes que uma página: as que ficassem de fora não teriam id
+            # para o cursor. Grava a fila e lê de novo, agora tudo no banco.
+            self.fila_historico.descarregar()
+
+        # As pendentes são mais novas que tudo no banco: a sequência por id é pendentes + linhas
+        depois_do_banco = linhas[0][0] + 1 if linhas else None
+        linhas = pendentes + linhas
+        proximo = None
+        if len(linhas) > limite:
+            linhas = linhas[:limite]
+            # cursor da última linha devolvida (se for pendente, a página seguinte começa no banco)
+            proximo = linhas[-1][0] if linhas[-1][0] is not None else depois_do_banco
+        return linhas, proximo
+
+    def exportar_historico(self, filtros=None, tamanho_lote=1000):
+        """Gerador com todo o histórico filtrado (ordem de id), lido em lotes de ``tamanho_lote``.
+
+        A conexão fica emprestada enquanto o gerador é consumido e volta ao pool
+        quando ele termina ou é fechado, então a memória não cresce com a tabela.
+        """
+        if self.fila_historico is not None:
+            self.fila_historico.descarregar()
+        condicoes, params = self._condicoes_historico(filtros)
+        where = " WHERE " + " AND ".join(condicoes) if condicoes else ""
+
+        def ler(conn, esquema):
+            select, params_select = self._select_historico(conn, filtros, esquema)
+            with closing(conn.execute(select + where + " ORDER BY id", params_select + params)) as cursor:
+                while True:
+                    linhas = cursor.fetchmany(tamanho_lote)
+                    if not linhas:
+                        break
+                    yield from linhas
+
+        with self.conexao() as conn:
+            # arquivos do mais antigo para o mais recente, depois o banco principal
+            for arquivo in reversed(self._arquivos_historico(conn, filtros)):
+                with self._arquivo_anexado(conn, arquivo):
+                    yield from ler(conn, 'arq')
+            yield from ler(conn, 'main')
+
+    def _arquivos_historico(self, conn, filtros):
+        """Arquivos (mais recente primeiro) cujo período cruza as datas do filtro."""
+        filtros = filtros or {}
+        data_fim = fim_do_dia(filtros['data_fim']) if filtros.get('data_fim') else None
+        versao = self.versao_leitura()
+        arquivos = self._arquivos
+        if arquivos is None or arquivos[0] != versao:
+            existentes = []
+            for linha in arquivamento.arquivos_registrados(conn):
+                caminho = arquivamento.resolver_caminho(self.db_name, linha[1])
+                if os.path.exists(caminho):
+                    existentes.append((linha, caminho))
+            arquivos = self._arquivos = (versao, existentes)
+        caminhos = dict((linha, caminho) for linha, caminho in arquivos[1])
+        return [caminhos[linha] for linha in
+                arquivamento.no_intervalo(caminhos, filtros.get('data_inicio'), data_fim)]
+
+    @contextmanager
+    def _arquivo_anexado(self, conn, caminho):
+        arquivamento.anexar(conn, caminho)
+        try:
+            yield conn
+        finally:
+            arquivamento.desanexar(conn)
+
+    def arquivar_periodo(self, periodo):
+        """Move um período encerrado do histórico para o arquivo dele (ver arquivamento.py)."""
+        if self.fila_historico is not None:
+            self.fila_historico.descarregar()
+        movidos = arquivamento.arquivar_periodo(self.db_name, periodo)
+        self._arquivos = None
+        self._nova_versao()
+        return movidos
+
+    def reconstruir_uso(self):
+        """Refaz os resumos de uso a partir do histórico e dos arquivos. Retorna quantos registros foram lidos.
+
+        O banco principal é refeito numa transação; cada arquivo soma na sua
+        (os ids que ainda estão no principal, de um arquivamento em andamento,
+        não contam duas vezes).
+        """
+        if self.fila_historico is not None:
+            self.fila_historico.descarregar()
+
+        def refazer(cursor):
+            uso.limpar(cursor)
+            uso.somar_fonte(cursor)
+            cursor.execute(SQL_NOVA_VERSAO_DADOS)  # o painel "hoje" lê dos resumos
+            cursor.execute("SELECT COUNT(*) FROM historico")
+            return cursor.fetchone()[0]
+
+        total = self.transacao_imediata(refazer)
+        with self.conexao() as conn:
+            for caminho in self._arquivos_historico(conn, {}):
+                with self._arquivo_anexado(conn, caminho):
+                    cursor = conn.cursor()
+                    cursor.execute("BEGIN IMMEDIATE")
+                    try:
+                        filtro = "AND id NOT IN (SELECT id FROM main.historico)"
+                        uso.somar_fonte(cursor, 'arq.historico', filtro)
+                        cursor.execute(SQL_NOVA_VERSAO_DADOS)
+                        cursor.execute(f"SELECT COUNT(*) FROM arq.historico WHERE true {filtro}")
+                        total += cursor.fetchone()[0]
+                        conn.commit()
+                    except Exception:
+                        conn.rollback()
+                        raise
+        return total
+
+    def relatorio_uso(self, dias=30, limite=10):
+        """Relatório de uso lido só dos resumos (ver uso.py)."""
+        with self.conexao() as conn:
+            return uso.relatorio(conn, dias, limite)
+
+    def autocompletar(self, tipo, texto, limite=10):
+        """Sugestões de aluno/turma/professor para o que foi digitado (ver busca.py), com cache por prefixo."""
+        limite = max(1, min(int(limite), LIMITE_MAXIMO_AUTOCOMPLETAR))
+        chave = (tipo, ' '.join(busca.termos(texto)), limite)
+        if not chave[1]:
+            return []
+
+        def carregar():
+            with self.conexao() as conn:
+                return busca.sugerir(conn, tipo, texto, limite)
+
+        return self.cache_autocompletar.obter(chave, carregar)
+
+    def reconstruir_busca(self):
+        """Refaz o índice textual do histórico e o vocabulário (inclusive dos arquivos). Retorna (registros, nomes)."""
+        if self.fila_historico is not None:
+            self.fila_historico.descarregar()
+
+        def refazer(cursor):
+            busca.reindexar_historico(cursor)
+            busca.limpar_nomes(cursor)
+            busca.somar_nomes(cursor)
+            cursor.execute(SQL_NOVA_VERSAO_DADOS)
+            cursor.execute("SELECT COUNT(*) FROM historico")
+            return cursor.fetchone()[0]
+
+        total = self.transacao_imediata(refazer)
+        with self.conexao() as conn:
+            for caminho in self._arquivos_historico(conn, {}):
+                with self._arquivo_anexado(conn, caminho):
+                    cursor = conn.cursor()
+                    cursor.execute("BEGIN IMMEDIATE")
+                    try:
+                        if not busca.criar_indice_historico(cursor, 'arq'):
+                            busca.reindexar_historico(cursor, 'arq')
+                        filtro = "AND id NOT IN (SELECT id FROM main.historico)"
+                        busca.somar_nomes(cursor, 'arq.historico', filtro)
+                        cursor.execute(SQL_NOVA_VERSAO_DADOS)
+                        cursor.execute(f"SELECT COUNT(*) FROM arq.historico WHERE true {filtro}")
+                        total += cursor.fetchone()[0]
+                        conn.commit()
+                    except Exception:
+                        conn.rollback()
+                        raise
+            nomes = conn.execute("SELECT COUNT(*) FROM nomes_busca").fetchone()[0]
+        self.cache_autocompletar.limpar()
+        return total, nomes
+
+    def obter_atrasados(self):
+        """Empréstimos atrasados agora (pelo índice dos empréstimos ativos), do mais antigo ao mais recente."""
+        with self.conexao() as conn:
+            return atrasos.em_atraso(conn, atrasos.carregar_regras(conn))
+
+    def listar_prazos(self):
+        """Prazo padrão (variáveis de ambiente) seguido das regras por turma e por carrinho."""
+        with self.conexao() as conn:
+            return [prazo.como_dict() for prazo in atrasos.carregar_regras(conn).todos()]
+
+    def definir_prazo(self, alvo, nome, minutos=None, hora_limite=None):
+        nome = (nome or '').strip()
+        if alvo not in atrasos.ALVOS or not nome:
+            return False, "Informe se o prazo é de um carrinho ou de uma turma e qual."
+        try:
+            prazo = atrasos.Prazo(minutos, hora_limite)
+        except ValueError:
+            return False, "Informe os minutos como número e o horário como HH:MM."
+        if prazo.minutos is None and prazo.hora_limite is None:
+            return False, "Informe a duração máxima, o horário limite ou ambos."
+        if prazo.minutos is not None and prazo.minutos <= 0:
+            return False, "A duração máxima deve ser maior que zero."
+        hora = prazo.como_dict()['hora_limite']
+        try:
+            with self.conexao() as conn:
+                conn.execute(
+                    "INSERT INTO prazos_emprestimo (alvo, nome, minutos, hora_limite) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (alvo, nome) DO UPDATE SET minutos = excluded.minutos, hora_limite = excluded.hora_limite",
+                    (alvo, nome, prazo.minutos, hora)
+                )
+                conn.commit()
+            return True, f"Prazo de {alvo} {nome}: {prazo.descricao()}"
+        except Exception as e:
+            return False, str(e)
+
+    def remover_prazo(self, alvo, nome):
+        with self.conexao() as conn:
+            removidos = conn.execute("DELETE FROM prazos_emprestimo WHERE alvo = ? AND nome = ?", (alvo, nome)).rowcount
+            conn.commit()
+        return (True, "Prazo removido") if removidos else (False, "Prazo não encontrado")
+
+    def _historico_pendente(self, filtros, pendentes):
+        """Registros ainda na fila de gravação (id None), mais recente primeiro, já filtrados."""
+        filtros = {chave: str(valor) for chave, valor in (filtros or {}).items()
+                   if valor not in (None, '') and chave in FILTROS_HISTORICO}
+        palavras = busca.termos(filtros.get('busca'))
+        linhas = []
+        for linha in reversed(pendentes):
+            linha = (None, *linha)
+            data_evento = linha[7] or linha[6] or ''
+            if 'data_inicio' in filtros and data_evento < filtros['data_inicio']:
+                continue
+            if 'data_fim' in filtros and data_evento > fim_do_dia(filtros['data_fim']):
+                continue
+            if any(str(linha[posicao]) != filtros[chave] for chave, posicao in POSICAO_FILTROS.items() if chave in filtros):
+                continue
+            if 'busca' in filtros and not busca.corresponde(palavras, linha[3], linha[4], linha[5]):
+                continue
+            linhas.append(linha)
+        return linhas
+
+    def _select_historico(self, conn, filtros, esquema):
+        """SELECT do histórico em ``esquema`` ('main' ou 'arq') e seus parâmetros (a consulta FTS5, se houver busca).
+
+        Arquivo antigo ainda sem historico_busca: a busca vira LIKE (mais lenta,
+        mas só leitura; o índice é criado por "python arquivamento.py verificar").
+        """
+        texto = (filtros or {}).get('busca')
+        consulta = busca.consulta_prefixos(texto)
+        if consulta is not None:
+            if esquema == 'main' or busca.tem_indice(conn, esquema):
+                return SQL_HISTORICO_BUSCA.format(esquema=esquema), [consulta]
+            condicao, params = busca.condicao_like(texto) or ('0', [])
+            return f"SELECT * FROM ({SQL_HISTORICO_ARQUIVO} WHERE {condicao})", params
+        return (SQL_HISTORICO if esquema == 'main' else SQL_HISTORICO_ARQUIVO), []
+
+    def _condicoes_historico(self, filtros):
+        condicoes, params = [], []
+        for chave, valor in (filtros or {}).items():
+            if valor in (None, '') or chave not in FILTROS_HISTORICO:
+                continue
+            if chave == 'data_fim':
+                valor = fim_do_dia(valor)
+            if FILTROS_HISTORICO[chave] is None:
+                continue
+            condicoes.append(FILTROS_HISTORICO[chave])
+            params.append(valor)
+        return condicoes, params
+
     def obter_chromebooks_emprestados(self):
         """Retorna todos os chromebooks emprestados no formato de dicionário JSON-friendly"""
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
+            if self.inventario is not None:
+                rows = [(numero, carrinho, status, aluno, turma, data, minutos_desde(data))
+                        for numero, carrinho, status, aluno, turma, _, data
+                        in self._inventario_atual().listar('Emprestado')]
+            else:
+                with self.conexao() as conn:
+                    cursor = conn.cursor()
 
-            cursor.execute("""
-                SELECT numero, carrinho, status, aluno_emprestado, turma_aluno
-                FROM chromebooks
-                WHERE status = 'Emprestado'
-                ORDER BY carrinho, numero
-            """)
-            rows = cursor.fetchall()
-            conn.close()
+                    cursor.execute("""
+                        SELECT numero, carrinho, status, aluno_emprestado, turma_aluno, data_emprestimo,
+                               CAST((julianday('now', 'localtime') - julianday(data_emprestimo)) * 1440 AS INTEGER)
+                        FROM chromebooks
+                        WHERE status = 'Emprestado'
+                        ORDER BY carrinho, numero
+                    """)
+                    rows = cursor.fetchall()
 
             # Converter tuplas -> dicionários
             resultado = []
@@ -295,11 +1312,12 @@ class Database:
                     "carrinho": r[1],
                     "status": r[2],
                     "aluno": r[3],
-                    "turma": r[4]
+                    "turma": r[4],
+                    "data_emprestimo": r[5],
+                    "minutos_emprestado": r[6]
                 })
             return resultado
 
         except Exception as e:
-            print("❌ Erro em obter_chromebooks_emprestados:", e)
-            import traceback; traceback.print_exc()
+            log.exception("Erro em obter_chromebooks_emprestados: %s", e)
             return []
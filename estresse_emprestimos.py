@@ -0,0 +1,128 @@
+"""Teste de concorrência de empréstimos e devoluções.
+
+Várias threads (cada uma com o próprio Database, como workers separados)
+disputam os mesmos chromebooks num banco temporário. Ao final confere que
+nenhum chromebook foi emprestado duas vezes e que contadores e histórico
+batem com a tabela chromebooks. Sai com código 1 se algo estiver errado.
+
+  python estresse_emprestimos.py --threads 32 --chromebooks 50 --rodadas 20
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from database import Database
+
+
+def disputar(db, numeros, barreira, vencedores, erros):
+    barreira.wait()
+    nome = threading.current_thread().name
+    for numero in random.sample(numeros, len(numeros)):
+        ok, msg = db.registrar_emprestimo(numero, 'Par', f'Aluno {nome}', '1A', nome)
+        if ok:
+            vencedores.append(numero)
+        elif msg != "Chromebook já está emprestado":
+            erros.append(msg)
+
+
+def alternar(db, numeros, rodadas, barreira, feitos, erros):
+    barreira.wait()
+    nome = threading.current_thread().name
+    for _ in range(rodadas):
+        numero = random.choice(numeros)
+        if random.random() < 0.5:
+            ok, msg = db.registrar_emprestimo(numero, 'Par', f'Aluno {nome}', '1A', nome)
+            esperado = "Chromebook já está emprestado"
+        else:
+            ok, msg = db.registrar_devolucao(numero, 'Par')
+            esperado = "Chromebook já está disponível"
+        if ok:
+            feitos.append('emprestimo' if esperado.endswith('emprestado') else 'devolucao')
+        elif msg != esperado:
+            erros.append(msg)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--chromebooks', type=int, default=50)
+    parser.add_argument('--rodadas', type=int, default=20, help='operações mistas por thread')
+    args = parser.parse_args()
+
+    pasta = tempfile.mkdtemp(prefix='estresse_')
+    caminho = os.path.join(pasta, 'estresse.db')
+    Database(caminho).criar_tabelas()
+    bancos = [Database(caminho, tamanho_pool=2) for _ in range(args.threads)]
+    for db in bancos:
+        db.inicializar()
+    numeros = list(range(1, args.chromebooks + 1))
+    for numero in numeros:
+        bancos[0].cadastrar_chromebook(numero, 'Par')
+
+    falhas = []
+
+    # 1) Todas as threads tentam emprestar todos os chromebooks ao mesmo tempo
+    vencedores, erros = [], []
+    barreira = threading.Barrier(args.threads)
+    inicio = time.perf_counter()
+    lista = [threading.Thread(target=disputar, args=(db, numeros, barreira, vencedores, erros), name=f'T{i}')
+             for i, db in enumerate(bancos)]
+    for t in lista:
+        t.start()
+    for t in lista:
+        t.join()
+    duracao = time.perf_counter() - inicio
+    repetidos = [numero for numero, n in Counter(vencedores).items() if n > 1]
+    print(f"Disputa: {len(vencedores)} empréstimos de {len(numeros)} chromebooks "
+          f"({args.threads * len(numeros)} tentativas em {duracao:.2f}s)")
+    if repetidos:
+        falhas.append(f"chromebooks emprestados mais de uma vez: {repetidos}")
+    if sorted(vencedores) != numeros:
+        falhas.append("nem todos os chromebooks foram emprestados exatamente uma vez")
+    falhas.extend(f"erro inesperado: {msg}" for msg in erros[:5])
+
+    # 2) Empréstimos e devoluções misturados
+    feitos, erros = [], []
+    barreira = threading.Barrier(args.threads)
+    inicio = time.perf_counter()
+    lista = [threading.Thread(target=alternar, args=(db, numeros, args.rodadas, barreira, feitos, erros), name=f'T{i}')
+             for i, db in enumerate(bancos)]
+    for t in lista:
+        t.start()
+    for t in lista:
+        t.join()
+    duracao = time.perf_counter() - inicio
+    contagem = Counter(feitos)
+    print(f"Misto: {contagem['emprestimo']} empréstimos e {contagem['devolucao']} devoluções "
+          f"em {duracao:.2f}s")
+    falhas.extend(f"erro inesperado: {msg}" for msg in erros[:5])
+
+    # 3) Consistência final (com o histórico assíncrono, descarrega as filas antes)
+    for db in bancos:
+        if db.fila_historico is not None:
+            db.fila_historico.descarregar()
+    conn = sqlite3.connect(caminho)
+    emprestados = conn.execute("SELECT COUNT(*) FROM chromebooks WHERE status = 'Emprestado'").fetchone()[0]
+    movimentos = dict(conn.execute("SELECT tipo_acao, COUNT(*) FROM historico GROUP BY tipo_acao").fetchall())
+    contadores = dict(conn.execute("SELECT status, quantidade FROM estatisticas_chromebooks WHERE carrinho = 'Par'").fetchall())
+    conn.close()
+    saldo = movimentos.get('Empréstimo', 0) - movimentos.get('Devolução', 0)
+    if saldo != emprestados:
+        falhas.append(f"histórico ({saldo} em aberto) não bate com chromebooks ({emprestados} emprestados)")
+    if contadores.get('Emprestado', 0) != emprestados or contadores.get('Disponível', 0) != len(numeros) - emprestados:
+        falhas.append(f"contadores inconsistentes: {contadores}")
+
+    if falhas:
+        for falha in falhas:
+            print(f"❌ {falha}")
+        sys.exit(1)
+    print(f"✅ Sem empréstimos duplicados; histórico e contadores consistentes ({caminho})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+# eventos.py - Canal de eventos em memória para Server-Sent Events
+import json
+import logging
+import queue
+import threading
+import time
+
+log = logging.getLogger('chromebooks.eventos')
+
+
+class CanalEventos:
+    """Pub/sub em memória: cada assinante (aba aberta) recebe os eventos numa fila própria.
+
+    Os eventos publicados só alcançam assinantes do mesmo processo. Escritas de
+    outros workers são percebidas por ``verificar`` (chamado pelas conexões
+    abertas a cada ``intervalo_verificacao`` segundos), que publica um
+    'recarregar' quando o banco mudou por fora.
+    """
+
+    def __init__(self, tamanho_fila=100, intervalo_heartbeat=15, verificar=None, intervalo_verificacao=5):
+        self.tamanho_fila = tamanho_fila
+        self.intervalo_heartbeat = intervalo_heartbeat
+        self.verificar = verificar
+        self.intervalo_verificacao = intervalo_verificacao
+        self._assinantes = set()
+        self._lock = threading.Lock()
+
+    def assinar(self):
+        fila = queue.Queue(maxsize=self.tamanho_fila)
+        with self._lock:
+            self._assinantes.add(fila)
+        return fila
+
+    def cancelar(self, fila):
+        with self._lock:
+            self._assinantes.discard(fila)
+
+    def publicar(self, tipo, dados):
+        mensagem = f"event: {tipo}\ndata: {json.dumps(dados, ensure_ascii=False)}\n\n"
+        with self._lock:
+            assinantes = list(self._assinantes)
+        for fila in assinantes:
+            try:
+                fila.put_nowait(mensagem)
+            except queue.Full:
+                # Cliente lento: derruba a assinatura; o EventSource reconecta e recarrega
+                self.cancelar(fila)
+                with fila.mutex:
+                    fila.queue.clear()
+                fila.put_nowait(None)
+
+    @property
+    def total_assinantes(self):
+        return len(self._assinantes)
+
+    def _verificar(self):
+        try:
+            self.verificar()
+        except Exception:
+            log.exception("Falha ao conferir escritas de outros processos")
+
+    def transmitir(self):
+        """Gerador de mensagens SSE para uma nova assinatura (com comentários de heartbeat).
+
+        A assinatura só é feita quando o servidor começa a consumir o gerador e
+        é desfeita no ``finally``: se o cliente cai antes disso, não sobra nada.
+        Depois, o heartbeat a cada ``intervalo_heartbeat`` segundos é o que
+        revela uma conexão fechada (a escrita falha e o servidor fecha o gerador).
+        """
+        espera = self.intervalo_heartbeat
+        if self.verificar is not None and self.intervalo_verificacao > 0:
+            espera = min(espera, self.intervalo_verificacao)
+        fila = self.assinar()
+        try:
+            yield "retry: 3000\n\n"
+            ultimo_envio = time.monotonic()
+            while True:
+                try:
+                    mensagem = fila.get(timeout=espera)
+                except queue.Empty:
+                    if espera < self.intervalo_heartbeat:
+                        self._verificar()  # se publicar, a mensagem chega na próxima volta
+                    if time.monotonic() - ultimo_envio >= self.intervalo_heartbeat:
+                        ultimo_envio = time.monotonic()
+                        yield ": heartbeat\n\n"
+                    continue
+                if mensagem is None:
+                    return
+                ultimo_envio = time.monotonic()
+                yield mensagem
+        finally:
+            self.cancelar(fila)
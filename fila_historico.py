@@ -0,0 +1,286 @@
+# fila_historico.py - Gravação do histórico em segundo plano (write-behind)
+#
+# Os registros de histórico vão primeiro para um arquivo de spool (uma linha
+# JSON por evento, com fsync antes do commit da escrita que os gerou) e uma
+# thread os grava no banco em lotes: a cada ``tamanho_lote`` eventos ou
+# ``intervalo`` segundos, o que vier antes. Cada lote é gravado junto com seu nome em historico_lotes_aplicados,
+# na mesma transação, para que a recuperação após uma queda não duplique nada.
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+log = logging.getLogger('chromebooks.fila')
+
+SQL_INSERIR_HISTORICO = (
+    "INSERT INTO historico (chromebook_numero, carrinho, aluno, turma, professor, data_emprestimo, data_devolucao, tipo_acao) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+
+class FilaHistorico:
+    """Fila durável de linhas de histórico, descarregada em group commits.
+
+    ``transacao`` é uma função que executa ``operacao(cursor)`` numa transação
+    de escrita (``Database.transacao_imediata``). As linhas seguem a ordem de
+    COLUNAS_HISTORICO sem o id. ``ao_inserir(cursor, linhas)``, se houver, roda
+    na mesma transação de cada lote (ex.: resumos de uso).
+
+    Quem gera as linhas chama ``reservar`` dentro da sua transação, antes do
+    commit, e depois ``confirmar`` (ou ``cancelar``, se ela falhou): uma queda
+    logo após o commit não perde o registro. Com ``sincronizar`` falso não há
+    fsync e o spool só sobrevive à queda do processo, não à do sistema.
+    """
+
+    def __init__(self, transacao, pasta_spool, tamanho_lote=100, intervalo=0.05, idade_orfaos=60.0,
+                 ao_inserir=None, sincronizar=True):
+        self.transacao = transacao
+        self.ao_inserir = ao_inserir
+        self.sincronizar = sincronizar
+        self.pasta_spool = pasta_spool
+        self.tamanho_lote = tamanho_lote
+        self.intervalo = intervalo
+        self.idade_orfaos = idade_orfaos
+        self.gravados = 0
+        self.lotes = 0
+        self.falhas = 0
+        self._prefixo = f"{os.getpid()}-{os.urandom(3).hex()}"
+        self._sequencia = 0
+        self._pendentes = []
+        self._arquivo = None
+        self._nome_arquivo = None
+        self._lotes = []  # [(linhas, arquivo de spool)] já fechados, aguardando o commit
+        self._lock = threading.Lock()
+        # linhas já no spool cuja transação ainda não terminou: o arquivo atual não é fechado
+        self._reservas = 0
+        self._sem_reservas = threading.Condition(self._lock)
+        self._reserva = threading.local()
+        self._lock_escritor = threading.Lock()
+        self._acordar = threading.Event()
+        self._parar = threading.Event()
+        self._thread = None
+
+    def iniciar(self):
+        """Recupera spools órfãos e sobe a thread de gravação (uma vez, no processo que vai usar a fila)."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            # depois de um fork o pid mudou: o prefixo identifica os spools deste processo
+            self._prefixo = f"{os.getpid()}-{os.urandom(3).hex()}"
+            os.makedirs(self.pasta_spool, exist_ok=True)
+            self._thread = threading.Thread(target=self._executar, name='fila-historico', daemon=True)
+        self.recuperar_orfaos()
+        self._thread.start()
+
+    def reservar(self, linhas):
+        """Grava as linhas no spool (dentro da transação que as gerou, antes do commit).
+
+        Elas só entram no próximo lote com ``confirmar``, chamado pela mesma
+        thread depois do commit.
+        """
+        linhas = [tuple(linha) for linha in linhas]
+        if not linhas:
+            return
+        with self._lock:
+            novo = self._arquivo is None
+            if novo:
+                os.makedirs(self.pasta_spool, exist_ok=True)
+                self._sequencia += 1
+                self._nome_arquivo = os.path.join(self.pasta_spool, f"{self._prefixo}-{self._sequencia:08d}.jsonl")
+                self._arquivo = open(self._nome_arquivo, 'a', encoding='utf-8')
+            arquivo = self._arquivo
+            inicio = arquivo.tell()
+            arquivo.write(''.join(json.dumps(linha, ensure_ascii=False) + '\n' for linha in linhas))
+            arquivo.flush()
+            self._reservas += 1
+            self._reserva.valor = (linhas, inicio, arquivo.tell())
+        # fora do lock: enquanto há reserva o arquivo não é fechado
+        if self.sincronizar:
+            os.fsync(arquivo.fileno())
+            if novo:
+                self._sincronizar_pasta()
+
+    def confirmar(self):
+        """A transação da reserva desta thread foi confirmada: as linhas vão para o próximo lote."""
+        reserva, self._reserva.valor = getattr(self._reserva, 'valor', None), None
+        if reserva is None:
+            return
+        with self._lock:
+            self._pendentes.extend(reserva[0])
+            self._liberar_reserva()
+            if len(self._pendentes) >= self.tamanho_lote:
+                self._acordar.set()
+
+    def cancelar(self):
+        """A transação da reserva desta thread falhou: as linhas saem do spool."""
+        reserva, self._reserva.valor = getattr(self._reserva, 'valor', None), None
+        if reserva is None:
+            return
+        _, inicio, fim = reserva
+        with self._lock:
+            # só a última reserva pode ser desfeita sem apagar as linhas de outra
+            if self._arquivo.tell() == fim:
+                self._arquivo.truncate(inicio)
+            self._liberar_reserva()
+
+    @property
+    def total_pendentes(self):
+        with self._lock:
+            return len(self._pendentes) + sum(len(lote) for lote, _ in self._lotes)
+
+    def lotes_pendentes(self):
+        """Cópia dos lotes ainda não descartados: [(nome do lote, linhas)], do mais antigo ao mais recente.
+
+        Um lote pode já ter sido gravado logo depois desta cópia; quem também lê
+        o banco descarta esses com ``lotes_aplicados`` na mesma transação de
+        leitura, e a visão fica sem lacunas nem duplicatas sem travar a fila.
+        """
+        with self._lock:
+            lotes = [(os.path.basename(nome), list(lote)) for lote, nome in self._lotes]
+            if self._pendentes:
+                lotes.append((os.path.basename(self._nome_arquivo), list(self._pendentes)))
+            return lotes
+
+    def descarregar(self):
+        """Grava no banco, em ordem, tudo que está pendente (levanta exceção se o banco falhar)."""
+        with self._lock_escritor:
+            with self._sem_reservas:
+                # uma transação em andamento tem linhas no arquivo atual: espera por ela
+                self._sem_reservas.wait_for(lambda: not self._reservas, timeout=5.0)
+                if self._pendentes and not self._reservas:
+                    # o lote atual é fechado e o próximo evento abre outro spool
+                    self._arquivo.close()
+                    self._lotes.append((self._pendentes, self._nome_arquivo))
+                    self._pendentes, self._arquivo, self._nome_arquivo = [], None, None
+            while self._lotes:
+                lote, nome = self._lotes[0]
+                self._gravar(lote, nome, ao_gravar=self._lotes.pop)
+
+    def fechar(self, timeout=5.0):
+        """Para a thread e descarrega o que restou (gancho de desligamento)."""
+        self._parar.set()
+        self._acordar.set()
+        if self._thread is not None and self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        try:
+            self.descarregar()
+        except Exception as e:
+            # os arquivos de spool ficam no disco e são recuperados na próxima inicialização
+            log.error("Histórico pendente não gravado: %s", e, extra={'registros': self.total_pendentes})
+
+    def recuperar_orfaos(self):
+        """Grava spools deixados por processos que terminaram antes de descarregar.
+
+        Só considera arquivos de outros processos parados há ``idade_orfaos``
+        segundos (os de processos vivos são trocados a cada lote).
+        """
+        recuperados = 0
+        for nome in sorted(glob.glob(os.path.join(self.pasta_spool, '*.jsonl'))):
+            if os.path.basename(nome).startswith(self._prefixo):
+                continue
+            try:
+                if time.time() - os.path.getmtime(nome) < self.idade_orfaos:
+                    continue
+                with open(nome, encoding='utf-8') as arquivo:
+                    lote = [tuple(json.loads(linha)) for linha in arquivo if linha.strip()]
+                self._gravar(lote, nome)
+            except Exception:
+                continue
+            recuperados += len(lote)
+        return recuperados
+
+    def estatisticas(self):
+        return {
+            'pendentes': self.total_pendentes,
+            'gravados': self.gravados,
+            'lotes': self.lotes,
+            'falhas': self.falhas,
+            'tamanho_lote': self.tamanho_lote,
+            'intervalo': self.intervalo,
+        }
+
+    def _gravar(self, lote, nome, ao_gravar=None):
+        lote_id = os.path.basename(nome)
+
+        def inserir(cursor):
+            cursor.execute("SELECT 1 FROM historico_lotes_aplicados WHERE lote = ?", (lote_id,))
+            if cursor.fetchone():
+                return False
+            cursor.executemany(SQL_INSERIR_HISTORICO, lote)
+            if self.ao_inserir is not None:
+                self.ao_inserir(cursor, lote)
+            cursor.execute("INSERT INTO historico_lotes_aplicados (lote, aplicado_em) VALUES (?, ?)",
+                           (lote_id, datetime.now().isoformat(sep=' ', timespec='seconds')))
+            return True
+
+        try:
+            gravado = self.transacao(inserir) if lote else False
+        except Exception:
+            self.falhas += 1
+            raise
+        if ao_gravar is not None:
+            with self._lock:
+                ao_gravar(0)
+        if gravado:
+            self.gravados += len(lote)
+            self.lotes += 1
+        try:
+            os.remove(nome)
+        except OSError:
+            pass
+
+    def _liberar_reserva(self):
+        self._reservas -= 1
+        if not self._reservas:
+            self._sem_reservas.notify_all()
+
+    def _sincronizar_pasta(self):
+        # a entrada do arquivo novo na pasta também precisa chegar ao disco
+        try:
+            pasta = os.open(self.pasta_spool, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(pasta)
+        except OSError:
+            pass
+        finally:
+            os.close(pasta)
+
+    def _executar(self):
+        ultima_limpeza = time.monotonic()
+        while not self._parar.is_set():
+            self._acordar.wait(self.intervalo)
+            self._acordar.clear()
+            try:
+                self.descarregar()
+            except Exception:
+                # banco indisponível: o spool continua no disco e o lote é tentado de novo
+                log.warning("Falha ao gravar lote do histórico; nova tentativa em seguida", exc_info=True)
+                self._parar.wait(min(5.0, self.intervalo * 20))
+            if time.monotonic() - ultima_limpeza > 300:
+                ultima_limpeza = time.monotonic()
+                self._limpar_marcadores()
+                self.recuperar_orfaos()
+
+    def _limpar_marcadores(self):
+        # Os marcadores só servem enquanto o arquivo de spool correspondente pode existir
+        limite = (datetime.now() - timedelta(days=1)).isoformat(sep=' ', timespec='seconds')
+        try:
+            self.transacao(lambda cursor: cursor.execute(
+                "DELETE FROM historico_lotes_aplicados WHERE aplicado_em < ?", (limite,)))
+        except Exception:
+            pass
+
+
+def lotes_aplicados(conn, nomes):
+    """Quais dos lotes ``nomes`` já estão no banco (visto pela transação corrente de ``conn``)."""
+    nomes = list(nomes)
+    if not nomes:
+        return set()
+    marcadores = ', '.join('?' * len(nomes))
+    return {linha[0] for linha in conn.execute(
+        f"SELECT lote FROM historico_lotes_aplicados WHERE lote IN ({marcadores})", nomes)}
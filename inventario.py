@@ -0,0 +1,166 @@
+# inventario.py - Cópia em memória da tabela chromebooks para as leituras
+#
+# O inventário inteiro cabe com folga na memória e é lido ~50x mais do que é
+# alterado. As listas ficam ordenadas por (carrinho, numero) e separadas por
+# status, então cada consulta custa proporcional ao resultado, sem SQLite.
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import Counter
+
+# Mesmas colunas e ordem de SQL_TODOS_CHROMEBOOKS
+SQL_INVENTARIO = '''
+    SELECT numero, carrinho, status, aluno_emprestado, turma_aluno, professor_emprestimo, data_emprestimo
+    FROM chromebooks
+'''
+SQL_VERSAO_INVENTARIO = "SELECT versao FROM inventario_versao WHERE id = 1"
+
+
+class InventarioMemoria:
+    """Inventário indexado por status e carrinho, atualizado a cada escrita (write-through).
+
+    Escritas de outros processos são percebidas pelo contador inventario_versao
+    (mantido por triggers), consultado no máximo a cada ``intervalo_verificacao``
+    segundos; se ele mudou, o inventário é recarregado do disco. As escritas
+    deste processo informam o contador antes/depois delas (``atualizar``), então
+    só um salto que nenhuma delas explica (escrita de outro processo) recarrega.
+    """
+
+    def __init__(self, intervalo_verificacao=1.0):
+        self.intervalo_verificacao = intervalo_verificacao
+        self.carregado = False
+        self.recargas = 0
+        self._linhas = {}           # numero -> linha
+        self._ordem = []            # (carrinho, numero) de todos, ordenado
+        self._por_status = {}       # status -> [(carrinho, numero)] ordenado
+        self._contagens = Counter()  # (carrinho, status) -> quantidade
+        self._versao_disco = None
+        self._escritas_locais = {}  # versão antes -> depois, das escritas ainda não encadeadas
+        self._verificado_em = 0.0
+        self._lock = threading.RLock()
+
+    # ----- carga e sincronização -----
+    def carregar(self, conn):
+        """Recarrega tudo do disco (linhas e versão lidas na mesma transação)."""
+        with self._lock:
+            conn.execute("BEGIN")
+            try:
+                linhas = conn.execute(SQL_INVENTARIO).fetchall()
+                versao = conn.execute(SQL_VERSAO_INVENTARIO).fetchone()
+            finally:
+                conn.rollback()
+            self._linhas = {linha[0]: linha for linha in linhas}
+            self._ordem = sorted((linha[1], linha[0]) for linha in linhas)
+            self._por_status = {}
+            self._contagens = Counter()
+            for carrinho, numero in self._ordem:
+                status = self._linhas[numero][2]
+                self._por_status.setdefault(status, []).append((carrinho, numero))
+                self._contagens[(carrinho, status)] += 1
+            self._versao_disco = versao[0] if versao else None
+            self._escritas_locais = {}
+            self._verificado_em = time.monotonic()
+            self.carregado = True
+            self.recargas += 1
+
+    @property
+    def versao_disco(self):
+        """inventario_versao que a cópia em memória já reflete."""
+        return self._versao_disco
+
+    def precisa_sincronizar(self):
+        return not self.carregado or time.monotonic() - self._verificado_em >= self.intervalo_verificacao
+
+    def sincronizar(self, conn):
+        """Recarrega se o banco foi alterado desde a última carga. Retorna True se recarregou."""
+        with self._lock:
+            if self.carregado:
+                versao = conn.execute(SQL_VERSAO_INVENTARIO).fetchone()
+                if versao is not None and versao[0] == self._versao_disco:
+                    self._verificado_em = time.monotonic()
+                    return False
+            self.carregar(conn)
+            return True
+
+    def atualizar(self, conn, numeros, versoes=None, tamanho_bloco=500):
+        """Relê do disco só as linhas indicadas (após um commit deste processo).
+
+        Ler o estado atual em vez de aplicar o que foi escrito faz escritas
+        concorrentes convergirem, seja qual for a ordem em que chegam aqui.
+        ``versoes`` é o inventario_versao (antes, depois) lido na transação da
+        escrita: a versão conhecida avança por ela sem recarregar tudo.
+        """
+        numeros = list(dict.fromkeys(numeros))
+        with self._lock:
+            if not self.carregado:
+                return
+            for i in range(0, len(numeros), tamanho_bloco):
+                bloco = numeros[i:i + tamanho_bloco]
+                atuais = {linha[0]: linha for linha in conn.execute(
+                    SQL_INVENTARIO + f" WHERE numero IN ({', '.join('?' * len(bloco))})", bloco)}
+                for numero in bloco:
+                    self._remover(numero)
+                    if numero in atuais:
+                        self._inserir(atuais[numero])
+            if versoes is not None:
+                self._reconhecer_escrita(*versoes)
+
+    def _reconhecer_escrita(self, antes, depois):
+        """Encadeia as escritas locais a partir da versão conhecida (podem chegar fora de ordem)."""
+        if self._versao_disco is None or depois <= self._versao_disco:
+            return
+        self._escritas_locais[antes] = depois
+        while self._versao_disco in self._escritas_locais:
+            self._versao_disco = self._escritas_locais.pop(self._versao_disco)
+        self._escritas_locais = {a: d for a, d in self._escritas_locais.items() if a > self._versao_disco}
+
+    def _inserir(self, linha):
+        chave = (linha[1], linha[0])
+        self._linhas[linha[0]] = linha
+        insort(self._ordem, chave)
+        insort(self._por_status.setdefault(linha[2], []), chave)
+        self._contagens[(linha[1], linha[2])] += 1
+
+    def _remover(self, numero):
+        linha = self._linhas.pop(numero, None)
+        if linha is None:
+            return
+        chave = (linha[1], linha[0])
+        for lista in (self._ordem, self._por_status.get(linha[2], [])):
+            i = bisect_left(lista, chave)
+            if i < len(lista) and lista[i] == chave:
+                del lista[i]
+        self._contagens[(linha[1], linha[2])] -= 1
+        if not self._contagens[(linha[1], linha[2])]:
+            del self._contagens[(linha[1], linha[2])]
+
+    # ----- consultas -----
+    def listar(self, status=None, carrinho=None):
+        """Linhas (como SQL_TODOS_CHROMEBOOKS) em ordem de carrinho e número."""
+        with self._lock:
+            chaves = self._ordem if status is None else self._por_status.get(status, [])
+            if carrinho is not None:
+                chaves = chaves[bisect_left(chaves, (carrinho,)):bisect_left(chaves, (carrinho, float('inf')))]
+            return [self._linhas[numero] for _, numero in chaves]
+
+    def contagens(self):
+        """[(carrinho, status, quantidade)] ordenado por carrinho, como estatisticas_chromebooks."""
+        with self._lock:
+            return sorted((carrinho, status or '', quantidade)
+                          for (carrinho, status), quantidade in self._contagens.items())
+
+    def divergencias(self, conn):
+        """Números cujo estado em memória difere do disco (vazio se está consistente)."""
+        with self._lock:
+            disco = {linha[0]: linha for linha in conn.execute(SQL_INVENTARIO)}
+            return sorted(numero for numero in set(disco) | set(self._linhas)
+                          if disco.get(numero) != self._linhas.get(numero))
+
+    def estatisticas(self):
+        return {
+            'carregado': self.carregado,
+            'chromebooks': len(self._linhas),
+            'versao_disco': self._versao_disco,
+            'recargas': self.recargas,
+            'intervalo_verificacao': self.intervalo_verificacao,
+        }
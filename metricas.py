@@ -0,0 +1,251 @@
+# metricas.py - Métricas de latência por rota e de SQL por requisição (formato Prometheus)
+#
+# O app abre um acumulador por requisição (iniciar_requisicao) e, ao final,
+# registra a latência da rota junto com o que o banco fez durante ela:
+# consultas, linhas, tempo de SQL e espera por conexão do pool.
+import contextvars
+import logging
+import threading
+import time
+
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SEM_REQUISICAO = 'segundo_plano'  # threads de fundo (fila do histórico, etc.)
+
+log_sql_lento = logging.getLogger('chromebooks.sql')
+_requisicao_atual = contextvars.ContextVar('requisicao_atual', default=None)
+
+
+class Acumulador:
+    """O que o banco fez durante uma requisição."""
+    __slots__ = ('consultas', 'linhas', 'tempo_sql', 'tempo_conexao')
+
+    def __init__(self):
+        self.consultas = 0
+        self.linhas = 0
+        self.tempo_sql = 0.0
+        self.tempo_conexao = 0.0
+
+
+class Histograma:
+    def __init__(self, buckets=BUCKETS_SEGUNDOS):
+        self.buckets = buckets
+        self.contagens = [0] * len(buckets)
+        self.soma = 0.0
+        self.total = 0
+
+    def observar(self, valor):
+        self.soma += valor
+        self.total += 1
+        for i, limite in enumerate(self.buckets):
+            if valor <= limite:
+                self.contagens[i] += 1
+                break
+
+
+class Metricas:
+    """Coletor em memória (por processo) de métricas HTTP e SQL."""
+
+    def __init__(self, limite_sql_lento=None):
+        self.limite_sql_lento = limite_sql_lento
+        self._lock = threading.Lock()
+        self._requisicoes = {}    # (endpoint, metodo, status) -> total
+        self._duracao = {}        # endpoint -> Histograma
+        self._sql = {}            # endpoint -> [consultas, linhas, segundos de SQL, segundos esperando conexão]
+        self._espera_conexao = Histograma()
+        self.sql_lentas = 0
+        self.medidores = {}       # nome -> (ajuda, função sem argumentos)
+
+    # ----- requisição -----
+    def iniciar_requisicao(self):
+        acumulador = Acumulador()
+        _requisicao_atual.set(acumulador)
+        return acumulador
+
+    def finalizar_requisicao(self, acumulador, endpoint, metodo, status, duracao):
+        _requisicao_atual.set(None)
+        with self._lock:
+            chave = (endpoint, metodo, str(status))
+            self._requisicoes[chave] = self._requisicoes.get(chave, 0) + 1
+            self._duracao.setdefault(endpoint, Histograma()).observar(duracao)
+            if acumulador is not None and (acumulador.consultas or acumulador.tempo_conexao):
+                self._somar_sql(endpoint, acumulador.consultas, acumulador.linhas, acumulador.tempo_sql,
+                                acumulador.tempo_conexao)
+
+    def _somar_sql(self, endpoint, consultas, linhas, segundos, conexao=0.0):
+        sql = self._sql.setdefault(endpoint, [0, 0, 0.0, 0.0])
+        sql[0] += consultas
+        sql[1] += linhas
+        sql[2] += segundos
+        sql[3] += conexao
+
+    # ----- banco -----
+    def registrar_conexao(self, segundos):
+        acumulador = _requisicao_atual.get()
+        if acumulador is not None:
+            acumulador.tempo_conexao += segundos
+        with self._lock:
+            self._espera_conexao.observar(segundos)
+
+    def registrar_sql(self, sql, segundos, linhas=0, consultas=1):
+        acumulador = _requisicao_atual.get()
+        if acumulador is not None:
+            acumulador.consultas += consultas
+            acumulador.linhas += linhas
+            acumulador.tempo_sql += segundos
+        else:
+            with self._lock:
+                self._somar_sql(SEM_REQUISICAO, consultas, linhas, segundos)
+        if sql is not None and self.limite_sql_lento is not None and segundos >= self.limite_sql_lento:
+            with self._lock:
+                self.sql_lentas += 1
+            log_sql_lento.warning("SQL lento (%.1f ms): %s", segundos * 1000, ' '.join(str(sql).split())[:500])
+
+    def adicionar_linhas(self, linhas, segundos):
+        """Linhas lidas (fetch*) depois do execute: entram na mesma requisição."""
+        if linhas or segundos:
+            self.registrar_sql(None, segundos, linhas, consultas=0)
+
+    # ----- exposição -----
+    def medidor(self, nome, ajuda, funcao):
+        """Registra um valor instantâneo (gauge) calculado na hora da coleta."""
+        self.medidores[nome] = (ajuda, funcao)
+
+    def texto_prometheus(self):
+        with self._lock:
+            requisicoes = dict(self._requisicoes)
+            duracao = {endpoint: (list(h.contagens), h.soma, h.total) for endpoint, h in self._duracao.items()}
+            sql = {endpoint: list(valores) for endpoint, valores in self._sql.items()}
+            espera = (list(self._espera_conexao.contagens), self._espera_conexao.soma, self._espera_conexao.total)
+
+        linhas = [
+            '# HELP chromebooks_http_requisicoes_total Requisições HTTP por rota, método e status.',
+            '# TYPE chromebooks_http_requisicoes_total counter',
+        ]
+        for (endpoint, metodo, status), total in sorted(requisicoes.items()):
+            linhas.append(f'chromebooks_http_requisicoes_total{{endpoint="{endpoint}",metodo="{metodo}",status="{status}"}} {total}')
+
+        linhas += [
+            '# HELP chromebooks_http_duracao_segundos Latência das requisições por rota.',
+            '# TYPE chromebooks_http_duracao_segundos histogram',
+        ]
+        for endpoint, valores in sorted(duracao.items()):
+            linhas += _histograma('chromebooks_http_duracao_segundos', f'endpoint="{endpoint}",', *valores)
+
+        for indice, (nome, tipo, ajuda) in enumerate((
+            ('chromebooks_sql_consultas_total', 'counter', 'Comandos SQL executados, por rota.'),
+            ('chromebooks_sql_linhas_total', 'counter', 'Linhas lidas ou alteradas pelo SQL, por rota.'),
+            ('chromebooks_sql_duracao_segundos_total', 'counter', 'Tempo gasto em SQL, por rota.'),
+            ('chromebooks_sql_espera_conexao_segundos_total', 'counter', 'Tempo esperando conexão do pool, por rota.'),
+        )):
+            linhas += [f'# HELP {nome} {ajuda}', f'# TYPE {nome} {tipo}']
+            for endpoint, valores in sorted(sql.items()):
+                valor = round(valores[indice], 6) if indice >= 2 else valores[indice]
+                linhas.append(f'{nome}{{endpoint="{endpoint}"}} {valor}')
+
+        linhas += [
+            '# HELP chromebooks_conexao_espera_segundos Tempo para obter uma conexão do pool.',
+            '# TYPE chromebooks_conexao_espera_segundos histogram',
+        ]
+        linhas += _histograma('chromebooks_conexao_espera_segundos', '', *espera)
+        linhas += [
+            '# HELP chromebooks_sql_lentas_total Comandos SQL acima do limite de SQL lento.',
+            '# TYPE chromebooks_sql_lentas_total counter',
+            f'chromebooks_sql_lentas_total {self.sql_lentas}',
+        ]
+        for nome, (ajuda, funcao) in sorted(self.medidores.items()):
+            try:
+                valor = funcao()
+            except Exception:
+                continue
+            linhas += [f'# HELP {nome} {ajuda}', f'# TYPE {nome} gauge', f'{nome} {valor}']
+        return '\n'.join(linhas) + '\n'
+
+
+def _histograma(nome, rotulos, contagens, soma, total):
+    linhas, acumulado = [], 0
+    for limite, contagem in zip(BUCKETS_SEGUNDOS, contagens):
+        acumulado += contagem
+        linhas.append(f'{nome}_bucket{{{rotulos}le="{limite}"}} {acumulado}')
+    linhas.append(f'{nome}_bucket{{{rotulos}le="+Inf"}} {total}')
+    rotulos = rotulos.rstrip(',')
+    sufixo = f'{{{rotulos}}}' if rotulos else ''
+    linhas.append(f'{nome}_sum{sufixo} {round(soma, 6)}')
+    linhas.append(f'{nome}_count{sufixo} {total}')
+    return linhas
+
+
+class CursorMedido:
+    """Cursor que mede execute/executemany e conta as linhas lidas."""
+
+    def __init__(self, cursor, metricas):
+        self._cursor = cursor
+        self._metricas = metricas
+
+    def __getattr__(self, nome):
+        return getattr(self._cursor, nome)
+
+    def __iter__(self):
+        # conta aqui e registra uma vez só: no fim da iteração ou quando ela é interrompida
+        linhas = 0
+        try:
+            for linha in self._cursor:
+                linhas += 1
+                yield linha
+        finally:
+            self._metricas.adicionar_linhas(linhas, 0.0)
+
+    def execute(self, sql, parametros=()):
+        inicio = time.perf_counter()
+        try:
+            self._cursor.execute(sql, parametros)
+        finally:
+            duracao = time.perf_counter() - inicio
+            self._metricas.registrar_sql(sql, duracao, max(self._cursor.rowcount, 0))
+        return self
+
+    def executemany(self, sql, parametros):
+        inicio = time.perf_counter()
+        try:
+            self._cursor.executemany(sql, parametros)
+        finally:
+            duracao = time.perf_counter() - inicio
+            self._metricas.registrar_sql(sql, duracao, max(self._cursor.rowcount, 0))
+        return self
+
+    def fetchone(self):
+        inicio = time.perf_counter()
+        linha = self._cursor.fetchone()
+        self._metricas.adicionar_linhas(1 if linha is not None else 0, time.perf_counter() - inicio)
+        return linha
+
+    def fetchmany(self, *args):
+        inicio = time.perf_counter()
+        linhas = self._cursor.fetchmany(*args)
+        self._metricas.adicionar_linhas(len(linhas), time.perf_counter() - inicio)
+        return linhas
+
+    def fetchall(self):
+        inicio = time.perf_counter()
+        linhas = self._cursor.fetchall()
+        self._metricas.adicionar_linhas(len(linhas), time.perf_counter() - inicio)
+        return linhas
+
+
+class ConexaoMedida:
+    """Conexão do pool com os comandos SQL medidos (o resto é repassado)."""
+
+    def __init__(self, conn, metricas):
+        self._conn = conn
+        self._metricas = metricas
+
+    def __getattr__(self, nome):
+        return getattr(self._conn, nome)
+
+    def cursor(self):
+        return CursorMedido(self._conn.cursor(), self._metricas)
+
+    def execute(self, sql, parametros=()):
+        return self.cursor().execute(sql, parametros)
+
+    def executemany(self, sql, parametros):
+        return self.cursor().executemany(sql, parametros)
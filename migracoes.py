@@ -0,0 +1,304 @@
+# migracoes.py - Migrações versionadas do banco de dados
+#
+# Cada passo roda uma única vez, em ordem, e fica registrado em schema_version.
+# Para alterar o schema basta acrescentar um novo passo no fim de MIGRACOES.
+from datetime import datetime
+from werkzeug.security import generate_password_hash
+from senhas import METODO_HASH, PREFIXOS_HASH
+import uso
+import busca
+
+
+def _colunas(cursor, tabela):
+    cursor.execute(f"PRAGMA table_info({tabela})")
+    return [col[1] for col in cursor.fetchall()]
+
+
+def _criar_tabelas_base(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS usuarios (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            senha TEXT NOT NULL,
+            nome TEXT NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS chromebooks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            numero INTEGER UNIQUE NOT NULL,
+            carrinho TEXT NOT NULL,
+            status TEXT DEFAULT 'Disponível',
+            aluno_emprestado TEXT,
+            data_emprestimo TEXT,
+            professor_emprestimo TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS historico (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chromebook_numero INTEGER,
+            carrinho TEXT,
+            aluno TEXT,
+            professor TEXT,
+            data_emprestimo TEXT,
+            data_devolucao TEXT,
+            tipo_acao TEXT
+        )
+    ''')
+
+
+def _adicionar_colunas_turma(cursor):
+    # Antigo migatre_turmas.py
+    if 'turma_aluno' not in _colunas(cursor, 'chromebooks'):
+        cursor.execute("ALTER TABLE chromebooks ADD COLUMN turma_aluno TEXT")
+    if 'turma' not in _colunas(cursor, 'historico'):
+        cursor.execute("ALTER TABLE historico ADD COLUMN turma TEXT")
+
+
+def _criar_estatisticas(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS estatisticas_chromebooks (
+            carrinho TEXT NOT NULL,
+            status TEXT NOT NULL,
+            quantidade INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (carrinho, status)
+        )
+    ''')
+    cursor.execute("DELETE FROM estatisticas_chromebooks")
+    cursor.execute('''
+        INSERT INTO estatisticas_chromebooks (carrinho, status, quantidade)
+        SELECT carrinho, COALESCE(status, ''), COUNT(*)
+        FROM chromebooks
+        GROUP BY status, carrinho
+    ''')
+
+
+def _converter_senhas_texto_simples(cursor):
+    # Antigo migrate_passwords.py
+    cursor.execute("SELECT id, senha FROM usuarios")
+    for user_id, senha in cursor.fetchall():
+        if senha and not senha.startswith(PREFIXOS_HASH):
+            cursor.execute("UPDATE usuarios SET senha = ? WHERE id = ?",
+                           (generate_password_hash(senha, METODO_HASH), user_id))
+
+
+def _indices_historico(cursor):
+    # Índices compostos (coluna, id) para filtro + paginação por cursor no histórico
+    for coluna in ('chromebook_numero', 'carrinho', 'aluno', 'turma', 'professor', 'tipo_acao'):
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_historico_{coluna} ON historico ({coluna}, id)")
+
+
+def _datas_iso(cursor):
+    # 'dd/mm/aaaa hh:mm' -> 'aaaa-mm-dd hh:mm:ss' (ordenável e comparável como texto)
+    for tabela, coluna in (('chromebooks', 'data_emprestimo'),
+                           ('historico', 'data_emprestimo'),
+                           ('historico', 'data_devolucao')):
+        cursor.execute(f"""
+            UPDATE {tabela}
+            SET {coluna} = substr({coluna}, 7, 4) || '-' || substr({coluna}, 4, 2) || '-' ||
+                           substr({coluna}, 1, 2) || ' ' || substr({coluna}, 12, 5) || ':00'
+            WHERE {coluna} LIKE '__/__/____ __:__'
+        """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_historico_data_evento "
+                   "ON historico (COALESCE(data_devolucao, data_emprestimo), id)")
+
+
+def _lotes_historico(cursor):
+    # Lotes da fila de histórico já gravados (evita duplicar ao recuperar um spool)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS historico_lotes_aplicados (
+            lote TEXT PRIMARY KEY,
+            aplicado_em TEXT NOT NULL
+        )
+    ''')
+
+
+def _versao_inventario(cursor):
+    # Contador alterado a cada mudança em chromebooks: outros processos percebem
+    # que a cópia em memória do inventário ficou desatualizada
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS inventario_versao (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            versao INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO inventario_versao (id, versao) VALUES (1, 0)")
+    for evento in ('INSERT', 'UPDATE', 'DELETE'):
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_inventario_versao_{evento.lower()}
+            AFTER {evento} ON chromebooks
+            BEGIN
+                UPDATE inventario_versao SET versao = versao + 1 WHERE id = 1;
+            END
+        """)
+
+
+def _versao_dados(cursor):
+    # Contador do resto do que as páginas mostram (histórico e usuários), também
+    # por triggers: caches e ETags de todos os processos mudam juntos. Escritas
+    # sem INSERT/DELETE no histórico (reconstruções de resumos) somam à parte.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS dados_versao (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            versao INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO dados_versao (id, versao) VALUES (1, 0)")
+    for tabela, eventos in (('historico', ('INSERT', 'DELETE')), ('usuarios', ('INSERT', 'UPDATE', 'DELETE'))):
+        for evento in eventos:
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_dados_versao_{tabela}_{evento.lower()}
+                AFTER {evento} ON {tabela}
+                BEGIN
+                    UPDATE dados_versao SET versao = versao + 1 WHERE id = 1;
+                END
+            """)
+
+
+def _arquivos_historico(cursor):
+    # Períodos do histórico movidos para bancos de arquivo (arquivamento.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS arquivos_historico (
+            periodo TEXT PRIMARY KEY,
+            arquivo TEXT NOT NULL,
+            inicio TEXT NOT NULL,
+            fim TEXT NOT NULL,
+            registros INTEGER NOT NULL,
+            arquivado_em TEXT NOT NULL
+        )
+    ''')
+
+
+def _usuario_padrao(cursor):
+    # Feito uma vez por banco (e não a cada inicialização do app): o hash é caro
+    cursor.execute("SELECT 1 FROM usuarios WHERE username = 'admin'")
+    if not cursor.fetchone():
+        cursor.execute("INSERT INTO usuarios (username, senha, nome) VALUES (?, ?, ?)",
+                       ('admin', generate_password_hash('1234', METODO_HASH), 'Administrador'))
+
+
+def _resumos_uso(cursor):
+    # Resumos por turma/professor/chromebook/hora, somados a cada gravação no
+    # histórico; aqui entra o que já existe (arquivos: python uso.py reconstruir)
+    uso.criar_tabelas(cursor)
+    uso.limpar(cursor)
+    uso.somar_fonte(cursor)
+
+
+def _atrasos(cursor):
+    # Empréstimos ativos por data de início: a varredura de atrasos lê só a
+    # faixa entre dois cortes (ver atrasos.py)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_chromebooks_emprestados_data "
+                   "ON chromebooks (data_emprestimo) WHERE status = 'Emprestado'")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS prazos_emprestimo (
+            alvo TEXT NOT NULL CHECK (alvo IN ('carrinho', 'turma')),
+            nome TEXT NOT NULL,
+            minutos INTEGER,
+            hora_limite TEXT,
+            PRIMARY KEY (alvo, nome)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS atrasos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chromebook_numero INTEGER NOT NULL,
+            carrinho TEXT,
+            aluno TEXT,
+            turma TEXT,
+            professor TEXT,
+            data_emprestimo TEXT NOT NULL,
+            prazo TEXT,
+            detectado_em TEXT NOT NULL,
+            UNIQUE (chromebook_numero, data_emprestimo)
+        )
+    ''')
+
+
+def _busca(cursor):
+    # Índice FTS5 do histórico e vocabulário do autocompletar, mantidos por
+    # triggers (ver busca.py); os arquivos: python busca.py reconstruir
+    busca.criar_tabelas(cursor)
+    busca.limpar_nomes(cursor)
+    busca.somar_nomes(cursor)
+
+
+MIGRACOES = [
+    (1, "Tabelas base (usuarios, chromebooks, historico)", _criar_tabelas_base),
+    (2, "Colunas de turma em chromebooks e historico", _adicionar_colunas_turma),
+    (3, "Contadores por carrinho/status", _criar_estatisticas),
+    (4, "Hash das senhas em texto simples", _converter_senhas_texto_simples),
+    (5, "Índices de filtro do histórico", _indices_historico),
+    (6, "Datas em ISO-8601 e índice por data do evento", _datas_iso),
+    (7, "Controle de lotes da fila de histórico", _lotes_historico),
+    (8, "Versão do inventário para a cópia em memória", _versao_inventario),
+    (9, "Registro dos arquivos de histórico por período", _arquivos_historico),
+    (10, "Usuário administrador padrão", _usuario_padrao),
+    (11, "Resumos de uso (turma, professor, chromebook, hora)", _resumos_uso),
+    (12, "Prazos de empréstimo e registro de atrasos", _atrasos),
+    (13, "Busca textual no histórico e autocompletar de nomes", _busca),
+    (14, "Versão compartilhada do histórico e dos usuários", _versao_dados),
+]
+
+VERSAO_ATUAL = MIGRACOES[-1][0]
+
+
+def versao_schema(conn):
+    """Versão aplicada no banco (0 se a tabela schema_version ainda não existe)."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'")
+    if not cursor.fetchone():
+        return 0
+    cursor.execute("SELECT COALESCE(MAX(versao), 0) FROM schema_version")
+    return cursor.fetchone()[0]
+
+
+def aplicar_migracoes(conn):
+    """Aplica as migrações pendentes numa única transação e retorna as versões aplicadas.
+
+    O BEGIN IMMEDIATE serializa processos que sobem ao mesmo tempo: o segundo
+    espera o primeiro terminar e então encontra o schema já atualizado.
+    """
+    if versao_schema(conn) >= VERSAO_ATUAL:
+        return []
+
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                versao INTEGER PRIMARY KEY,
+                descricao TEXT NOT NULL,
+                aplicada_em TEXT NOT NULL
+            )
+        ''')
+        atual = versao_schema(conn)
+        aplicadas = []
+        for versao, descricao, passo in MIGRACOES:
+            if versao <= atual:
+                continue
+            passo(cursor)
+            cursor.execute(
+                "INSERT INTO schema_version (versao, descricao, aplicada_em) VALUES (?, ?, ?)",
+                (versao, descricao, datetime.now().isoformat(sep=' ', timespec='seconds'))
+            )
+            aplicadas.append(versao)
+        conn.commit()
+        return aplicadas
+    except Exception:
+        conn.rollback()
+        raise
+
+
+if __name__ == '__main__':
+    from database import Database
+
+    db = Database()
+    with db.conexao() as conn:
+        print(f"Versão atual do schema: {versao_schema(conn)}")
+        aplicadas = aplicar_migracoes(conn)
+    if aplicadas:
+        print(f"✅ Migrações aplicadas: {aplicadas}")
+    else:
+        print("✅ Banco de dados já está atualizado")
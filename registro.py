@@ -0,0 +1,216 @@
+# registro.py - Logging estruturado sem bloquear as requisições
+#
+# As rotas só colocam o registro numa fila em memória (QueueHandler); uma
+# thread (QueueListener) formata e escreve no terminal/arquivo. Se a fila
+# encher, o registro é descartado e contado em vez de travar a requisição.
+# Antes de entrar na fila, senhas e tokens são mascarados e eventos DEBUG
+# são amostrados.
+#
+#   CHROMEBOOKS_LOG_NIVEL=INFO                        nível do logger "chromebooks"
+#   CHROMEBOOKS_LOG_NIVEIS=chromebooks.sql=DEBUG,...  níveis por módulo
+#   CHROMEBOOKS_LOG_FORMATO=texto|json
+#   CHROMEBOOKS_LOG_ARQUIVO=/var/log/chromebooks.log  (padrão: stderr)
+#   CHROMEBOOKS_LOG_AMOSTRA_DEBUG=0.1                 fração dos DEBUG mantida
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import threading
+from collections.abc import Mapping
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+
+RAIZ = 'chromebooks'
+CHAVES_SECRETAS = ('senha', 'password', 'token', 'secret', 'authorization', 'cookie')
+MASCARA = '***'
+_RE_SEGREDO = re.compile(
+    r'''(?i)\b((?:%s)\w*)(['"]?\s*[:=,]\s*\(?['"]?)(?:Bearer\s+)?([^\s'"&,;)}\]]+)''' % '|'.join(CHAVES_SECRETAS)
+)
+# Atributos padrão de LogRecord: o resto veio de extra= e vira campo estruturado
+_ATRIBUTOS_PADRAO = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'taskName'}
+
+_lock = threading.Lock()
+_configuracao = None
+
+
+def secreta(chave):
+    chave = str(chave).lower()
+    return any(parte in chave for parte in CHAVES_SECRETAS)
+
+
+def mascarar(valor):
+    """Cópia de ``valor`` com senhas/tokens trocados por ***."""
+    if isinstance(valor, str):
+        return _RE_SEGREDO.sub(lambda m: m.group(1) + m.group(2) + MASCARA, valor)
+    if isinstance(valor, Mapping) or hasattr(valor, 'items'):
+        try:
+            return {chave: MASCARA if secreta(chave) else mascarar(item) for chave, item in valor.items()}
+        except Exception:
+            return valor
+    if isinstance(valor, (list, tuple)):
+        return type(valor)(mascarar(item) for item in valor)
+    return valor
+
+
+def campos(record):
+    """Campos estruturados do registro (passados via extra=)."""
+    return {chave: valor for chave, valor in vars(record).items() if chave not in _ATRIBUTOS_PADRAO}
+
+
+class FiltroSegredos(logging.Filter):
+    """Mascara senhas e tokens na mensagem, nos argumentos e nos campos extras."""
+
+    def filter(self, record):
+        if record.args:
+            record.args = mascarar(record.args) if isinstance(record.args, (tuple, Mapping)) else record.args
+        if isinstance(record.msg, str):
+            record.msg = mascarar(record.msg)
+        for chave, valor in campos(record).items():
+            setattr(record, chave, MASCARA if secreta(chave) else mascarar(valor))
+        return True
+
+
+class FiltroAmostragem(logging.Filter):
+    """Mantém só uma fração dos eventos DEBUG (os de alta frequência)."""
+
+    def __init__(self, taxa=1.0):
+        super().__init__()
+        self.taxa = taxa
+        self.descartados = 0
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.taxa >= 1.0 or random.random() < self.taxa:
+            return True
+        self.descartados += 1
+        return False
+
+
+class FilaRegistros(QueueHandler):
+    """QueueHandler que nunca espera: com a fila cheia o registro é descartado."""
+
+    def __init__(self, fila):
+        super().__init__(fila)
+        self.descartados = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.descartados += 1
+
+    def prepare(self, record):
+        # Resolve a mensagem agora (os argumentos podem mudar depois) e deixa
+        # a formatação, inclusive do traceback, para a thread do listener.
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class Formatador(logging.Formatter):
+    """Uma linha por registro: texto legível com chave=valor, ou JSON."""
+
+    def __init__(self, formato='texto'):
+        super().__init__()
+        self.formato = formato
+
+    def format(self, record):
+        extras = campos(record)
+        data = datetime.fromtimestamp(record.created).isoformat(sep=' ', timespec='milliseconds')
+        if self.formato == 'json':
+            dados = {'ts': data, 'nivel': record.levelname, 'logger': record.name, 'msg': record.getMessage(), **extras}
+            if record.exc_text:
+                dados['exc'] = record.exc_text
+            return json.dumps(dados, ensure_ascii=False, default=str)
+        linha = f"{data} {record.levelname:<7} {record.name}: {record.getMessage()}"
+        if extras:
+            linha += ' ' + ' '.join(f"{chave}={valor}" for chave, valor in extras.items())
+        if record.exc_text:
+            linha += '\n' + record.exc_text
+        return linha
+
+
+def niveis_por_modulo(texto):
+    """'chromebooks.sql=DEBUG,werkzeug=WARNING' -> {'chromebooks.sql': 'DEBUG', ...}"""
+    niveis = {}
+    for parte in (texto or '').split(','):
+        if '=' in parte:
+            nome, nivel = parte.split('=', 1)
+            niveis[nome.strip()] = nivel.strip().upper()
+    return niveis
+
+
+def configurar(nivel=None, formato=None, arquivo=None, amostra_debug=None, niveis=None, tamanho_fila=10000):
+    """Liga o logging em fila para o logger "chromebooks" (só na primeira chamada)."""
+    global _configuracao
+    with _lock:
+        if _configuracao is not None:
+            return _configuracao
+        nivel = (nivel or os.environ.get('CHROMEBOOKS_LOG_NIVEL', 'INFO')).upper()
+        formato = formato or os.environ.get('CHROMEBOOKS_LOG_FORMATO', 'texto')
+        arquivo = arquivo or os.environ.get('CHROMEBOOKS_LOG_ARQUIVO')
+        if amostra_debug is None:
+            amostra_debug = float(os.environ.get('CHROMEBOOKS_LOG_AMOSTRA_DEBUG', 0.1))
+        if niveis is None:
+            niveis = niveis_por_modulo(os.environ.get('CHROMEBOOKS_LOG_NIVEIS'))
+
+        saida = logging.FileHandler(arquivo, encoding='utf-8') if arquivo else logging.StreamHandler(sys.stderr)
+        saida.setFormatter(Formatador(formato))
+        fila = FilaRegistros(queue.Queue(maxsize=tamanho_fila))
+        amostragem = FiltroAmostragem(amostra_debug)
+        fila.addFilter(amostragem)
+        fila.addFilter(FiltroSegredos())
+
+        raiz = logging.getLogger(RAIZ)
+        raiz.setLevel(nivel)
+        raiz.addHandler(fila)
+        raiz.propagate = False
+        for nome, nivel_modulo in niveis.items():
+            logger = logging.getLogger(nome)
+            logger.setLevel(nivel_modulo)
+            if not nome.startswith(RAIZ):
+                # loggers de bibliotecas (werkzeug...) também passam pela fila
+                logger.addHandler(fila)
+                logger.propagate = False
+
+        ouvinte = QueueListener(fila.queue, saida, respect_handler_level=True)
+        ouvinte.start()
+        atexit.register(_parar)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=_reiniciar_no_filho)
+        _configuracao = {'fila': fila, 'amostragem': amostragem, 'ouvinte': ouvinte}
+        return _configuracao
+
+
+def _parar():
+    if _configuracao is not None:
+        _configuracao['ouvinte'].stop()
+
+
+def _reiniciar_no_filho():
+    """Após um fork (workers do gunicorn com --preload) a thread do listener não existe mais no filho."""
+    if _configuracao is None:
+        return
+    fila, antigo = _configuracao['fila'], _configuracao['ouvinte']
+    fila.queue = queue.Queue(maxsize=fila.queue.maxsize)
+    ouvinte = QueueListener(fila.queue, *antigo.handlers, respect_handler_level=antigo.respect_handler_level)
+    ouvinte.start()
+    _configuracao['ouvinte'] = ouvinte
+
+
+def estatisticas():
+    if _configuracao is None:
+        return None
+    return {
+        'nivel': logging.getLevelName(logging.getLogger(RAIZ).level),
+        'na_fila': _configuracao['fila'].queue.qsize(),
+        'descartados_fila_cheia': _configuracao['fila'].descartados,
+        'debug_descartados_amostragem': _configuracao['amostragem'].descartados,
+    }
@@ -0,0 +1,118 @@
+# senhas.py - Verificação de senhas fora da thread da requisição
+#
+# PBKDF2/scrypt são caros de propósito. Rodá-los num pool pequeno e limitado
+# impede que um pico de logins ocupe a CPU de todas as threads que atendem
+# empréstimos e devoluções.
+import hmac
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# Parâmetros atuais: hashes com outro método/custo são refeitos no próximo login
+METODO_HASH = os.environ.get('CHROMEBOOKS_METODO_HASH', 'scrypt:32768:8:1')
+PREFIXOS_HASH = ('pbkdf2:', 'scrypt:')
+
+
+class LoginLimitado(Exception):
+    """Tentativa recusada por excesso de logins (do usuário a partir de um endereço, ou no servidor todo)."""
+
+
+def _conferir(senha_db, senha_digitada):
+    if senha_db.startswith(PREFIXOS_HASH):
+        return check_password_hash(senha_db, senha_digitada)
+    # legado: senha gravada em texto simples
+    return hmac.compare_digest(senha_db.encode(), senha_digitada.encode())
+
+
+def precisa_rehash(senha_db):
+    return not senha_db.startswith(METODO_HASH + '$')
+
+
+class Tentativa:
+    sucesso = False
+
+
+class VerificadorSenhas:
+    """Pool limitado para hash/verificação de senhas, com limite de tentativas por usuário e endereço."""
+
+    def __init__(self, workers=2, max_pendentes=8, timeout=10.0, max_falhas=5, janela_falhas=300.0):
+        self.timeout = timeout
+        self.max_falhas = max_falhas
+        self.janela_falhas = janela_falhas
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='senhas')
+        self._vagas = threading.BoundedSemaphore(max_pendentes)
+        self._lock = threading.Lock()
+        self._em_andamento = set()
+        self._livre = threading.Condition(self._lock)
+        self._falhas = {}  # (usuário, endereço) -> instantes das falhas recentes
+        self.recusadas = 0
+
+    def _executar(self, funcao, *args):
+        if not self._vagas.acquire(timeout=self.timeout):
+            self.recusadas += 1
+            raise LoginLimitado("Muitos logins simultâneos. Tente novamente em instantes.")
+        try:
+            futuro = self._executor.submit(funcao, *args)
+        except Exception:
+            self._vagas.release()
+            raise
+        # a vaga só é liberada quando o hash termina de fato (mesmo após timeout)
+        futuro.add_done_callback(lambda _: self._vagas.release())
+        return futuro.result(timeout=self.timeout)
+
+    def conferir(self, senha_db, senha_digitada):
+        return self._executar(_conferir, senha_db or '', senha_digitada or '')
+
+    def gerar_hash(self, senha):
+        return self._executar(generate_password_hash, senha, METODO_HASH)
+
+    @contextmanager
+    def tentativa(self, username, endereco=None):
+        """Reserva o usuário durante a verificação e contabiliza falhas recentes.
+
+        As falhas contam por (usuário, endereço): quem erra a senha de outro
+        usuário só bloqueia a si mesmo. Verificações do mesmo usuário entram em
+        fila (um duplo envio do formulário espera a primeira); recusa
+        (LoginLimitado) se a vez não chega em ``timeout`` ou se o par excedeu
+        ``max_falhas`` na janela de tempo.
+        """
+        usuario = (username or '').strip().lower()
+        chave = (usuario, endereco or '')
+        with self._lock:
+            if not self._livre.wait_for(lambda: usuario not in self._em_andamento, timeout=self.timeout):
+                self.recusadas += 1
+                raise LoginLimitado("Muitos logins simultâneos. Tente novamente em instantes.")
+            falhas = self._falhas.get(chave)
+            agora = time.monotonic()
+            while falhas and agora - falhas[0] > self.janela_falhas:
+                falhas.popleft()
+            if falhas and len(falhas) >= self.max_falhas:
+                self.recusadas += 1
+                raise LoginLimitado("Muitas tentativas para este usuário. Aguarde alguns minutos.")
+            self._em_andamento.add(usuario)
+
+        tentativa = Tentativa()
+        try:
+            yield tentativa
+        finally:
+            with self._lock:
+                self._em_andamento.discard(usuario)
+                self._livre.notify_all()
+                if tentativa.sucesso:
+                    self._falhas.pop(chave, None)
+                else:
+                    self._falhas.setdefault(chave, deque()).append(time.monotonic())
+                    if len(self._falhas) > 1000:
+                        self._descartar_falhas_antigas()
+
+    def _descartar_falhas_antigas(self):
+        limite = time.monotonic() - self.janela_falhas
+        for chave in [c for c, f in self._falhas.items() if f[-1] < limite]:
+            del self._falhas[chave]
+
+    def fechar(self):
+        self._executor.shutdown(wait=False)
@@ -65,38 +65,110 @@ document.addEventListener("DOMContentLoaded", function () {
 });
 
 // ======================================================
-// 🧩 Devolução — carregar Chromebooks emprestados
+// 🔔 Inventário em tempo real (Server-Sent Events)
 // ======================================================
-async function carregarEmprestados() {
-  const lista = document.getElementById("lista-emprestados");
-  if (!lista) return;
+// Chama aoReceber(evento) a cada mudança no inventário. aoReconectar é chamado
+// quando a conexão volta (eventos podem ter sido perdidos), quando o servidor
+// avisa que outro worker alterou o banco ("recarregar") e, em navegadores sem
+// EventSource, a cada 30 segundos.
+function assinarInventario(aoReceber, aoReconectar) {
+  if (!window.EventSource) {
+    setInterval(aoReconectar, 30000);
+    return null;
+  }
+  const fonte = new EventSource("/api/eventos");
+  let jaConectou = false;
+  fonte.addEventListener("open", () => {
+    if (jaConectou) aoReconectar();
+    jaConectou = true;
+  });
+  fonte.addEventListener("inventario", (e) => {
+    const evento = JSON.parse(e.data);
+    if (evento.recarregar) aoReconectar();
+    else aoReceber(evento);
+  });
+  return fonte;
+}
 
-  lista.innerHTML =
-    "<div class='text-center text-muted py-3'>🔄 Carregando Chromebooks emprestados...</div>";
+// Aplica um evento a uma lista [{numero, carrinho, ...}]: mantém apenas os
+// chromebooks com o status desejado.
+function aplicarEventoInventario(lista, evento, statusDesejado) {
+  evento.itens.forEach((item) => {
+    const i = lista.findIndex((cb) => cb.numero === item.numero && cb.carrinho === item.carrinho);
+    if (i >= 0) lista.splice(i, 1);
+    if (item.status === statusDesejado) lista.push(item);
+  });
+  lista.sort((a, b) => a.carrinho.localeCompare(b.carrinho) || a.numero - b.numero);
+  return lista;
+}
 
-  try {
-    // Timeout para evitar travamento se o servidor demorar
-    const controller = new AbortController();
-    const timeout = setTimeout(() => controller.abort(), 6000);
+// ======================================================
+// 🔤 Autocompletar de aluno, turma e professor
+// ======================================================
+// Campos com data-autocompletar="aluno|turma|professor" ganham uma datalist
+// com os nomes já usados. Em alunos, data-turma-alvo="<id>" preenche a turma
+// (se estiver vazia) com a última turma do aluno escolhido.
+function ativarAutocompletar(campo) {
+  const tipo = campo.dataset.autocompletar;
+  const lista = document.createElement("datalist");
+  lista.id = `${campo.id || campo.name}-sugestoes`;
+  campo.after(lista);
+  campo.setAttribute("list", lista.id);
+  campo.setAttribute("autocomplete", "off");
+
+  let sugestoes = [];
+  let espera = null;
+  let ultimaConsulta = "";
+  campo.addEventListener("input", () => {
+    const escolhida = sugestoes.find((s) => s.nome === campo.value);
+    const alvo = campo.dataset.turmaAlvo && document.getElementById(campo.dataset.turmaAlvo);
+    if (escolhida && escolhida.turma && alvo && !alvo.value) alvo.value = escolhida.turma;
+
+    clearTimeout(espera);
+    const consulta = campo.value.trim();
+    if (!consulta || consulta === ultimaConsulta || escolhida) return;
+    espera = setTimeout(() => {
+      ultimaConsulta = consulta;
+      fetch(`/api/autocompletar/${tipo}?q=${encodeURIComponent(consulta)}`)
+        .then((resposta) => (resposta.ok ? resposta.json() : []))
+        .then((dados) => {
+          if (campo.value.trim() !== consulta) return; // já digitou outra coisa
+          sugestoes = dados;
+          lista.replaceChildren(...dados.map((s) => {
+            const opcao = document.createElement("option");
+            opcao.value = s.nome;
+            if (s.turma) opcao.label = `${s.nome} (${s.turma})`;
+            return opcao;
+          }));
+        })
+        .catch(() => {});
+    }, 120);
+  });
+}
 
-    const resposta = await fetch("/api/chromebooks_emprestados", {
-      signal: controller.signal,
-    });
-    clearTimeout(timeout);
+document.addEventListener("DOMContentLoaded", function () {
+  document.querySelectorAll("[data-autocompletar]").forEach(ativarAutocompletar);
+});
 
-    if (!resposta.ok) throw new Error("Falha ao buscar dados");
+// ======================================================
+// 🧩 Devolução — carregar Chromebooks emprestados
+// ======================================================
+let emprestados = [];
 
-    const dados = await resposta.json();
-    lista.innerHTML = "";
+function renderizarEmprestados() {
+  const lista = document.getElementById("lista-emprestados");
+  document.dispatchEvent(new CustomEvent("emprestados-atualizados", { detail: emprestados }));
+  if (!lista) return;
 
-    if (!Array.isArray(dados) || dados.length === 0) {
-      lista.innerHTML =
-        "<div class='alert alert-info text-center'>📭 Nenhum Chromebook emprestado no momento.</div>";
-      return;
-    }
+  if (emprestados.length === 0) {
+    lista.innerHTML =
+      "<div class='alert alert-info text-center'>📭 Nenhum Chromebook emprestado no momento.</div>";
+    return;
+  }
 
-    dados.forEach((cb) => {
-      lista.innerHTML += `
+  lista.innerHTML = emprestados
+    .map(
+      (cb) => `
         <div class="card p-3 mb-2 shadow-sm border-start border-primary border-3">
           <div class="d-flex justify-content-between align-items-center">
             <div>
@@ -112,13 +184,46 @@ async function carregarEmprestados() {
             </form>
           </div>
         </div>
-      `;
+      `
+    )
+    .join("");
+}
+
+async function carregarEmprestados() {
+  const lista = document.getElementById("lista-emprestados");
+  if (!lista) return;
+
+  lista.innerHTML =
+    "<div class='text-center text-muted py-3'>🔄 Carregando Chromebooks emprestados...</div>";
+
+  try {
+    // Timeout para evitar travamento se o servidor demorar
+    const controller = new AbortController();
+    const timeout = setTimeout(() => controller.abort(), 6000);
+
+    const resposta = await fetch("/api/chromebooks_emprestados", {
+      signal: controller.signal,
     });
+    clearTimeout(timeout);
+
+    if (!resposta.ok) throw new Error("Falha ao buscar dados");
+
+    const dados = await resposta.json();
+    emprestados = Array.isArray(dados) ? dados : [];
+    renderizarEmprestados();
   } catch (erro) {
     console.error("Erro ao carregar Chromebooks emprestados:", erro);
     lista.innerHTML =
       "<div class='alert alert-danger text-center'>❌ Erro ao carregar dados. Verifique a conexão.</div>";
+    document.dispatchEvent(new CustomEvent("emprestados-erro"));
   }
 }
 
-document.addEventListener("DOMContentLoaded", carregarEmprestados);
+document.addEventListener("DOMContentLoaded", function () {
+  if (!document.getElementById("lista-emprestados")) return;
+  carregarEmprestados();
+  assinarInventario((evento) => {
+    aplicarEventoInventario(emprestados, evento, "Emprestado");
+    renderizarEmprestados();
+  }, carregarEmprestados);
+});
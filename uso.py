@@ -0,0 +1,231 @@
+# uso.py - Tabelas de resumo (rollups) do uso dos chromebooks
+#
+# Cada linha gravada no histórico também soma nos resumos, na mesma
+# transação: por dia x turma, por dia x professor, por chromebook e por hora
+# do dia x professor. Os relatórios leem só os resumos, cujo tamanho depende
+# de dias, turmas e professores, e não do tamanho do histórico.
+#
+#   python uso.py reconstruir     (refaz os resumos a partir do histórico e dos arquivos)
+#   python uso.py relatorio [dias]
+from datetime import datetime
+
+EMPRESTIMO = 'Empréstimo'
+DEVOLUCAO = 'Devolução'
+
+TABELAS_USO = ('uso_turma_dia', 'uso_professor_dia', 'uso_chromebook', 'uso_hora')
+
+# Um evento por linha do histórico: o empréstimo conta no dia/hora em que
+# começou; a devolução, no dia/hora em que terminou, com a duração em minutos.
+# Mesma regra de evento() (usada na gravação incremental).
+SQL_EVENTOS = f'''
+    SELECT substr(data_emprestimo, 1, 10) AS dia, CAST(substr(data_emprestimo, 12, 2) AS INTEGER) AS hora,
+           COALESCE(turma, '') AS turma, COALESCE(professor, '') AS professor, chromebook_numero AS numero,
+           1 AS emprestimos, 0 AS devolucoes, 0 AS minutos, data_emprestimo AS data
+    FROM {{fonte}} WHERE tipo_acao = '{EMPRESTIMO}' AND data_emprestimo IS NOT NULL {{filtro}}
+    UNION ALL
+    SELECT substr(data_devolucao, 1, 10), CAST(substr(data_devolucao, 12, 2) AS INTEGER),
+           COALESCE(turma, ''), COALESCE(professor, ''), chromebook_numero,
+           0, 1, COALESCE(MAX(0, (strftime('%s', data_devolucao) - strftime('%s', data_emprestimo)) / 60), 0),
+           data_devolucao
+    FROM {{fonte}} WHERE tipo_acao = '{DEVOLUCAO}' AND data_devolucao IS NOT NULL {{filtro}}
+'''
+
+# (tabela, colunas da chave, expressões da chave sobre SQL_EVENTOS, colunas somadas)
+RESUMOS = (
+    ('uso_turma_dia', ('dia', 'turma'), ('dia', 'turma'), ('emprestimos', 'devolucoes', 'minutos')),
+    ('uso_professor_dia', ('dia', 'professor'), ('dia', 'professor'), ('emprestimos', 'devolucoes', 'minutos')),
+    ('uso_chromebook', ('chromebook_numero',), ('numero',), ('emprestimos', 'devolucoes', 'minutos')),
+    ('uso_hora', ('hora', 'professor'), ('hora', 'professor'), ('emprestimos', 'devolucoes')),
+)
+
+
+def criar_tabelas(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS uso_turma_dia (
+            dia TEXT NOT NULL,
+            turma TEXT NOT NULL,
+            emprestimos INTEGER NOT NULL DEFAULT 0,
+            devolucoes INTEGER NOT NULL DEFAULT 0,
+            minutos INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (dia, turma)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS uso_professor_dia (
+            dia TEXT NOT NULL,
+            professor TEXT NOT NULL,
+            emprestimos INTEGER NOT NULL DEFAULT 0,
+            devolucoes INTEGER NOT NULL DEFAULT 0,
+            minutos INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (dia, professor)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS uso_chromebook (
+            chromebook_numero INTEGER PRIMARY KEY,
+            emprestimos INTEGER NOT NULL DEFAULT 0,
+            devolucoes INTEGER NOT NULL DEFAULT 0,
+            minutos INTEGER NOT NULL DEFAULT 0,
+            ultimo_uso TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS uso_hora (
+            hora INTEGER NOT NULL,
+            professor TEXT NOT NULL,
+            emprestimos INTEGER NOT NULL DEFAULT 0,
+            devolucoes INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (hora, professor)
+        ) WITHOUT ROWID
+    ''')
+
+
+def _upsert(tabela, chave, somas, extra=()):
+    colunas = (*chave, *somas, *extra)
+    atualizacoes = [f"{coluna} = {coluna} + excluded.{coluna}" for coluna in somas]
+    atualizacoes += [f"{coluna} = MAX(COALESCE({coluna}, ''), excluded.{coluna})" for coluna in extra]
+    return (f"INSERT INTO {tabela} ({', '.join(colunas)}) {{valores}} "
+            f"ON CONFLICT ({', '.join(chave)}) DO UPDATE SET {', '.join(atualizacoes)}")
+
+
+def _minutos(inicio, fim):
+    try:
+        segundos = (datetime.fromisoformat(fim) - datetime.fromisoformat(inicio)).total_seconds()
+    except (TypeError, ValueError):
+        return 0
+    return max(0, int(segundos) // 60)
+
+
+def evento(linha):
+    """(dia, hora, turma, professor, numero, emprestimos, devolucoes, minutos, data) de uma linha
+    do histórico (ordem de COLUNAS_HISTORICO sem o id), ou None se ela não conta no uso."""
+    numero, _, _, turma, professor, data_emprestimo, data_devolucao, tipo_acao = linha
+    if tipo_acao == EMPRESTIMO and data_emprestimo:
+        data, emprestimos, devolucoes, minutos = data_emprestimo, 1, 0, 0
+    elif tipo_acao == DEVOLUCAO and data_devolucao:
+        data, emprestimos, devolucoes, minutos = data_devolucao, 0, 1, _minutos(data_emprestimo, data_devolucao)
+    else:
+        return None
+    try:
+        hora = int(data[11:13])
+    except ValueError:
+        hora = 0
+    return data[:10], hora, turma or '', professor or '', numero, emprestimos, devolucoes, minutos, data
+
+
+def acumular(cursor, linhas):
+    """Soma as linhas do histórico nos resumos, na transação corrente."""
+    totais = {tabela: {} for tabela in TABELAS_USO}
+    ultimo_uso = {}
+    for linha in linhas:
+        e = evento(linha)
+        if e is None:
+            continue
+        dia, hora, turma, professor, numero, emprestimos, devolucoes, minutos, data = e
+        for tabela, chave, valores in (
+            ('uso_turma_dia', (dia, turma), (emprestimos, devolucoes, minutos)),
+            ('uso_professor_dia', (dia, professor), (emprestimos, devolucoes, minutos)),
+            ('uso_chromebook', (numero,), (emprestimos, devolucoes, minutos)),
+            ('uso_hora', (hora, professor), (emprestimos, devolucoes)),
+        ):
+            atual = totais[tabela].get(chave)
+            totais[tabela][chave] = valores if atual is None else tuple(a + b for a, b in zip(atual, valores))
+        ultimo_uso[numero] = max(ultimo_uso.get(numero, ''), data)
+
+    for tabela, colunas_chave, _, somas in RESUMOS:
+        if not totais[tabela]:
+            continue
+        extra = ('ultimo_uso',) if tabela == 'uso_chromebook' else ()
+        sql = _upsert(tabela, colunas_chave, somas, extra).format(
+            valores=f"VALUES ({', '.join('?' * (len(colunas_chave) + len(somas) + len(extra)))})")
+        cursor.executemany(sql, [
+            (*chave, *valores, *((ultimo_uso[chave[0]],) if extra else ()))
+            for chave, valores in totais[tabela].items()
+        ])
+
+
+def somar_fonte(cursor, fonte='main.historico', filtro=''):
+    """Soma nos resumos todos os eventos de ``fonte`` (uma tabela de histórico) com uma varredura agrupada."""
+    eventos = SQL_EVENTOS.format(fonte=fonte, filtro=filtro)
+    for tabela, colunas_chave, expressoes, somas in RESUMOS:
+        extra = ('ultimo_uso',) if tabela == 'uso_chromebook' else ()
+        selecao = [*expressoes, *(f"SUM({coluna})" for coluna in somas), *(("MAX(data)",) if extra else ())]
+        cursor.execute(_upsert(tabela, colunas_chave, somas, extra).format(
+            valores=f"SELECT {', '.join(selecao)} FROM ({eventos}) WHERE true GROUP BY {', '.join(expressoes)}"))
+
+
+def limpar(cursor):
+    for tabela in TABELAS_USO:
+        cursor.execute(f"DELETE FROM {tabela}")
+
+
+def relatorio(conn, dias=30, limite=10, hoje=None):
+    """Uso nos últimos ``dias`` (turmas, professores, dias e horários) e por chromebook (total)."""
+    hoje = hoje or datetime.now().date().isoformat()
+    inicio = conn.execute("SELECT date(?, ?)", (hoje, f'-{max(int(dias), 1) - 1} days')).fetchone()[0]
+
+    def ranking(tabela, coluna):
+        return [
+            {coluna: nome, 'emprestimos': emprestimos, 'devolucoes': devolucoes,
+             'minutos_medios': round(minutos / devolucoes, 1) if devolucoes else None}
+            for nome, emprestimos, devolucoes, minutos in conn.execute(
+                f"SELECT {coluna}, SUM(emprestimos), SUM(devolucoes), SUM(minutos) FROM {tabela} "
+                f"WHERE dia >= ? GROUP BY {coluna} ORDER BY 2 DESC, 1 LIMIT ?", (inicio, limite))
+        ]
+
+    por_dia = conn.execute(
+        "SELECT dia, SUM(emprestimos), SUM(devolucoes) FROM uso_turma_dia WHERE dia >= ? GROUP BY dia ORDER BY dia",
+        (inicio,)
+    ).fetchall()
+    por_hora = conn.execute("SELECT hora, SUM(emprestimos) FROM uso_hora GROUP BY hora ORDER BY hora").fetchall()
+    professor_hora = conn.execute("""
+        SELECT professor, hora, emprestimos FROM uso_hora
+        WHERE emprestimos > 0 AND professor IN (
+            SELECT professor FROM uso_hora GROUP BY professor ORDER BY SUM(emprestimos) DESC LIMIT ?)
+        ORDER BY professor, hora
+    """, (limite,)).fetchall()
+    mais_usados = conn.execute("""
+        SELECT c.numero, c.carrinho, u.emprestimos, u.minutos, u.ultimo_uso
+        FROM uso_chromebook u JOIN chromebooks c ON c.numero = u.chromebook_numero
+        ORDER BY u.emprestimos DESC, c.numero LIMIT ?
+    """, (limite,)).fetchall()
+    nunca_usados = conn.execute("""
+        SELECT c.numero, c.carrinho FROM chromebooks c
+        LEFT JOIN uso_chromebook u ON u.chromebook_numero = c.numero
+        WHERE COALESCE(u.emprestimos, 0) = 0
+        ORDER BY c.carrinho, c.numero
+    """).fetchall()
+
+    horas = {}
+    for professor, hora, emprestimos in professor_hora:
+        horas.setdefault(professor, {})[hora] = emprestimos
+    return {
+        'periodo': {'inicio': inicio, 'fim': hoje, 'dias': int(dias)},
+        'turmas': ranking('uso_turma_dia', 'turma'),
+        'professores': ranking('uso_professor_dia', 'professor'),
+        'por_dia': [{'dia': dia, 'emprestimos': e, 'devolucoes': d} for dia, e, d in por_dia],
+        'por_hora': [{'hora': hora, 'emprestimos': e} for hora, e in por_hora],
+        'professor_por_hora': horas,
+        'chromebooks_mais_usados': [
+            {'numero': n, 'carrinho': c, 'emprestimos': e, 'minutos': m, 'ultimo_uso': u}
+            for n, c, e, m, u in mais_usados
+        ],
+        'chromebooks_nunca_usados': [{'numero': n, 'carrinho': c} for n, c in nunca_usados],
+    }
+
+
+if __name__ == '__main__':
+    import json
+    import sys
+    from database import Database
+
+    db = Database()
+    db.criar_tabelas()
+    comando = sys.argv[1] if len(sys.argv) > 1 else 'relatorio'
+    if comando == 'reconstruir':
+        print(f"✅ Resumos de uso reconstruídos a partir de {db.reconstruir_uso()} registros")
+    elif comando == 'relatorio':
+        print(json.dumps(db.relatorio_uso(int(sys.argv[2]) if len(sys.argv) > 2 else 30), ensure_ascii=False, indent=2))
+    else:
+        print("Uso: python uso.py [reconstruir|relatorio [dias]]")
+        sys.exit(2)